@@ -0,0 +1,174 @@
+# UAS-PDT/app/analytics.py
+# Query laporan analitik (tabel hasil ETL di analytics_db) untuk endpoint /analytics/*.
+# Paginasi memakai keyset pada kolom urutan laporan (cursor = nilai kunci baris terakhir).
+#
+# Jalur baca diatur lewat ANALYTICS_READ_PATH:
+# - 'fdw'    : lewat foreign table di library_db (postgres_fdw ke analytics_db). Filter,
+#              ORDER BY, dan LIMIT ditulis sebagai ekspresi sederhana (=, >=, <, AND/OR)
+#              supaya didorong ke analytics_db; yang dikirim balik hanya baris satu halaman.
+# - 'direct' : langsung ke analytics_db lewat pool ANALYTICS_* (db.analytics_conn), tanpa
+#              hop tambahan lewat coordinator Citus. Nama tabel dan kolomnya sama.
+# Bandingkan keduanya dengan benchmarks/bench_analytics_read_path.py.
+
+import base64
+import json
+import os
+from decimal import Decimal
+
+from db import pg_conn, analytics_conn
+
+ANALYTICS_PAGE_DEFAULT = int(os.getenv('ANALYTICS_PAGE_DEFAULT', '100'))
+ANALYTICS_PAGE_MAX = int(os.getenv('ANALYTICS_PAGE_MAX', '1000'))
+ANALYTICS_STREAM_ITERSIZE = int(os.getenv('ANALYTICS_STREAM_ITERSIZE', '1000')) # Baris per FETCH saat streaming NDJSON
+ANALYTICS_READ_PATH = os.getenv('ANALYTICS_READ_PATH', 'fdw')
+READ_PATHS = {"fdw": pg_conn, "direct": analytics_conn}
+
+# table   : tabel di analytics_db (foreign table dengan nama sama di library_db)
+# keys    : kolom urutan; kolom terakhir harus unik agar keyset stabil
+# filters : parameter query -> kondisi SQL (nilai selalu integer)
+REPORTS = {
+    "late_returns": {
+        "table": "late_returns",
+        "columns": ("log_id", "book_id", "user_id", "borrowed_at", "return_at", "returned_at", "late_days"),
+        "keys": ("late_days", "log_id"),
+        "descending": True,
+        "filters": {
+            "user_id": "user_id = %s",
+            "book_id": "book_id = %s",
+            "min_late_days": "late_days >= %s",
+        },
+    },
+    "books_summary": {
+        "table": "books_summary",
+        "columns": ("book_id", "total_review", "avg_rating", "total_borrowed"),
+        "keys": ("book_id",),
+        "descending": False,
+        "filters": {
+            "book_id": "book_id = %s",
+            "min_total_borrowed": "total_borrowed >= %s",
+            "min_total_review": "total_review >= %s",
+        },
+    },
+    "borrows_per_user": {
+        "table": "borrows_per_user",
+        "columns": ("user_id", "user_name", "total_borrows"),
+        "keys": ("total_borrows", "user_id"),
+        "descending": True,
+        "filters": {
+            "user_id": "user_id = %s",
+            "min_total_borrows": "total_borrows >= %s",
+        },
+    },
+}
+
+
+def read_conn(path=None):
+    # Context manager koneksi untuk jalur baca yang dipilih
+    path = path or ANALYTICS_READ_PATH
+    if path not in READ_PATHS:
+        raise ValueError(f"Unknown analytics read path: {path}")
+    return READ_PATHS[path]()
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(report, cursor):
+    # ValueError jika cursor tidak valid
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if len(values) != len(report["keys"]):
+            raise ValueError("wrong number of keys")
+        return [int(v) for v in values]
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def parse_filters(report, args):
+    # {nama_filter: int}; ValueError jika nilainya bukan integer
+    filters = {}
+    for name in report["filters"]:
+        value = args.get(name)
+        if value not in (None, ''):
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+    return filters
+
+
+def _keyset_condition(report, cursor_values):
+    # (a, b) setelah (x, y) ditulis sebagai a < x OR (a = x AND b < y); perbandingan ROW()
+    # tidak didorong ke server remote oleh postgres_fdw
+    op = "<" if report["descending"] else ">"
+    keys = report["keys"]
+    clauses, params = [], []
+    for i, key in enumerate(keys):
+        parts = [f"{k} = %s" for k in keys[:i]] + [f"{key} {op} %s"]
+        clauses.append("(" + " AND ".join(parts) + ")")
+        params.extend(cursor_values[:i + 1])
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def build_query(report, filters, cursor_values=None, limit=None):
+    conditions, params = [], []
+    for name, value in filters.items():
+        conditions.append(report["filters"][name])
+        params.append(value)
+    if cursor_values is not None:
+        condition, cursor_params = _keyset_condition(report, cursor_values)
+        conditions.append(condition)
+        params.extend(cursor_params)
+
+    direction = " DESC" if report["descending"] else ""
+    query = f"SELECT {', '.join(report['columns'])} FROM {report['table']}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + ", ".join(key + direction for key in report["keys"])
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def serialize_row(report, row):
+    item = {}
+    for column, value in zip(report["columns"], row):
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = float(value)
+        item[column] = value
+    return item
+
+
+def _cursor_for(report, item):
+    return encode_cursor(item[key] for key in report["keys"])
+
+
+def fetch_page(conn, report, filters, limit, cursor_values=None):
+    # Ambil limit + 1 baris untuk mengetahui apakah masih ada halaman berikutnya
+    query, params = build_query(report, filters, cursor_values, limit + 1)
+    cur = conn.cursor()
+    cur.execute(query, params)
+    items = [serialize_row(report, row) for row in cur.fetchall()]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = _cursor_for(report, items[-1])
+    return items, next_cursor
+
+
+def stream_ndjson(conn, report, filters, cursor_values=None, limit=None):
+    # Satu baris JSON per record, dibaca dari server-side cursor per ANALYTICS_STREAM_ITERSIZE
+    # baris, jadi memori aplikasi tidak bergantung pada ukuran laporan
+    query, params = build_query(report, filters, cursor_values, limit)
+    cur = conn.cursor(name=f"analytics_{report['table']}_stream")
+    cur.itersize = ANALYTICS_STREAM_ITERSIZE
+    try:
+        cur.execute(query, params)
+        for row in cur:
+            yield json.dumps(serialize_row(report, row)) + "\n"
+    finally:
+        cur.close()
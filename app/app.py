@@ -1,112 +1,58 @@
 # UAS-PDT/app/app.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import psycopg2
-from pymongo import MongoClient
-import redis
 from datetime import datetime, timedelta
 import os
+import time
 import json # Untuk menyimpan review sebagai array JSON di MongoDB
-import uuid # Untuk generate session token
+import csv
+
+# Koneksi ke PostgreSQL, MongoDB, dan Redis diambil dari pool bersama (lihat db.py)
+from db import get_pg_conn, put_pg_conn, pg_conn, get_mongo_client, get_redis_client, pool_stats
+# Middleware autentikasi: sesi {user_id, role} di Redis + cache lokal (lihat auth.py)
+# Cache ketersediaan buku di Redis dengan warm-up dan rekonsiliasi (lihat availability.py)
+import availability
+# Penyimpanan review (satu dokumen per review) dan statistiknya di MongoDB (lihat reviews.py)
+import reviews
+# Jalur async /books: Redis dan MongoDB bersamaan dengan timeout per store (lihat async_books.py)
+import async_books
+# Query laporan analitik dengan filter, keyset pagination, dan streaming (lihat analytics.py)
+import analytics
+# Cache respons JSON + ETag untuk katalog dan analitik (lihat response_cache.py)
+from response_cache import cached_response, bump_version, CATALOG, ANALYTICS
+# Counter pinjaman per user di Redis dan riwayat pinjaman (lihat user_loans.py)
+import user_loans
+# Index sekunder PG/MongoDB yang dibuat saat startup (lihat indexes.py)
+import indexes
+# Impor katalog lewat COPY dan peminjaman batch dalam satu transaksi (lihat bulk.py)
+import bulk
+# Histogram latensi route/query dan format Prometheus untuk /metrics (lihat metrics.py)
+import metrics
+from auth import login_required, admin_required, create_session, delete_session, get_request_token, update_user_role, session_cache
 
 app = Flask(__name__)
 
-# Konfigurasi Database dari environment variables
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
-MONGO_HOST = os.getenv('MONGO_HOST')
-MONGO_PORT = int(os.getenv('MONGO_PORT'))
-MONGO_USERNAME = os.getenv('MONGO_USERNAME')
-MONGO_PASSWORD = os.getenv('MONGO_PASSWORD')
-
-REDIS_HOST = os.getenv('REDIS_HOST')
-REDIS_PORT = int(os.getenv('REDIS_PORT'))
-
-ANALYTICS_HOST = os.getenv('ANALYTICS_HOST')
-ANALYTICS_PORT = os.getenv('ANALYTICS_PORT')
-ANALYTICS_DB = os.getenv('ANALYTICS_DB')
-ANALYTICS_USER = os.getenv('ANALYTICS_USER')
-ANALYTICS_PASSWORD = os.getenv('ANALYTICS_PASSWORD')
-
-# Koneksi ke PostgreSQL (Library DB)
-def get_pg_conn():
-    conn = psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD
-    )
-    return conn
-
-# Koneksi ke MongoDB
-def get_mongo_client():
-    client = MongoClient(
-        host=MONGO_HOST,
-        port=MONGO_PORT,
-        username=MONGO_USERNAME,
-        password=MONGO_PASSWORD
-    )
-    return client
-
-# Koneksi ke Redis
-def get_redis_client():
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
-    return r
-
-# --- Middleware Autentikasi (Contoh Sederhana) ---
-def authenticate_user(token):
-    r = get_redis_client()
-    user_id = r.get(f"session:{token}")
-    if user_id:
-        return int(user_id)
-    return None
-
-def authorize_role(user_id, required_role):
-    conn = get_pg_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT role FROM users WHERE user_id = %s", (user_id,))
-    user_role = cur.fetchone()
-    conn.close()
-    if user_role and user_role[0] == required_role:
-        return True
-    return False
-
-# Dekorator untuk endpoint yang membutuhkan otentikasi
-def login_required(f):
-    def wrapper(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({"message": "Authorization token missing"}), 401
-        token = token.replace('Bearer ', '')
-        user_id = authenticate_user(token)
-        if not user_id:
-            return jsonify({"message": "Invalid or expired token"}), 401
-        request.user_id = user_id # Tambahkan user_id ke objek request
-        return f(*args, **kwargs)
-    wrapper.__name__ = f.__name__ # Penting untuk Flask
-    return wrapper
-
-# Dekorator untuk endpoint yang membutuhkan role admin
-def admin_required(f):
-    def wrapper(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({"message": "Authorization token missing"}), 401
-        token = token.replace('Bearer ', '')
-        user_id = authenticate_user(token)
-        if not user_id:
-            return jsonify({"message": "Invalid or expired token"}), 401
-        if not authorize_role(user_id, 'admin'):
-            return jsonify({"message": "Forbidden: Admin access required"}), 403
-        request.user_id = user_id # Tambahkan user_id ke objek request
-        return f(*args, **kwargs)
-    wrapper.__name__ = f.__name__
-    return wrapper
+# Latensi setiap request per pola route (mis. /books/<int:book_id>/rating)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.record_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+@app.teardown_request
+def record_failed_request(exc):
+    # after_request dilewati saat terjadi exception yang tidak tertangani
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.record_request(route, request.method, 500, time.perf_counter() - started)
 
 # --- Endpoint API (Sesuai Laporan) ---
 
@@ -119,25 +65,21 @@ def login():
     if not email or not password:
         return jsonify({"message": "Email and password are required"}), 400
 
-    conn = get_pg_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, password FROM users WHERE email = %s", (email,))
-    user = cur.fetchone()
-    conn.close()
+    with pg_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT user_id, password, role FROM users WHERE email = %s", (email,))
+        user = cur.fetchone()
 
     if user and user[1] == password: # Implementasi hashing password di dunia nyata!
-        token = str(uuid.uuid4())
-        r = get_redis_client()
-        r.set(f"session:{token}", user[0], ex=3600) # Token berlaku 1 jam
+        # Role disimpan di sesi agar dekorator auth tidak perlu query ke PG lagi
+        token = create_session(user[0], user[2])
         return jsonify({"message": "Login successful", "token": token}), 200
     return jsonify({"message": "Invalid credentials"}), 401
 
 @app.route('/logout', methods=['POST'])
 @login_required
 def logout():
-    token = request.headers.get('Authorization').replace('Bearer ', '')
-    r = get_redis_client()
-    r.delete(f"session:{token}")
+    delete_session(get_request_token())
     return jsonify({"message": "Logout successful"}), 200
 
 @app.route('/register', methods=['POST'])
@@ -162,55 +104,161 @@ def register():
         conn.rollback()
         return jsonify({"message": "User with this email already exists"}), 409
     finally:
-        conn.close()
+        put_pg_conn(conn)
+
+@app.route('/users/<int:user_id>/role', methods=['PUT'])
+@admin_required # Hanya admin yang bisa mengubah role user
+def change_user_role(user_id):
+    data = request.get_json()
+    role = data.get('role')
+
+    if role not in ('admin', 'mahasiswa'):
+        return jsonify({"message": "Role must be 'admin' or 'mahasiswa'"}), 400
+
+    conn = get_pg_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE users SET role = %s WHERE user_id = %s", (role, user_id))
+        if cur.rowcount == 0:
+            conn.rollback()
+            return jsonify({"message": "User not found"}), 404
+        conn.commit()
+    finally:
+        put_pg_conn(conn)
+
+    # Sesi aktif user ikut diperbarui dan cache auth di semua worker diinvalidasi
+    update_user_role(user_id, role)
+    return jsonify({"message": "User role updated", "user_id": user_id, "role": role}), 200
+
+# Konfigurasi paginasi /books
+BOOKS_PAGE_DEFAULT = int(os.getenv('BOOKS_PAGE_DEFAULT', '50'))
+BOOKS_PAGE_MAX = int(os.getenv('BOOKS_PAGE_MAX', '200'))
+BOOKS_INLINE_REVIEWS = int(os.getenv('BOOKS_INLINE_REVIEWS', '10')) # Maksimal review terbaru per buku saat include=reviews
+BOOK_FIELDS = ("book_id", "title", "author", "year", "category", "quantity", "available_copies", "status")
+# 'sync' = PG, Redis, MongoDB berurutan lewat pool di db.py; 'async' = Redis dan MongoDB
+# bersamaan setelah PG dengan timeout per store (lihat async_books.py)
+BOOKS_FETCH_MODE = os.getenv('BOOKS_FETCH_MODE', 'sync')
+
+def fetch_books_page_sync(limit, cursor, with_availability, with_reviews):
+    with pg_conn() as conn_pg:
+        cur_pg = conn_pg.cursor()
+        # Ambil limit + 1 baris untuk mengetahui apakah masih ada halaman berikutnya
+        if cursor is None:
+            cur_pg.execute(
+                "SELECT book_id, title, author, year, category, quantity FROM books ORDER BY book_id LIMIT %s",
+                (limit + 1,)
+            )
+        else:
+            cur_pg.execute(
+                "SELECT book_id, title, author, year, category, quantity FROM books WHERE book_id > %s ORDER BY book_id LIMIT %s",
+                (cursor, limit + 1)
+            )
+        pg_books = cur_pg.fetchall()
+
+    next_cursor = None
+    if len(pg_books) > limit:
+        pg_books = pg_books[:limit]
+        next_cursor = pg_books[-1][0]
+    book_ids = [row[0] for row in pg_books]
+
+    # Satu MGET ke Redis untuk seluruh halaman (bukan satu GET per buku)
+    available_counts = []
+    if book_ids and with_availability:
+        available_counts = availability.get_available_counts(book_ids)
+
+    # Satu query $in ke MongoDB untuk seluruh halaman, hanya jika diminta
+    reviews_by_book = {}
+    if book_ids and with_reviews:
+        reviews_collection = reviews.get_reviews_collection(get_mongo_client())
+        reviews_by_book = reviews.latest_reviews(reviews_collection, book_ids, BOOKS_INLINE_REVIEWS)
+
+    return pg_books, next_cursor, available_counts, reviews_by_book, []
 
 # Contoh Endpoint /books (GET) - Menggabungkan data dari 3 DB
+# Query params:
+#   limit   - jumlah buku per halaman (default BOOKS_PAGE_DEFAULT, maks BOOKS_PAGE_MAX)
+#   cursor  - book_id terakhir dari halaman sebelumnya (keyset pagination)
+#   fields  - daftar kolom dipisah koma, mis. fields=book_id,title,status
+#   include - include=reviews untuk menyertakan review terbaru dari MongoDB
+# Jika Redis/MongoDB melewati timeout (mode async), respons berisi "degraded" dengan
+# store yang dilewati dan tidak di-cache.
 @app.route('/books', methods=['GET'])
 @login_required
+@cached_response(CATALOG)
 def get_all_books():
-    books_data = []
-    conn_pg = get_pg_conn()
-    cur_pg = conn_pg.cursor()
-    # Tambahkan kolom 'quantity' di SELECT
-    cur_pg.execute("SELECT book_id, title, author, year, category, quantity FROM books")
-    pg_books = cur_pg.fetchall()
-    conn_pg.close()
-
-    mongo_client = get_mongo_client()
-    reviews_collection = mongo_client.librarydb.reviews 
-
-    r = get_redis_client()
+    try:
+        limit = int(request.args.get('limit', BOOKS_PAGE_DEFAULT))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"message": "limit and cursor must be integers"}), 400
+    if limit < 1:
+        return jsonify({"message": "limit must be at least 1"}), 400
+    limit = min(limit, BOOKS_PAGE_MAX)
+
+    fields = request.args.get('fields')
+    if fields:
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in BOOK_FIELDS]
+        if unknown:
+            return jsonify({"message": f"Unknown fields: {', '.join(unknown)}"}), 400
+    else:
+        fields = list(BOOK_FIELDS)
+    include = {i.strip() for i in request.args.get('include', '').split(',') if i.strip()}
+
+    with_availability = "available_copies" in fields or "status" in fields
+    with_reviews = "reviews" in include
+    if BOOKS_FETCH_MODE == 'async':
+        try:
+            pg_books, next_cursor, available_counts, reviews_by_book, degraded = async_books.fetch_books_page(
+                limit, cursor, with_availability, with_reviews, BOOKS_INLINE_REVIEWS
+            )
+        except async_books.StoreTimeout as e:
+            return jsonify({"message": str(e)}), 504
+    else:
+        pg_books, next_cursor, available_counts, reviews_by_book, degraded = fetch_books_page_sync(
+            limit, cursor, with_availability, with_reviews
+        )
 
-    for book_id, title, author, year, category, quantity in pg_books: # Tambahkan 'quantity' di sini
+    books_data = []
+    for i, (book_id, title, author, year, category, quantity) in enumerate(pg_books):
         book_info = {
             "book_id": book_id,
             "title": title,
             "author": author,
             "year": year,
             "category": category,
-            "quantity": quantity # Tambahkan quantity ke respons
+            "quantity": quantity
         }
 
-        # --- Modifikasi untuk Status Ketersediaan (berdasarkan quantity atau Redis) ---
-        # Opsi 1: Status dari Redis (menyimpan jumlah tersedia)
-        # Jika Anda ingin Redis menyimpan jumlah tersedia untuk akses cepat
-        redis_available_count = r.get(f"book_available_count:{book_id}")
-        if redis_available_count is not None:
-             book_info["available_copies"] = int(redis_available_count)
-             book_info["status"] = "available" if int(redis_available_count) > 0 else "out of stock"
-        else:
-             # Fallback ke quantity dari PG jika tidak ada di Redis
-             book_info["available_copies"] = quantity
-             book_info["status"] = "available" if quantity > 0 else "out of stock"
-        # --- Akhir Modifikasi Status ---
+        # Status ketersediaan dari Redis, fallback ke quantity dari PG jika key belum ada
+        if available_counts:
+            available = available_counts[i] if available_counts[i] is not None else quantity
+            book_info["available_copies"] = available
+            book_info["status"] = "available" if available > 0 else "out of stock"
 
-        # Ambil review dari MongoDB (sama seperti sebelumnya)
-        mongo_doc = reviews_collection.find_one({"book_id": book_id}, {"_id": 0, "reviews": 1})
-        book_info["reviews"] = mongo_doc.get("reviews", []) if mongo_doc else []
+        book_info = {f: book_info[f] for f in fields if f in book_info}
+        if with_reviews and "reviews" not in degraded:
+            book_info["reviews"] = reviews_by_book.get(book_id, [])
 
         books_data.append(book_info)
 
-    return jsonify(books_data), 200
+    body = {"books": books_data, "next_cursor": next_cursor}
+    if degraded:
+        body["degraded"] = degraded
+        response = jsonify(body)
+        response.headers['X-Degraded'] = ','.join(degraded) # Jangan di-cache (lihat response_cache.py)
+        return response, 200
+    return jsonify(body), 200
+# Ringkasan rating satu buku tanpa mengirim array review (aggregation di MongoDB)
+@app.route('/books/<int:book_id>/rating', methods=['GET'])
+@login_required
+def get_book_rating(book_id):
+    reviews_collection = reviews.get_reviews_collection(get_mongo_client())
+    stats = reviews.review_stats(reviews_collection, [book_id]).get(book_id) or reviews.empty_stats(book_id)
+    stats.pop("last_review_at", None)
+    return jsonify(stats), 200
+
 # /books/<book_id>, /books (POST, PUT, DELETE), /review (POST, GET, PUT, DELETE)
 
 # --- Modifikasi Endpoint Peminjaman Buku ---
@@ -228,7 +276,6 @@ def borrow_book():
 
     conn_pg = get_pg_conn()
     cur_pg = conn_pg.cursor()
-    r = get_redis_client()
 
     try:
         try:
@@ -236,36 +283,53 @@ def borrow_book():
         except ValueError:
             return jsonify({"message": "Invalid return_at format. Use YYYY-MM-DD HH:MM:SS"}), 400
 
-        # 1. Cek kuantitas buku di PostgreSQL
-        cur_pg.execute("SELECT quantity FROM books WHERE book_id = %s FOR UPDATE", (book_id,)) # FOR UPDATE untuk mencegah race condition
-        book = cur_pg.fetchone()
+        # 0. Mode reservasi Redis: stok dikurangi dulu di Redis (Lua, atomik) sehingga
+        # permintaan untuk buku yang habis langsung ditolak tanpa menyentuh PG.
+        # Key yang belum ada (cold) diproses lewat PG seperti biasa.
+        reserved = False
+        if availability.reservation_enabled():
+            reservation = availability.reserve(book_id)
+            if reservation == availability.OUT_OF_STOCK:
+                return jsonify({"message": "Book is currently out of stock"}), 400
+            reserved = reservation == availability.RESERVED
+
+        # 1-3. Kurangi kuantitas (hanya jika masih ada) dan catat log peminjaman dalam satu
+        # panggilan fungsi borrow_book_atomic (lihat init.sql). Dengan autocommit, lock baris
+        # books hanya dipegang selama fungsi berjalan di server, tanpa round trip tambahan.
+        conn_pg.autocommit = True
+        try:
+            cur_pg.execute(
+                "SELECT status, log_id, remaining_quantity FROM borrow_book_atomic(%s, %s, %s)",
+                (book_id, current_user_id, return_at)
+            )
+            status, log_id, new_quantity = cur_pg.fetchone()
+        except Exception:
+            if reserved:
+                availability.release(book_id) # Kompensasi: kembalikan reservasi di Redis
+            raise
+
+        if status != 'ok' and reserved:
+            availability.release(book_id)
 
-        if book is None:
+        if status == 'not_found':
             return jsonify({"message": "Book not found"}), 404
-        
-        current_quantity = book[0]
 
-        if current_quantity <= 0:
+        if status == 'out_of_stock':
             return jsonify({"message": "Book is currently out of stock"}), 400
 
-        # 2. Kurangi kuantitas di PostgreSQL
-        new_quantity = current_quantity - 1
-        cur_pg.execute(
-            "UPDATE books SET quantity = %s WHERE book_id = %s",
-            (new_quantity, book_id)
-        )
-
-        # 3. Masukkan log peminjaman ke PostgreSQL
-        cur_pg.execute(
-            "INSERT INTO borrow_logs (book_id, user_id, borrowed_at, return_at) VALUES (%s, %s, CURRENT_TIMESTAMP, %s) RETURNING log_id",
-            (book_id, current_user_id, return_at)
-        )
-        log_id = cur_pg.fetchone()[0]
-        
-        conn_pg.commit() # Commit transaksi PG setelah semua update
-
-        # 4. Update jumlah tersedia di Redis (opsional, untuk cache ketersediaan cepat)
-        r.set(f"book_available_count:{book_id}", new_quantity)
+        # 4. Write-through ke cache ketersediaan di Redis. Kegagalan di sini tidak
+        # membatalkan peminjaman; selisihnya diperbaiki oleh reconciler.
+        # Pada mode reservasi, Redis sudah dikurangi di langkah 0.
+        if not reserved:
+            try:
+                availability.apply_delta(book_id, -1, new_quantity)
+            except Exception as e:
+                print(f"Error updating availability cache for book {book_id}: {e}")
+        try:
+            user_loans.apply_event(current_user_id, log_id, returned=False) # Counter pinjaman aktif + total user
+        except Exception as e:
+            print(f"Error updating loan counters for user {current_user_id}: {e}")
+        bump_version(CATALOG) # 5. Respons /books yang di-cache menjadi basi
 
         return jsonify({"message": "Book borrowed successfully", "log_id": log_id, "remaining_quantity": new_quantity}), 201
 
@@ -273,7 +337,86 @@ def borrow_book():
         conn_pg.rollback()
         return jsonify({"message": f"Error borrowing book: {str(e)}"}), 500
     finally:
-        conn_pg.close()
+        conn_pg.autocommit = False
+        put_pg_conn(conn_pg)
+
+# --- Endpoint Batch: impor katalog dan peminjaman banyak buku ---
+# Body JSON (array / {"books": [...]}), NDJSON, atau CSV; semua baris disimpan atau tidak
+# sama sekali, error per baris dilaporkan di "errors"
+@app.route('/books/bulk', methods=['POST'])
+@admin_required
+def bulk_create_books():
+    try:
+        records = bulk.request_records(request)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 415 if request.mimetype not in bulk.FORMATS else 400
+
+    with pg_conn() as conn_pg:
+        try:
+            inserted, errors = bulk.copy_books(conn_pg, records)
+            if errors:
+                conn_pg.rollback()
+                return jsonify({"message": "No books were inserted", "errors": errors}), 400
+            conn_pg.commit()
+        except (ValueError, csv.Error) as e:
+            # Body rusak di tengah stream (mis. encoding bukan UTF-8)
+            conn_pg.rollback()
+            return jsonify({"message": f"Invalid request body: {e}"}), 400
+        except psycopg2.Error as e:
+            conn_pg.rollback()
+            return jsonify({"message": f"Error inserting books: {str(e)}"}), 500
+
+    # Seed cache ketersediaan; jika gagal, /books memakai quantity PG sampai reconciler mengisinya
+    try:
+        availability.seed(inserted)
+    except Exception as e:
+        print(f"Error seeding availability cache for {len(inserted)} books: {e}")
+    bump_version(CATALOG) # Respons /books yang di-cache menjadi basi
+
+    return jsonify({
+        "message": "Books inserted successfully",
+        "inserted": len(inserted),
+        "book_ids": [book_id for book_id, _ in inserted],
+    }), 201
+
+# Body: {"items": [{"book_id", "return_at"?}], "return_at"?}. Semua item dipinjam dalam satu
+# transaksi; jika satu gagal, tidak ada yang dipinjam dan "results" menjelaskan per item.
+# Mode reservasi Redis tidak dipakai di sini: stok langsung diperiksa di PG.
+@app.route('/borrow/batch', methods=['POST'])
+@login_required
+def borrow_books_batch():
+    try:
+        items = bulk.parse_borrow_items(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    current_user_id = request.user_id
+
+    conn_pg = get_pg_conn()
+    try:
+        all_ok, results = bulk.borrow_batch(conn_pg, current_user_id, items)
+        if not all_ok:
+            conn_pg.rollback()
+            return jsonify({"message": "No books were borrowed", "results": results}), 400
+        conn_pg.commit()
+    except Exception as e:
+        conn_pg.rollback()
+        return jsonify({"message": f"Error borrowing books: {str(e)}"}), 500
+    finally:
+        put_pg_conn(conn_pg)
+
+    # Write-through ke Redis setelah commit, sama seperti /borrow (selisih diperbaiki reconciler)
+    try:
+        availability.apply_deltas([(r["book_id"], -1, r["remaining_quantity"]) for r in results])
+    except Exception as e:
+        print(f"Error updating availability cache for batch borrow: {e}")
+    try:
+        user_loans.apply_events(current_user_id, [r["log_id"] for r in results], returned=False)
+    except Exception as e:
+        print(f"Error updating loan counters for user {current_user_id}: {e}")
+    bump_version(CATALOG)
+
+    return jsonify({"message": "Books borrowed successfully", "results": results}), 201
 
 # --- Endpoint Review (MongoDB) ---
 @app.route('/review', methods=['POST'])
@@ -292,44 +435,46 @@ def add_review():
 
     user_id = request.user_id # Diambil dari dekorator @login_required
 
-    mongo_client = get_mongo_client()
-    reviews_collection = mongo_client.librarydb.reviews # Asumsi DB bernama 'librarydb'
+    reviews_collection = reviews.get_reviews_collection(get_mongo_client())
 
     try:
-        # Cek apakah ada dokumen untuk book_id ini
-        existing_doc = reviews_collection.find_one({"book_id": book_id})
-
-        new_review = {
-            "user_id": user_id,
-            "rating": rating,
-            "comment": comment,
-            "timestamp": datetime.now()
-        }
-
-        if existing_doc:
-            # Jika dokumen sudah ada, tambahkan review ke array 'reviews'
-            reviews_collection.update_one(
-                {"book_id": book_id},
-                {"$push": {"reviews": new_review}}
-            )
-            message = "Review added to existing book entry"
-        else:
-            # Jika dokumen belum ada, buat dokumen baru
-            reviews_collection.insert_one({
-                "book_id": book_id,
-                "reviews": [new_review]
-            })
-            message = "New book entry created with review"
-
-        return jsonify({"message": message, "review": new_review}), 201
+        # Satu insert per review (dokumen terpisah per review, lihat reviews.py)
+        new_review = reviews.add_review(reviews_collection, book_id, user_id, rating, comment)
+        reviews.invalidate_page_cache(get_redis_client(), book_id)
+        bump_version(CATALOG)
+        return jsonify({"message": "Review added successfully", "review": new_review}), 201
 
     except Exception as e:
         return jsonify({"message": f"Error adding review: {str(e)}"}), 500
-    finally:
-        mongo_client.close()
 
-# Anda juga mungkin ingin menambahkan endpoint GET untuk /review/<book_id>
-# dan PUT/DELETE untuk review di masa mendatang.
+# Daftar review satu buku, terbaru lebih dulu
+# Query params:
+#   limit  - jumlah review per halaman (default REVIEW_PAGE_DEFAULT, maks REVIEW_PAGE_MAX)
+#   cursor - next_cursor dari halaman sebelumnya
+# Halaman pertama dengan ukuran default dilayani dari cache Redis (diinvalidasi oleh add_review)
+@app.route('/review/<int:book_id>', methods=['GET'])
+@login_required
+def get_reviews(book_id):
+    try:
+        limit = int(request.args.get('limit', reviews.REVIEW_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({"message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"message": "limit must be at least 1"}), 400
+    limit = min(limit, reviews.REVIEW_PAGE_MAX)
+    cursor = request.args.get('cursor')
+
+    reviews_collection = reviews.get_reviews_collection(get_mongo_client())
+    try:
+        if not cursor and limit == reviews.REVIEW_PAGE_DEFAULT:
+            page = reviews.cached_first_page(get_redis_client(), reviews_collection, book_id)
+        else:
+            page = reviews.review_page(reviews_collection, book_id, limit, cursor)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(page), 200
+
+# PUT/DELETE untuk review bisa ditambahkan di masa mendatang.
 
 # --- Modifikasi Endpoint Pengembalian Buku ---
 @app.route('/return', methods=['POST'])
@@ -346,13 +491,14 @@ def return_book():
 
     conn_pg = get_pg_conn()
     cur_pg = conn_pg.cursor()
-    r = get_redis_client()
 
     try:
-        # 1. Cek log peminjaman di PostgreSQL
+        # 1. Cek log peminjaman di PostgreSQL. borrow_logs didistribusikan berdasarkan
+        # book_id (co-located dengan books), jadi filter book_id membuat seluruh transaksi
+        # ini dirutekan ke satu shard
         cur_pg.execute(
-            "SELECT user_id, book_id, return_at, returned_at FROM borrow_logs WHERE log_id = %s",
-            (log_id,)
+            "SELECT user_id, book_id, return_at, returned_at FROM borrow_logs WHERE book_id = %s AND log_id = %s",
+            (book_id, log_id)
         )
         borrow_log = cur_pg.fetchone()
 
@@ -367,8 +513,8 @@ def return_book():
 
         # 2. Update returned_at di PostgreSQL
         cur_pg.execute(
-            "UPDATE borrow_logs SET returned_at = CURRENT_TIMESTAMP WHERE log_id = %s",
-            (log_id,)
+            "UPDATE borrow_logs SET returned_at = CURRENT_TIMESTAMP WHERE book_id = %s AND log_id = %s",
+            (book_id, log_id)
         )
         
         # 3. Tambah kuantitas di PostgreSQL
@@ -380,8 +526,16 @@ def return_book():
         
         conn_pg.commit() # Commit transaksi PG
 
-        # 4. Update jumlah tersedia di Redis (opsional, untuk cache ketersediaan cepat)
-        r.set(f"book_available_count:{book_id}", new_quantity)
+        # 4. Write-through ke cache ketersediaan di Redis (lihat borrow_book)
+        try:
+            availability.apply_delta(book_id, 1, new_quantity)
+        except Exception as e:
+            print(f"Error updating availability cache for book {book_id}: {e}")
+        try:
+            user_loans.apply_event(current_user_id, int(log_id), returned=True)
+        except Exception as e:
+            print(f"Error updating loan counters for user {current_user_id}: {e}")
+        bump_version(CATALOG) # 5. Respons /books yang di-cache menjadi basi
 
         return jsonify({"message": "Book returned successfully", "remaining_quantity": new_quantity}), 200
 
@@ -389,32 +543,143 @@ def return_book():
         conn_pg.rollback()
         return jsonify({"message": f"Error returning book: {str(e)}"}), 500
     finally:
-        conn_pg.close()
+        put_pg_conn(conn_pg)
+
+# --- Endpoint Pinjaman Milik User ---
+# Pinjaman user yang sedang login (log_id + book_id untuk /return) dan counter live-nya
+# Query params:
+#   status - all (default), active, atau history
+#   limit  - jumlah pinjaman per halaman (default LOANS_PAGE_DEFAULT, maks LOANS_PAGE_MAX)
+#   cursor - next_cursor dari halaman sebelumnya
+@app.route('/me/loans', methods=['GET'])
+@login_required
+def get_my_loans():
+    status = request.args.get('status', 'all')
+    if status not in user_loans.LOAN_STATUSES:
+        return jsonify({"message": f"status must be one of: {', '.join(user_loans.LOAN_STATUSES)}"}), 400
+    try:
+        limit = int(request.args.get('limit', user_loans.LOANS_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({"message": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"message": "limit must be at least 1"}), 400
+    limit = min(limit, user_loans.LOANS_PAGE_MAX)
 
-# --- Endpoint Analitik (FDW ke analytics_db) ---
+    try:
+        with pg_conn() as conn:
+            loans, next_cursor = user_loans.loan_page(conn, request.user_id, status, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    counters = user_loans.get_counters([request.user_id])[request.user_id] # Fallback ke PG jika Redis gagal
+    return jsonify({**counters, "loans": loans, "next_cursor": next_cursor}), 200
+
+# --- Endpoint Analitik (analytics_db, lewat FDW atau langsung) ---
+# Query params (semua laporan):
+#   limit  - jumlah baris per halaman (default ANALYTICS_PAGE_DEFAULT, maks ANALYTICS_PAGE_MAX)
+#   cursor - next_cursor dari halaman sebelumnya (keyset pagination)
+#   format - format=ndjson untuk streaming semua baris yang cocok (satu JSON per baris);
+#            limit hanya berlaku jika diberikan
+#   filter per laporan, lihat REPORTS di analytics.py
+def analytics_report(name):
+    report = analytics.REPORTS[name]
+    try:
+        filters = analytics.parse_filters(report, request.args)
+        cursor = request.args.get('cursor')
+        cursor_values = analytics.decode_cursor(report, cursor) if cursor else None
+        limit = request.args.get('limit')
+        limit = int(limit) if limit else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if limit is not None and limit < 1:
+        return jsonify({"message": "limit must be at least 1"}), 400
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            # Koneksi dipegang selama streaming dan dikembalikan ke pool saat selesai/klien putus
+            with analytics.read_conn() as conn:
+                yield from analytics.stream_ndjson(conn, report, filters, cursor_values, limit)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    limit = min(limit or analytics.ANALYTICS_PAGE_DEFAULT, analytics.ANALYTICS_PAGE_MAX)
+    with analytics.read_conn() as conn: # FDW lewat library_db atau langsung ke analytics_db (ANALYTICS_READ_PATH)
+        items, next_cursor = analytics.fetch_page(conn, report, filters, limit, cursor_values)
+    return jsonify({name: items, "next_cursor": next_cursor}), 200
+
+# Filter: user_id, book_id, min_late_days; urut late_days terbesar lebih dulu
 @app.route('/analytics/late-returns', methods=['GET'])
 @admin_required
+@cached_response(ANALYTICS)
 def get_late_returns():
-    conn = get_pg_conn() # Koneksi ke library_db yang memiliki FDW ke analytics_db
-    cur = conn.cursor()
-    # Query ke foreign table late_returns
-    cur.execute("SELECT log_id, book_id, user_id, borrowed_at, return_at, returned_at, late_days FROM late_returns ORDER BY late_days DESC")
-    late_data = [
-        {
-            "log_id": row[0],
-            "book_id": row[1],
-            "user_id": row[2],
-            "borrowed_at": row[3].isoformat() if row[3] else None,
-            "return_at": row[4].isoformat() if row[4] else None,
-            "returned_at": row[5].isoformat() if row[5] else None,
-            "late_days": row[6]
-        } for row in cur.fetchall()
-    ]
-    conn.close()
-    return jsonify(late_data), 200
-
-# Endpoint analitik lainnya akan mengikuti pola serupa
-# /analytics/books-summary, /analytics/borrows-per-user
+    return analytics_report("late_returns")
+
+# Filter: book_id, min_total_borrowed, min_total_review; urut book_id
+@app.route('/analytics/books-summary', methods=['GET'])
+@admin_required
+@cached_response(ANALYTICS)
+def get_books_summary():
+    return analytics_report("books_summary")
+
+# Filter: user_id, min_total_borrows; urut total_borrows terbesar lebih dulu
+@app.route('/analytics/borrows-per-user', methods=['GET'])
+@admin_required
+@cached_response(ANALYTICS)
+def get_borrows_per_user():
+    return analytics_report("borrows_per_user")
+
+# --- Endpoint Health Check ---
+# Liveness: proses menerima request. Readiness: pool PG/Redis/MongoDB bisa dipakai dan
+# cache ketersediaan sudah di-warm-up (503 jika belum, agar load balancer menunggu)
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    return jsonify({"status": "ok"}), 200
+
+def _check_postgres():
+    with pg_conn() as conn:
+        conn.cursor().execute("SELECT 1")
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    checks = {}
+    for name, check in (
+        ("postgres", _check_postgres),
+        ("redis", lambda: get_redis_client().ping()),
+        ("mongo", lambda: get_mongo_client().admin.command('ping')),
+    ):
+        try:
+            check()
+            checks[name] = "ok"
+        except Exception as e:
+            checks[name] = f"error: {e}"
+    try:
+        checks["availability_cache"] = "ok" if availability.is_warm() else "cold"
+    except Exception as e:
+        checks["availability_cache"] = f"error: {e}"
+
+    ready = all(status == "ok" for status in checks.values())
+    return jsonify({"ready": ready, "checks": checks, "pools": pool_stats()}), 200 if ready else 503
+
+# --- Endpoint Monitoring Pool Koneksi ---
+@app.route('/stats/pools', methods=['GET'])
+@admin_required
+def get_pool_stats():
+    stats = pool_stats()
+    stats["auth_cache"] = session_cache.stats()
+    return jsonify(stats), 200
+
+@app.route('/stats/availability', methods=['GET'])
+@admin_required
+def get_availability_stats():
+    return jsonify(availability.stats()), 200
+
+# --- Endpoint Metrics (format teks Prometheus, gabungan semua proses) ---
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(metrics.collect()), mimetype='text/plain; version=0.0.4')
 
+# Server development Flask; di produksi gunakan Gunicorn (lihat gunicorn.conf.py)
 if __name__ == '__main__':
+    indexes.ensure_indexes()
+    availability.warm_up()
+    availability.start_reconciler()
+    metrics.start_publisher()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,170 @@
+# UAS-PDT/app/async_books.py
+# Jalur async untuk GET /books (BOOKS_FETCH_MODE=async): halaman buku diambil dari PG
+# lebih dulu, lalu ketersediaan (Redis) dan review (MongoDB) diambil bersamaan, sehingga
+# latensi = PG + max(Redis, MongoDB), bukan jumlah ketiganya.
+#
+# Driver async (asyncpg, motor, redis.asyncio) dan pool-nya hidup di satu event loop per
+# proses worker yang berjalan di thread latar belakang; thread request Flask (gthread)
+# mengirim coroutine ke loop itu dan menunggu hasilnya. Loop dibuat ulang jika proses
+# di-fork (pid berubah).
+#
+# Setiap store punya timeout sendiri dengan degradasi (error driver, mis. koneksi
+# ditolak, diperlakukan sama dengan timeout):
+# - PG lambat      -> StoreTimeout (halaman tidak bisa dibentuk tanpa PG)
+# - Redis lambat   -> available_copies/status dihitung dari quantity PG, 'availability' di degraded
+# - MongoDB lambat -> review dihilangkan, 'reviews' di degraded
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+import asyncpg
+import motor.motor_asyncio
+import redis.asyncio as aioredis
+
+import db
+import availability
+import metrics
+import reviews
+
+PG_TIMEOUT = float(os.getenv('BOOKS_PG_TIMEOUT', '2.0')) # detik
+REDIS_TIMEOUT = float(os.getenv('BOOKS_REDIS_TIMEOUT', '0.05'))
+MONGO_TIMEOUT = float(os.getenv('BOOKS_MONGO_TIMEOUT', '0.2'))
+# Pool asyncpg ini terpisah dari PgPool di db.py; keduanya dihitung dalam anggaran koneksi
+# per worker di gunicorn.conf.py
+ASYNC_PG_POOL_MAX = int(os.getenv('BOOKS_ASYNC_PG_POOL_MAX', '0')) or db.PG_POOL_MAX
+
+_lock = threading.Lock()
+_loop = None
+_loop_pid = None
+_clients = {}
+
+
+class StoreTimeout(Exception):
+    pass
+
+
+async def _init_clients():
+    _clients["pg"] = await asyncpg.create_pool(
+        host=db.POSTGRES_HOST, port=int(db.POSTGRES_PORT or 5432), database=db.POSTGRES_DB,
+        user=db.POSTGRES_USER, password=db.POSTGRES_PASSWORD,
+        min_size=min(db.PG_POOL_MIN, ASYNC_PG_POOL_MAX), max_size=ASYNC_PG_POOL_MAX
+    )
+    _clients["mongo"] = motor.motor_asyncio.AsyncIOMotorClient(
+        host=db.MONGO_HOST, port=db.MONGO_PORT,
+        username=db.MONGO_USERNAME, password=db.MONGO_PASSWORD,
+        minPoolSize=db.MONGO_POOL_MIN, maxPoolSize=db.MONGO_POOL_MAX,
+        waitQueueTimeoutMS=db.MONGO_POOL_TIMEOUT_MS,
+        event_listeners=db.MONGO_LISTENERS
+    )
+    _clients["redis"] = aioredis.Redis(
+        host=db.REDIS_HOST, port=db.REDIS_PORT, decode_responses=True,
+        max_connections=db.REDIS_POOL_MAX
+    )
+
+
+def _get_loop():
+    global _loop, _loop_pid
+    if _loop is not None and _loop_pid == os.getpid():
+        return _loop
+    with _lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="books-async-loop", daemon=True).start()
+            _clients.clear()
+            try:
+                asyncio.run_coroutine_threadsafe(_init_clients(), loop).result(timeout=PG_TIMEOUT * 5)
+            except Exception:
+                loop.call_soon_threadsafe(loop.stop)
+                raise
+            _loop, _loop_pid = loop, os.getpid()
+    return _loop
+
+
+async def _fetch_pg(limit, cursor):
+    pool = _clients["pg"]
+    # limit + 1 baris untuk mengetahui apakah masih ada halaman berikutnya
+    if cursor is None:
+        query, params = "SELECT book_id, title, author, year, category, quantity FROM books ORDER BY book_id LIMIT $1", (limit + 1,)
+    else:
+        query, params = "SELECT book_id, title, author, year, category, quantity FROM books WHERE book_id > $1 ORDER BY book_id LIMIT $2", (cursor, limit + 1)
+    # asyncpg tidak lewat cursor psycopg2, jadi diukur di sini (MongoDB sudah lewat listener)
+    started = time.perf_counter()
+    rows = await pool.fetch(query, *params)
+    operation, target, shape = metrics.sql_shape(query)
+    metrics.record_query("postgres", operation, target, time.perf_counter() - started, len(rows), shape)
+    return [tuple(row) for row in rows]
+
+
+async def _fetch_availability(keys):
+    started = time.perf_counter()
+    values = await _clients["redis"].mget(keys)
+    metrics.record_query("redis", "MGET", availability.KEY_PREFIX.rstrip(":"), time.perf_counter() - started, len(values))
+    return values
+
+
+async def _fetch_reviews(book_ids, per_book):
+    collection = reviews.get_reviews_collection(_clients["mongo"])
+    cursor = collection.aggregate(reviews.latest_reviews_pipeline(book_ids, per_book))
+    return {doc["_id"]: doc["reviews"] async for doc in cursor}
+
+
+async def _fetch_page(limit, cursor, with_availability, with_reviews, per_book):
+    try:
+        pg_books = await asyncio.wait_for(_fetch_pg(limit, cursor), PG_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise StoreTimeout("PostgreSQL did not respond in time")
+    except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+        # Koneksi ditolak/putus atau pool tertutup: ditangani sama seperti timeout
+        raise StoreTimeout(f"PostgreSQL is unavailable: {e}")
+
+    next_cursor = None
+    if len(pg_books) > limit:
+        pg_books = pg_books[:limit]
+        next_cursor = pg_books[-1][0]
+    book_ids = [row[0] for row in pg_books]
+
+    # Redis dan MongoDB bersamaan, masing-masing dengan timeout sendiri
+    tasks = {}
+    if book_ids and with_availability:
+        keys = [availability.cache_key(book_id) for book_id in book_ids]
+        tasks["availability"] = asyncio.wait_for(_fetch_availability(keys), REDIS_TIMEOUT)
+    if book_ids and with_reviews:
+        tasks["reviews"] = asyncio.wait_for(_fetch_reviews(book_ids, per_book), MONGO_TIMEOUT)
+    results = dict(zip(tasks, await asyncio.gather(*tasks.values(), return_exceptions=True)))
+
+    degraded = []
+    available_counts = []
+    if "availability" in results:
+        if isinstance(results["availability"], Exception):
+            degraded.append("availability")
+            available_counts = [None] * len(book_ids) # Fallback ke quantity dari PG
+        else:
+            available_counts = availability.parse_counts(results["availability"])
+    reviews_by_book = {}
+    if "reviews" in results:
+        if isinstance(results["reviews"], Exception):
+            degraded.append("reviews")
+        else:
+            reviews_by_book = results["reviews"]
+    return pg_books, next_cursor, available_counts, reviews_by_book, degraded
+
+
+def fetch_books_page(limit, cursor, with_availability, with_reviews, per_book):
+    # Dipanggil dari thread request (sinkron); hasil sama dengan jalur sinkron di app.py
+    # ditambah daftar store yang terdegradasi
+    try:
+        loop = _get_loop()
+    except Exception as e:
+        # Store belum bisa dihubungi saat membuat pool: diperlakukan sama dengan timeout (504)
+        raise StoreTimeout(f"Catalog stores are unavailable: {e}")
+    future = asyncio.run_coroutine_threadsafe(
+        _fetch_page(limit, cursor, with_availability, with_reviews, per_book), loop
+    )
+    try:
+        return future.result(timeout=PG_TIMEOUT + max(REDIS_TIMEOUT, MONGO_TIMEOUT) + 1)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise StoreTimeout("Catalog page did not complete in time")
@@ -0,0 +1,210 @@
+# UAS-PDT/app/auth.py
+# Lapisan autentikasi: sesi di Redis menyimpan {user_id, role}, ditambah cache
+# TTL/LRU kecil di memori proses agar request terautentikasi tidak perlu ke PG
+# dan biasanya juga tidak perlu ke Redis.
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify
+
+from db import pg_conn, get_redis_client
+
+SESSION_TTL = int(os.getenv('SESSION_TTL', '3600')) # Token berlaku 1 jam
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '30')) # detik sebelum token dicek ulang ke Redis
+INVALIDATION_CHANNEL = "auth:invalidate"
+
+
+class SessionCache:
+    # Cache LRU dengan TTL per entri: token -> (session, expires_at)
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._data[token]
+                self.misses += 1
+                return None
+            self._data.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, session):
+        # Entri lokal tidak boleh hidup lebih lama dari sesinya di Redis
+        expires_at = min(time.time() + self.ttl, session.get("exp", float("inf")))
+        with self._lock:
+            self._data[token] = (session, expires_at)
+            self._data.move_to_end(token)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, token):
+        with self._lock:
+            self._data.pop(token, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for token in [t for t, (sess, _) in self._data.items() if sess["user_id"] == user_id]:
+                del self._data[token]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+session_cache = SessionCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+_listener_lock = threading.Lock()
+_listener_started = False
+
+
+def _listen_invalidations():
+    # Pesan invalidasi dari proses/worker lain: "token:<token>" atau "user:<user_id>"
+    while True:
+        try:
+            pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                kind, _, value = message["data"].partition(":")
+                if kind == "token":
+                    session_cache.invalidate(value)
+                elif kind == "user":
+                    session_cache.invalidate_user(int(value))
+        except Exception:
+            # Koneksi Redis terputus: kosongkan cache lokal supaya tidak ada sesi basi, lalu subscribe ulang
+            session_cache.clear()
+            time.sleep(1)
+
+
+def _ensure_listener():
+    global _listener_started
+    if _listener_started:
+        return
+    with _listener_lock:
+        if not _listener_started:
+            threading.Thread(target=_listen_invalidations, name="auth-invalidation", daemon=True).start()
+            _listener_started = True
+
+
+def create_session(user_id, role):
+    token = str(uuid.uuid4())
+    session = {"user_id": user_id, "role": role, "exp": time.time() + SESSION_TTL}
+    r = get_redis_client()
+    pipe = r.pipeline()
+    pipe.set(f"session:{token}", json.dumps(session), ex=SESSION_TTL)
+    # Index token per user, dipakai saat role user berubah
+    pipe.sadd(f"user_sessions:{user_id}", token)
+    pipe.expire(f"user_sessions:{user_id}", SESSION_TTL)
+    pipe.execute()
+    return token
+
+
+def delete_session(token):
+    session = get_session(token)
+    r = get_redis_client()
+    pipe = r.pipeline()
+    pipe.delete(f"session:{token}")
+    if session:
+        pipe.srem(f"user_sessions:{session['user_id']}", token)
+    pipe.publish(INVALIDATION_CHANNEL, f"token:{token}")
+    pipe.execute()
+    session_cache.invalidate(token)
+
+
+def update_user_role(user_id, role):
+    # Tulis ulang semua sesi aktif milik user dengan role baru (TTL dipertahankan)
+    r = get_redis_client()
+    for token in r.smembers(f"user_sessions:{user_id}"):
+        raw = r.get(f"session:{token}")
+        if raw is None:
+            r.srem(f"user_sessions:{user_id}", token)
+            continue
+        session = json.loads(raw)
+        session["role"] = role
+        r.set(f"session:{token}", json.dumps(session), keepttl=True)
+    r.publish(INVALIDATION_CHANNEL, f"user:{user_id}")
+    session_cache.invalidate_user(user_id)
+
+
+def get_session(token):
+    _ensure_listener()
+    session = session_cache.get(token)
+    if session is not None:
+        return session
+
+    raw = get_redis_client().get(f"session:{token}")
+    if raw is None:
+        return None
+    try:
+        session = json.loads(raw)
+    except ValueError:
+        session = None
+    if not isinstance(session, dict):
+        # Format sesi lama hanya berisi user_id: lengkapi role sekali dari PG
+        try:
+            user_id = int(raw)
+        except (TypeError, ValueError):
+            return None # Nilai sesi rusak: perlakukan sebagai token tidak valid
+        with pg_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT role FROM users WHERE user_id = %s", (user_id,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        session = {"user_id": user_id, "role": row[0]}
+        get_redis_client().set(f"session:{token}", json.dumps(session), keepttl=True)
+    session_cache.put(token, session)
+    return session
+
+
+def get_request_token():
+    token = request.headers.get('Authorization')
+    if not token:
+        return None
+    return token.replace('Bearer ', '')
+
+
+def auth_required(role=None):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            token = get_request_token()
+            if not token:
+                return jsonify({"message": "Authorization token missing"}), 401
+            session = get_session(token)
+            if not session:
+                return jsonify({"message": "Invalid or expired token"}), 401
+            if role is not None and session["role"] != role:
+                return jsonify({"message": f"Forbidden: {role.capitalize()} access required"}), 403
+            request.user_id = session["user_id"] # Tambahkan user_id ke objek request
+            request.user_role = session["role"]
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Dekorator untuk endpoint yang membutuhkan otentikasi
+login_required = auth_required()
+
+# Dekorator untuk endpoint yang membutuhkan role admin
+admin_required = auth_required('admin')
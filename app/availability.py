@@ -0,0 +1,278 @@
+# UAS-PDT/app/availability.py
+# Cache ketersediaan buku di Redis (book_available_count:{book_id}).
+# - warm_up(): isi seluruh key dari books.quantity saat startup
+# - apply_delta()/apply_deltas(): write-through atomik setelah commit borrow/return
+# - seed(): isi key untuk buku baru dari POST /books/bulk dalam satu pipeline
+# - reserve()/release(): reservasi stok di Redis untuk judul populer (BORROW_RESERVATION_MODE=redis)
+# - reconciler: thread latar belakang yang membandingkan Redis dengan PG per batch
+#   dan memperbaiki selisih (drift)
+
+import os
+import threading
+import time
+
+from db import pg_conn, get_redis_client
+import metrics
+from response_cache import bump_version, CATALOG
+
+KEY_PREFIX = "book_available_count:"
+WARMUP_BATCH = int(os.getenv('AVAILABILITY_WARMUP_BATCH', '1000'))
+RECONCILE_BATCH = int(os.getenv('AVAILABILITY_RECONCILE_BATCH', '500'))
+RECONCILE_INTERVAL = float(os.getenv('AVAILABILITY_RECONCILE_INTERVAL', '60')) # detik, 0 = nonaktif
+RECONCILE_LOCK_KEY = "availability:reconcile_lock"
+WARMED_KEY = "availability:warmed_at" # Penanda warm-up selesai, dibaca oleh readiness check
+# Mode reservasi: 'redis' = stok dikurangi dulu di Redis sebelum menyentuh PG, 'pg' = langsung ke PG
+RESERVATION_MODE = os.getenv('BORROW_RESERVATION_MODE', 'pg')
+
+# Jika key ada: tambahkan delta (urutan commit yang bersamaan tidak masalah).
+# Jika key belum ada: isi dengan nilai terbaru dari PG.
+_APPLY_DELTA_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+redis.call('SET', KEYS[1], ARGV[2])
+return tonumber(ARGV[2])
+"""
+
+# Compare-and-set: perbaiki nilai hanya jika belum berubah sejak diamati
+_REPAIR_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] or (current == false and ARGV[1] == '') then
+    redis.call('SET', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Reservasi: -2 = key belum ada (cold), -1 = stok habis, selain itu sisa stok setelah dikurangi
+_RESERVE_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current == false then
+    return -2
+end
+if tonumber(current) <= 0 then
+    return -1
+end
+return redis.call('DECR', KEYS[1])
+"""
+
+# Kompensasi reservasi yang gagal disimpan di PG (key yang hilang dibiarkan, akan di-seed ulang)
+_RELEASE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+return -2
+"""
+
+RESERVED = "reserved"
+OUT_OF_STOCK = "out_of_stock"
+COLD = "cold"
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "hits": 0,
+    "misses": 0,
+    "writes": 0,
+    "reservations": 0,
+    "reservations_rejected": 0,
+    "reservations_released": 0,
+    "warmed_keys": 0,
+    "reconcile_runs": 0,
+    "reconcile_checked": 0,
+    "corrections": 0,
+    "last_reconcile_at": None,
+    "last_reconcile_seconds": None,
+}
+
+
+def _count(**deltas):
+    with _metrics_lock:
+        for name, value in deltas.items():
+            _metrics[name] += value
+
+
+def cache_key(book_id):
+    return f"{KEY_PREFIX}{book_id}"
+
+
+def get_available_counts(book_ids):
+    # Satu MGET untuk semua buku; None berarti key belum ada (cold)
+    if not book_ids:
+        return []
+    values = get_redis_client().mget([cache_key(book_id) for book_id in book_ids])
+    return parse_counts(values)
+
+
+def parse_counts(values):
+    # Hasil MGET -> int/None, sekaligus mencatat hit/miss (dipakai juga oleh async_books.py)
+    counts = [int(v) if v is not None else None for v in values]
+    misses = counts.count(None)
+    _count(hits=len(counts) - misses, misses=misses)
+    metrics.record_cache("book_available_count", len(counts) - misses, misses)
+    return counts
+
+
+def apply_delta(book_id, delta, pg_quantity):
+    r = get_redis_client()
+    value = r.eval(_APPLY_DELTA_LUA, 1, cache_key(book_id), delta, pg_quantity)
+    _count(writes=1)
+    return value
+
+
+def apply_deltas(changes):
+    # apply_delta untuk banyak buku sekaligus (POST /borrow/batch): [(book_id, delta, pg_quantity)]
+    pipe = get_redis_client().pipeline(transaction=False)
+    for book_id, delta, pg_quantity in changes:
+        pipe.eval(_APPLY_DELTA_LUA, 1, cache_key(book_id), delta, pg_quantity)
+    pipe.execute()
+    _count(writes=len(changes))
+
+
+def seed(quantities):
+    # [(book_id, quantity)] untuk buku yang baru dibuat, satu pipeline untuk semuanya
+    pipe = get_redis_client().pipeline(transaction=False)
+    for book_id, quantity in quantities:
+        pipe.set(cache_key(book_id), quantity)
+    pipe.execute()
+    _count(writes=len(quantities))
+
+
+def set_quantity(book_id, quantity):
+    get_redis_client().set(cache_key(book_id), quantity)
+    _count(writes=1)
+
+
+def reservation_enabled():
+    return RESERVATION_MODE == 'redis'
+
+
+def reserve(book_id):
+    # Kurangi stok secara atomik di Redis; permintaan tanpa stok ditolak tanpa menyentuh PG
+    result = get_redis_client().eval(_RESERVE_LUA, 1, cache_key(book_id))
+    if result == -2:
+        return COLD
+    if result == -1:
+        _count(reservations_rejected=1)
+        return OUT_OF_STOCK
+    _count(reservations=1)
+    return RESERVED
+
+
+def release(book_id):
+    get_redis_client().eval(_RELEASE_LUA, 1, cache_key(book_id))
+    _count(reservations_released=1)
+
+
+def warm_up():
+    # Baca books.quantity dengan server-side cursor dan tulis ke Redis lewat satu pipeline
+    r = get_redis_client()
+    pipe = r.pipeline(transaction=False)
+    warmed = 0
+    with pg_conn() as conn:
+        with conn.cursor(name="availability_warmup") as cur:
+            cur.itersize = WARMUP_BATCH
+            cur.execute("SELECT book_id, quantity FROM books")
+            for book_id, quantity in cur:
+                pipe.set(cache_key(book_id), quantity)
+                warmed += 1
+                if warmed % WARMUP_BATCH == 0:
+                    pipe.execute()
+        conn.rollback()
+    pipe.set(WARMED_KEY, time.time())
+    pipe.execute()
+    _count(warmed_keys=warmed)
+    return warmed
+
+
+def is_warm():
+    return get_redis_client().exists(WARMED_KEY) == 1
+
+
+def reconcile(suspects=None):
+    # Bandingkan Redis dengan PG per batch (keyset pada book_id). Selisih baru diperbaiki
+    # jika terlihat sama persis pada dua putaran berturut-turut, supaya write-through yang
+    # sedang berjalan (antara commit PG dan update Redis) tidak dianggap drift.
+    if suspects is None:
+        suspects = {}
+    started = time.monotonic()
+    r = get_redis_client()
+    new_suspects = {}
+    checked = corrections = 0
+    last_id = 0
+    while True:
+        with pg_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT book_id, quantity FROM books WHERE book_id > %s ORDER BY book_id LIMIT %s",
+                (last_id, RECONCILE_BATCH)
+            )
+            rows = cur.fetchall()
+            conn.rollback()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        cached = r.mget([cache_key(book_id) for book_id, _ in rows])
+        pipe = r.pipeline(transaction=False)
+        repairs = 0
+        for (book_id, quantity), value in zip(rows, cached):
+            checked += 1
+            if value is not None and int(value) == quantity:
+                continue
+            observed = (value, quantity)
+            if suspects.get(book_id) == observed:
+                pipe.eval(_REPAIR_LUA, 1, cache_key(book_id), value if value is not None else '', quantity)
+                repairs += 1
+            else:
+                new_suspects[book_id] = observed
+        if repairs:
+            corrections += sum(pipe.execute())
+    if corrections:
+        bump_version(CATALOG) # Respons /books yang di-cache memuat nilai lama
+    elapsed = time.monotonic() - started
+    with _metrics_lock:
+        _metrics["reconcile_runs"] += 1
+        _metrics["reconcile_checked"] += checked
+        _metrics["corrections"] += corrections
+        _metrics["last_reconcile_at"] = time.time()
+        _metrics["last_reconcile_seconds"] = round(elapsed, 3)
+    return new_suspects
+
+
+def _reconcile_loop():
+    suspects = {}
+    while True:
+        time.sleep(RECONCILE_INTERVAL)
+        try:
+            # Hanya satu worker yang menjalankan rekonsiliasi per interval
+            if not get_redis_client().set(RECONCILE_LOCK_KEY, os.getpid(), nx=True, ex=max(int(RECONCILE_INTERVAL), 1)):
+                continue
+            if not is_warm():
+                # Redis kehilangan data (mis. restart tanpa persistence): isi ulang semua key
+                warm_up()
+                suspects = {}
+                continue
+            suspects = reconcile(suspects)
+        except Exception as e:
+            print(f"Error during availability reconcile: {e}")
+
+
+_reconciler_started = False
+_reconciler_lock = threading.Lock()
+
+
+def start_reconciler():
+    global _reconciler_started
+    if RECONCILE_INTERVAL <= 0:
+        return
+    with _reconciler_lock:
+        if not _reconciler_started:
+            threading.Thread(target=_reconcile_loop, name="availability-reconciler", daemon=True).start()
+            _reconciler_started = True
+
+
+def stats():
+    with _metrics_lock:
+        result = dict(_metrics)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else None
+    return result
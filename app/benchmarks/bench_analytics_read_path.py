@@ -0,0 +1,150 @@
+# UAS-PDT/app/benchmarks/bench_analytics_read_path.py
+# Benchmark jalur baca endpoint /analytics/*: lewat postgres_fdw di library_db ('fdw')
+# dibandingkan koneksi langsung ke analytics_db ('direct'). Query yang dijalankan sama
+# persis dengan endpoint (analytics.fetch_page / analytics.stream_ndjson).
+#
+# Skenario:
+#   page   - halaman pertama laporan dengan filter min_* acak
+#   walk   - menelusuri beberapa halaman berturut-turut lewat next_cursor
+#   stream - membaca seluruh laporan lewat server-side cursor (mode NDJSON)
+#
+# Jalankan di dalam kontainer flask_app (setelah ETL mengisi analytics_db):
+#   python3 benchmarks/bench_analytics_read_path.py --workers 8 --requests 50
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import analytics
+import common
+
+
+def connect(path):
+    # fdw: lewat library_db, direct: langsung ke analytics_db
+    return common.connect("library" if path == "fdw" else "analytics")
+
+
+def scenario_page(conn, report, limit, pages):
+    filters = {name: random.randint(0, 3) for name in report["filters"] if name.startswith("min_")}
+    items, _ = analytics.fetch_page(conn, report, filters, limit)
+    conn.rollback()
+    return len(items)
+
+
+def scenario_walk(conn, report, limit, pages):
+    rows, cursor_values = 0, None
+    for _ in range(pages):
+        items, next_cursor = analytics.fetch_page(conn, report, {}, limit, cursor_values)
+        rows += len(items)
+        if not next_cursor:
+            break
+        cursor_values = analytics.decode_cursor(report, next_cursor)
+    conn.rollback()
+    return rows
+
+
+def scenario_stream(conn, report, limit, pages):
+    rows = sum(1 for _ in analytics.stream_ndjson(conn, report, {}))
+    conn.rollback()
+    return rows
+
+
+SCENARIOS = {"page": scenario_page, "walk": scenario_walk, "stream": scenario_stream}
+
+
+
+def remote_sql(report, limit):
+    # Query yang benar-benar dikirim postgres_fdw ke analytics_db, untuk memastikan
+    # WHERE/ORDER BY/LIMIT ikut didorong (bukan disortir di coordinator)
+    query, params = analytics.build_query(report, {}, None, limit)
+    conn = connect("fdw")
+    try:
+        cur = conn.cursor()
+        cur.execute("EXPLAIN (VERBOSE) " + query, params)
+        return [row[0].strip() for row in cur.fetchall() if "Remote SQL" in row[0]]
+    finally:
+        conn.close()
+
+
+def run(path, scenario, report, workers, requests, limit, pages):
+    func = SCENARIOS[scenario]
+    latencies = []
+    rows = [0]
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(workers + 1)
+
+    def worker():
+        conn = connect(path)
+        local = []
+        local_rows = 0
+        try:
+            start_barrier.wait()
+            for _ in range(requests):
+                t0 = time.perf_counter()
+                try:
+                    local_rows += func(conn, report, limit, pages)
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                local.append(time.perf_counter() - t0)
+        finally:
+            conn.close()
+            with lock:
+                latencies.extend(local)
+                rows[0] += local_rows
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "path": path,
+        "scenario": scenario,
+        "report": report["table"],
+        "workers": workers,
+        **common.summarize(latencies, len(errors), elapsed, rows=rows[0], rows_per_sec=round(rows[0] / elapsed, 1) if elapsed else None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FDW and direct analytics_db read paths")
+    parser.add_argument("--report", default="late_returns", choices=sorted(analytics.REPORTS))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="requests per worker")
+    parser.add_argument("--limit", type=int, default=analytics.ANALYTICS_PAGE_DEFAULT)
+    parser.add_argument("--pages", type=int, default=5, help="pages per request in the walk scenario")
+    parser.add_argument("--paths", default="fdw,direct")
+    parser.add_argument("--scenarios", default="page,walk,stream")
+    args = parser.parse_args()
+
+    report = analytics.REPORTS[args.report]
+    results = []
+    for scenario in args.scenarios.split(','):
+        for path in args.paths.split(','):
+            results.append(run(path.strip(), scenario.strip(), report, args.workers, args.requests, args.limit, args.pages))
+
+    print(json.dumps({
+        "benchmark": "analytics_read_path",
+        "fdw_remote_sql": remote_sql(report, args.limit) if "fdw" in args.paths else None,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# UAS-PDT/app/benchmarks/bench_borrow_contention.py
+# Benchmark peminjaman pada satu buku "populer" dengan banyak peminjam bersamaan.
+# Membandingkan jalur lama (SELECT ... FOR UPDATE + UPDATE + INSERT, 3 round trip
+# selama lock dipegang) dengan fungsi borrow_book_atomic (satu panggilan).
+#
+# Jalankan di dalam kontainer flask_app:
+#   python3 benchmarks/bench_borrow_contention.py --workers 64 --borrows 20
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from common import connect, summarize
+
+
+def borrow_legacy(conn, book_id, user_id, return_at):
+    cur = conn.cursor()
+    cur.execute("SELECT quantity FROM books WHERE book_id = %s FOR UPDATE", (book_id,))
+    quantity = cur.fetchone()[0]
+    if quantity <= 0:
+        conn.rollback()
+        return False
+    cur.execute("UPDATE books SET quantity = %s WHERE book_id = %s", (quantity - 1, book_id))
+    cur.execute(
+        "INSERT INTO borrow_logs (book_id, user_id, borrowed_at, return_at) VALUES (%s, %s, CURRENT_TIMESTAMP, %s) RETURNING log_id",
+        (book_id, user_id, return_at)
+    )
+    cur.fetchone()
+    conn.commit()
+    return True
+
+
+def borrow_atomic(conn, book_id, user_id, return_at):
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("SELECT status FROM borrow_book_atomic(%s, %s, %s)", (book_id, user_id, return_at))
+    return cur.fetchone()[0] == 'ok'
+
+
+MODES = {"legacy": borrow_legacy, "atomic": borrow_atomic}
+
+
+def run_mode(mode, book_id, user_id, workers, borrows):
+    borrow = MODES[mode]
+    return_at = datetime.now(timezone.utc) + timedelta(days=7)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(workers + 1)
+
+    def worker():
+        conn = connect()
+        local = []
+        try:
+            start_barrier.wait()
+            for _ in range(borrows):
+                t0 = time.perf_counter()
+                try:
+                    borrow(conn, book_id, user_id, return_at)
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                local.append(time.perf_counter() - t0)
+        finally:
+            conn.close()
+            with lock:
+                latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    return {"mode": mode, "workers": workers, **summarize(latencies, len(errors), elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark borrow path on a single hot book")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--borrows", type=int, default=20, help="borrows per worker")
+    parser.add_argument("--modes", default="legacy,atomic")
+    args = parser.parse_args()
+
+    conn = connect()
+    cur = conn.cursor()
+    # Buku dan user khusus benchmark; stok cukup untuk semua peminjaman
+    total = args.workers * args.borrows
+    cur.execute(
+        "INSERT INTO books (title, author, year, category, quantity) VALUES ('Benchmark Hot Title', 'bench', 2024, 'Benchmark', %s) RETURNING book_id",
+        (total * len(args.modes.split(',')),)
+    )
+    book_id = cur.fetchone()[0]
+    cur.execute("SELECT user_id FROM users ORDER BY user_id LIMIT 1")
+    user_id = cur.fetchone()[0]
+    conn.commit()
+
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            results.append(run_mode(mode.strip(), book_id, user_id, args.workers, args.borrows))
+    finally:
+        cur.execute("DELETE FROM borrow_logs WHERE book_id = %s", (book_id,))
+        cur.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
+        conn.commit()
+        conn.close()
+
+    print(json.dumps({"benchmark": "borrow_contention", "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# UAS-PDT/app/benchmarks/bench_shard_routing.py
+# Benchmark routing shard Citus untuk query yang dipakai /borrow, /return, dan ETL.
+# Untuk setiap query dicatat jumlah task Citus (EXPLAIN "Task Count": 1 = satu shard,
+# > 1 = fan-out ke banyak shard) dan latensi eksekusinya; ditambah siklus borrow +
+# return penuh seperti yang dijalankan app.py.
+#
+# Jalankan sebelum dan sesudah migrations/005_colocate_borrow_logs.sql lalu bandingkan:
+#   python3 benchmarks/bench_shard_routing.py --iterations 200 --label before > before.json
+#   python3 benchmarks/bench_shard_routing.py --iterations 200 --label after > after.json
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from common import connect, summarize
+
+# (nama, query, dieksekusi saat benchmark latensi); parameter: book_id, log_id, user_id
+QUERIES = [
+    ("borrow_update_books", "UPDATE books SET quantity = quantity - 1 WHERE book_id = %(book_id)s AND quantity > 0", False),
+    ("borrow_insert_log", "INSERT INTO borrow_logs (book_id, user_id, return_at) VALUES (%(book_id)s, %(user_id)s, CURRENT_TIMESTAMP)", False),
+    ("return_lookup_by_log_id", "SELECT user_id, book_id, return_at, returned_at FROM borrow_logs WHERE log_id = %(log_id)s", True),
+    ("return_lookup_by_book_and_log_id", "SELECT user_id, book_id, return_at, returned_at FROM borrow_logs WHERE book_id = %(book_id)s AND log_id = %(log_id)s", True),
+    ("count_borrows_per_book", "SELECT COUNT(*) FROM borrow_logs WHERE book_id = %(book_id)s", True),
+    ("join_books_borrow_logs", "SELECT b.title, COUNT(*) FROM books b JOIN borrow_logs bl ON bl.book_id = b.book_id WHERE b.book_id = %(book_id)s GROUP BY b.title", True),
+    ("join_users_borrow_logs", "SELECT u.email, COUNT(*) FROM users u JOIN borrow_logs bl ON bl.user_id = u.user_id WHERE bl.book_id = %(book_id)s GROUP BY u.email", True),
+]
+
+
+def distribution(cur):
+    cur.execute(
+        """
+        SELECT table_name::text, citus_table_type, distribution_column, colocation_id, shard_count
+        FROM citus_tables WHERE table_name IN ('books'::regclass, 'borrow_logs'::regclass, 'users'::regclass)
+        """
+    )
+    return {row[0]: {"type": row[1], "distribution_column": row[2], "colocation_id": row[3], "shard_count": row[4]} for row in cur.fetchall()}
+
+
+def task_count(conn, query, params):
+    # Jumlah seluruh "Task Count" di plan; None jika Citus menolak query (mis. join non co-located)
+    cur = conn.cursor()
+    try:
+        cur.execute("EXPLAIN " + query, params)
+        counts = [int(m.group(1)) for row in cur.fetchall() for m in [re.search(r"Task Count: (\d+)", row[0])] if m]
+        return sum(counts) if counts else 0, None
+    except psycopg2.Error as e:
+        return None, str(e).strip()
+    finally:
+        conn.rollback()
+
+
+def time_query(conn, query, params, iterations):
+    cur = conn.cursor()
+    latencies = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        cur.execute(query, params)
+        cur.fetchall()
+        latencies.append(time.perf_counter() - t0)
+    conn.rollback()
+    return summarize(latencies)
+
+
+def borrow_return_cycle(conn, params, iterations):
+    # Sama dengan app.py: borrow_book_atomic dengan autocommit, lalu return dalam satu transaksi
+    return_at = datetime.now(timezone.utc) + timedelta(days=7)
+    cur = conn.cursor()
+    latencies = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        conn.autocommit = True
+        cur.execute("SELECT status, log_id FROM borrow_book_atomic(%s, %s, %s)", (params["book_id"], params["user_id"], return_at))
+        status, log_id = cur.fetchone()
+        conn.autocommit = False
+        if status != 'ok':
+            raise RuntimeError(f"Benchmark borrow failed: {status}")
+        cur.execute(
+            "SELECT user_id, book_id, return_at, returned_at FROM borrow_logs WHERE book_id = %s AND log_id = %s",
+            (params["book_id"], log_id)
+        )
+        cur.fetchone()
+        cur.execute("UPDATE borrow_logs SET returned_at = CURRENT_TIMESTAMP WHERE book_id = %s AND log_id = %s", (params["book_id"], log_id))
+        cur.execute("UPDATE books SET quantity = quantity + 1 WHERE book_id = %s", (params["book_id"],))
+        conn.commit()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Citus shard routing for borrow/return and per-book queries")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--label", help="label stored in the output (e.g. before/after)")
+    args = parser.parse_args()
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO books (title, author, year, category, quantity) VALUES ('Benchmark Routing Title', 'bench', 2024, 'Benchmark', 1) RETURNING book_id"
+    )
+    book_id = cur.fetchone()[0]
+    cur.execute("SELECT user_id FROM users ORDER BY user_id LIMIT 1")
+    user_id = cur.fetchone()[0]
+    cur.execute(
+        "INSERT INTO borrow_logs (book_id, user_id, return_at, returned_at) VALUES (%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP) RETURNING log_id",
+        (book_id, user_id)
+    )
+    log_id = cur.fetchone()[0]
+    conn.commit()
+    params = {"book_id": book_id, "log_id": log_id, "user_id": user_id}
+
+    try:
+        queries = []
+        for name, query, timed in QUERIES:
+            tasks, error = task_count(conn, query, params)
+            result = {"query": name, "tasks": tasks, "single_shard": tasks == 1, "error": error}
+            if timed and error is None:
+                result.update(time_query(conn, query, params, args.iterations))
+            queries.append(result)
+        cycle = borrow_return_cycle(conn, params, args.iterations)
+        dist = distribution(cur)
+        conn.rollback()
+    finally:
+        conn.autocommit = False
+        cur.execute("DELETE FROM borrow_logs WHERE book_id = %s", (book_id,))
+        cur.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
+        conn.commit()
+        conn.close()
+
+    print(json.dumps({
+        "benchmark": "shard_routing",
+        "label": args.label,
+        "distribution": dist,
+        "queries": queries,
+        "borrow_return_cycle": cycle,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# UAS-PDT/app/benchmarks/common.py
+# Helper bersama untuk skrip benchmark: koneksi langsung ke PostgreSQL (tanpa pool
+# aplikasi, satu koneksi per worker) dan ringkasan latensi p50/p95/p99.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import db
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def connect(target="library"):
+    # 'library' = library_db (Citus coordinator), 'analytics' = analytics_db
+    if target == "analytics":
+        return psycopg2.connect(
+            host=db.ANALYTICS_HOST, port=db.ANALYTICS_PORT, database=db.ANALYTICS_DB,
+            user=db.ANALYTICS_USER, password=db.ANALYTICS_PASSWORD
+        )
+    return psycopg2.connect(
+        host=db.POSTGRES_HOST, port=db.POSTGRES_PORT, database=db.POSTGRES_DB,
+        user=db.POSTGRES_USER, password=db.POSTGRES_PASSWORD
+    )
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors=None, elapsed=None, **extra):
+    # Latensi dalam detik -> jumlah operasi, p50/p95/p99 (ms), dan jika diberikan: jumlah
+    # error, durasi total, dan throughput; extra ditambahkan apa adanya
+    latencies = sorted(latencies)
+    result = {"operations": len(latencies)}
+    if errors is not None:
+        result["errors"] = errors
+    if elapsed is not None:
+        result["seconds"] = round(elapsed, 3)
+        result["throughput_ops"] = round(len(latencies) / elapsed, 1) if elapsed else None
+    for key, p in zip(LATENCY_KEYS, (50, 95, 99)):
+        result[key] = round(percentile(latencies, p) * 1000, 3) if latencies else None
+    result.update(extra)
+    return result
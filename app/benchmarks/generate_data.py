@@ -0,0 +1,214 @@
+# UAS-PDT/app/benchmarks/generate_data.py
+# Generator data sintetis untuk benchmark (lihat run_suite.py): N buku, M user,
+# K borrow_logs, dan R review, dimuat dengan COPY (PG) dan insert_many (MongoDB).
+#
+# Data sintetis diberi penanda sehingga bisa dihapus tanpa menyentuh data asli:
+#   books.category = 'bench-generated' (hanya dipakai skrip ini; judul sementara benchmark
+#   lain memakai 'Benchmark'), users.email = bench-user-{i}@bench.local (password 'bench'),
+#   review_items.source = 'bench'
+# Setiap kali dijalankan, data sintetis sebelumnya dihapus dulu; dengan --seed yang sama
+# hasilnya identik. Cache ketersediaan Redis di-warm-up ulang di akhir.
+#
+# Jalankan di dalam kontainer flask_app:
+#   python3 benchmarks/generate_data.py --books 10000 --users 1000 --borrows 100000 --reviews 50000
+#   python3 benchmarks/generate_data.py --clean    # hanya hapus data sintetis
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import availability
+import user_loans
+import reviews
+from common import connect
+from response_cache import bump_version, CATALOG, ANALYTICS
+
+GENERATED_CATEGORY = "bench-generated"
+BENCH_EMAIL_DOMAIN = "bench.local"
+BENCH_PASSWORD = "bench"
+REVIEW_SOURCE = "bench"
+COPY_CHUNK = 50000 # baris per COPY
+REVIEW_BATCH = 10000
+CATEGORIES = ("Fiksi", "Sains", "Sejarah", "Teknologi", "Filsafat", "Ekonomi", "Bahasa", "Seni")
+LOAN_DAYS = 14
+HISTORY_DAYS = 365
+
+
+def bench_email(i):
+    return f"bench-user-{i}@{BENCH_EMAIL_DOMAIN}"
+
+
+def bench_user_ids(cur):
+    cur.execute("SELECT user_id FROM users WHERE email LIKE %s ORDER BY user_id", (f"%@{BENCH_EMAIL_DOMAIN}",))
+    return [row[0] for row in cur.fetchall()]
+
+
+def bench_book_ids(cur):
+    cur.execute("SELECT book_id FROM books WHERE category = %s ORDER BY book_id", (GENERATED_CATEGORY,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _copy(cur, table, columns, rows):
+    # COPY per potongan COPY_CHUNK baris agar memori tetap kecil; NULL ditulis sebagai \N
+    buffer, count = io.StringIO(), 0
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    for row in rows:
+        buffer.write("\t".join("\\N" if v is None else str(v) for v in row) + "\n")
+        count += 1
+        if count % COPY_CHUNK == 0:
+            buffer.seek(0)
+            cur.copy_expert(statement, buffer)
+            buffer = io.StringIO()
+    if count % COPY_CHUNK:
+        buffer.seek(0)
+        cur.copy_expert(statement, buffer)
+    return count
+
+
+def clean(conn):
+    cur = conn.cursor()
+    user_ids = bench_user_ids(cur)
+    book_ids = bench_book_ids(cur)
+    # borrow_logs didistribusikan per book_id: hapus per buku sintetis (dan log user sintetis di buku lain).
+    # Log user asli di buku sintetis ikut terhapus, jadi counter pinjaman semua pemilik log
+    # dihapus (dimuat ulang dari PG saat dibaca), bukan hanya milik user sintetis
+    condition = "book_id = ANY(%s) OR user_id = ANY(%s)"
+    cur.execute(f"SELECT DISTINCT user_id FROM borrow_logs WHERE {condition}", (book_ids, user_ids))
+    loan_user_ids = {row[0] for row in cur.fetchall()} | set(user_ids)
+    cur.execute(f"DELETE FROM borrow_logs WHERE {condition}", (book_ids, user_ids))
+    cur.execute("DELETE FROM books WHERE category = %s", (GENERATED_CATEGORY,))
+    cur.execute("DELETE FROM users WHERE email LIKE %s", (f"%@{BENCH_EMAIL_DOMAIN}",))
+    conn.commit()
+
+    reviews.get_reviews_collection(db.get_mongo_client()).delete_many({"source": REVIEW_SOURCE})
+    r = db.get_redis_client()
+    keys = [availability.cache_key(book_id) for book_id in book_ids]
+    keys += [key for user_id in sorted(loan_user_ids) for key in user_loans.counter_keys(user_id)]
+    for i in range(0, len(keys), 1000):
+        r.delete(*keys[i:i + 1000])
+    return {"books": len(book_ids), "users": len(user_ids)}
+
+
+def generate(conn, books, users, borrows, review_count, seed):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    cur = conn.cursor()
+    timings = {}
+
+    # 1. Users (reference table)
+    started = time.monotonic()
+    _copy(cur, "users", ("email", "password", "role"), ((bench_email(i), BENCH_PASSWORD, "mahasiswa") for i in range(users)))
+    conn.commit()
+    user_ids = bench_user_ids(cur)
+    timings["users"] = round(time.monotonic() - started, 3)
+
+    # 2. Borrow logs disusun dulu per indeks buku, agar quantity buku = eksemplar - pinjaman aktif
+    copies = [rng.randint(1, 10) for _ in range(books)]
+    open_loans = [0] * books
+    logs = []
+    for _ in range(borrows):
+        book = rng.randrange(books)
+        borrowed_at = now - timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400))
+        return_at = borrowed_at + timedelta(days=LOAN_DAYS)
+        returned_at = None
+        # ~20% masih dipinjam (jika eksemplar masih ada), sisanya dikembalikan; ~15% terlambat
+        if rng.random() >= 0.2 or open_loans[book] >= copies[book]:
+            late = rng.random() < 0.15
+            returned_at = return_at + timedelta(days=rng.randint(1, 30)) if late else borrowed_at + timedelta(days=rng.randint(0, LOAN_DAYS))
+            returned_at = min(returned_at, now)
+        else:
+            open_loans[book] += 1
+        logs.append((book, rng.choice(user_ids), borrowed_at, return_at, returned_at))
+
+    # 3. Books: COPY dalam satu sesi, book_id SERIAL urut sesuai urutan baris
+    started = time.monotonic()
+    _copy(cur, "books", ("title", "author", "year", "category", "quantity"), (
+        (f"Benchmark Title {i}", f"bench-author-{rng.randrange(max(1, books // 10))}", rng.randint(1950, 2024), GENERATED_CATEGORY, copies[i] - open_loans[i])
+        for i in range(books)
+    ))
+    conn.commit()
+    book_ids = bench_book_ids(cur)
+    timings["books"] = round(time.monotonic() - started, 3)
+
+    started = time.monotonic()
+    _copy(cur, "borrow_logs", ("book_id", "user_id", "borrowed_at", "return_at", "returned_at"), (
+        (book_ids[book], user_id, borrowed_at.isoformat(), return_at.isoformat(), returned_at.isoformat() if returned_at else None)
+        for book, user_id, borrowed_at, return_at, returned_at in logs
+    ))
+    conn.commit()
+    timings["borrow_logs"] = round(time.monotonic() - started, 3)
+
+    # 4. Review di MongoDB (satu dokumen per review)
+    started = time.monotonic()
+    collection = reviews.get_reviews_collection(db.get_mongo_client())
+    batch = []
+    for _ in range(review_count):
+        batch.append({
+            "book_id": rng.choice(book_ids),
+            "user_id": rng.choice(user_ids),
+            "rating": rng.choices((1, 2, 3, 4, 5), weights=(5, 10, 20, 35, 30))[0],
+            "comment": f"bench review {rng.randrange(1000)}",
+            "timestamp": (now - timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400))).replace(tzinfo=None),
+            "source": REVIEW_SOURCE,
+        })
+        if len(batch) == REVIEW_BATCH:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    timings["reviews"] = round(time.monotonic() - started, 3)
+
+    # 5. Statistik planner, cache ketersediaan, dan cache respons
+    conn.autocommit = True
+    for table in ("users", "books", "borrow_logs"):
+        cur.execute(f"ANALYZE {table}")
+    conn.autocommit = False
+    started = time.monotonic()
+    availability.warm_up()
+    timings["availability_warm_up"] = round(time.monotonic() - started, 3)
+    bump_version(CATALOG)
+    bump_version(ANALYTICS)
+    return {
+        "books": len(book_ids),
+        "users": len(user_ids),
+        "borrow_logs": len(logs),
+        "open_loans": sum(open_loans),
+        "reviews": review_count,
+        "seconds": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic books, users, borrow_logs and reviews for benchmarks")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--borrows", type=int, default=100000)
+    parser.add_argument("--reviews", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--clean", action="store_true", help="only remove previously generated data")
+    args = parser.parse_args()
+    if not args.clean and (args.books < 1 or args.users < 1):
+        parser.error("--books and --users must be at least 1")
+
+    conn = connect()
+    try:
+        removed = clean(conn)
+        result = {"removed": removed}
+        if not args.clean:
+            result["generated"] = generate(conn, args.books, args.users, args.borrows, args.reviews, args.seed)
+            result["seed"] = args.seed
+    finally:
+        conn.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+# UAS-PDT/app/benchmarks/run_suite.py
+# Suite benchmark yang bisa diulang untuk API dan ETL, dijalankan terhadap stack
+# docker-compose lokal setelah data sintetis dibuat dengan generate_data.py.
+#
+# Skenario:
+#   catalog_first_page  GET /books halaman pertama (jalur yang paling sering di-cache)
+#   catalog_walk        GET /books mengikuti next_cursor dari posisi acak
+#   catalog_reviews     GET /books?include=reviews (PG + Redis + MongoDB)
+#   login_storm         POST /login bersamaan untuk user sintetis
+#   borrow_contention   POST /borrow bersamaan pada satu judul dengan stok terbatas
+#   etl_<job>           setiap fungsi run_etl_* (ditemukan lewat run_etl.discover_jobs), rebuild penuh
+# Setiap skenario menghasilkan p50/p95/p99 (ms), throughput, dan jumlah error dalam JSON.
+#
+# Jalankan di dalam kontainer flask_app:
+#   python3 benchmarks/generate_data.py --books 10000 --users 1000 --borrows 100000 --reviews 50000
+#   python3 benchmarks/run_suite.py run --label before --output before.json
+#   python3 benchmarks/run_suite.py run --label after --output after.json
+#   python3 benchmarks/run_suite.py compare before.json after.json --threshold 10
+# compare keluar dengan kode 1 jika ada regresi (latensi naik atau throughput turun
+# melebihi threshold persen), sehingga bisa dipakai sebagai gate.
+
+import argparse
+import http.client
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "etl_scripts"))
+
+import db
+import availability
+import user_loans
+from response_cache import bump_version, CATALOG
+import generate_data
+from common import connect, summarize, LATENCY_KEYS
+
+BASE_URL = os.getenv('BENCH_BASE_URL', 'http://localhost:5000')
+API_SCENARIOS = ("catalog_first_page", "catalog_walk", "catalog_reviews", "login_storm", "borrow_contention")
+
+
+class Client:
+    # Satu koneksi HTTP keep-alive per thread worker
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self._conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.token = None
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            self._conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self._conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self._conn.close() # Koneksi dibuka ulang otomatis pada request berikutnya
+            raise
+        return response.status, json.loads(data) if data else None
+
+    def login(self, email, password):
+        status, body = self.request("POST", "/login", {"email": email, "password": password})
+        if status != 200:
+            raise RuntimeError(f"Login failed for {email}: {status} {body}")
+        self.token = body["token"]
+
+    def close(self):
+        self._conn.close()
+
+
+def run_workers(workers, requests, setup, operation):
+    # setup(worker_index) -> state; operation(state, i) -> hasil (mis. status HTTP) yang
+    # dihitung per jenis, exception = error. Semua worker
+    # mulai bersamaan (barrier) dan yang diukur hanya operation, bukan setup.
+    latencies, errors, outcomes = [], [], {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers + 1)
+
+    def worker(index):
+        local, local_errors, local_outcomes = [], 0, {}
+        try:
+            state = setup(index)
+        except Exception:
+            state = None
+        barrier.wait()
+        if state is None:
+            with lock:
+                errors.append(requests) # Setup gagal (mis. login): semua request worker ini gagal
+            return
+        for i in range(requests):
+            t0 = time.perf_counter()
+            try:
+                outcome = operation(state, i)
+            except Exception:
+                local_errors += 1
+                continue
+            local.append(time.perf_counter() - t0)
+            local_outcomes[outcome] = local_outcomes.get(outcome, 0) + 1
+        if state.get("client"):
+            state["client"].close()
+        with lock:
+            latencies.extend(local)
+            errors.append(local_errors)
+            for outcome, count in local_outcomes.items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    return latencies, sum(errors), time.perf_counter() - started, outcomes
+
+
+def _bench_users(cur):
+    user_ids = generate_data.bench_user_ids(cur)
+    if not user_ids:
+        raise SystemExit("No synthetic users found; run benchmarks/generate_data.py first")
+    return user_ids
+
+
+def _logged_in(base_url, user_index):
+    client = Client(base_url)
+    client.login(generate_data.bench_email(user_index), generate_data.BENCH_PASSWORD)
+    return client
+
+
+def scenario_catalog_first_page(ctx):
+    def operation(state, i):
+        status, _ = state["client"].request("GET", "/books?limit=50")
+        if status != 200:
+            raise RuntimeError(status)
+        return status
+    return _catalog(ctx, operation)
+
+
+def scenario_catalog_walk(ctx):
+    book_ids = ctx["book_ids"]
+
+    def operation(state, i):
+        # Mulai dari buku acak lalu ikuti next_cursor sebanyak --pages halaman
+        cursor = state["rng"].choice(book_ids)
+        for _ in range(ctx["pages"]):
+            status, body = state["client"].request("GET", "/books?" + urlencode({"limit": 50, "cursor": cursor}))
+            if status != 200:
+                raise RuntimeError(status)
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        return status
+    return _catalog(ctx, operation, pages=ctx["pages"])
+
+
+def scenario_catalog_reviews(ctx):
+    book_ids = ctx["book_ids"]
+
+    def operation(state, i):
+        cursor = state["rng"].choice(book_ids)
+        status, _ = state["client"].request("GET", "/books?" + urlencode({"limit": 20, "cursor": cursor, "include": "reviews"}))
+        if status != 200:
+            raise RuntimeError(status)
+        return status
+    return _catalog(ctx, operation)
+
+
+def _catalog(ctx, operation, **extra):
+    def setup(index):
+        return {"client": _logged_in(ctx["base_url"], index % ctx["users"]), "rng": random.Random(ctx["seed"] + index)}
+    latencies, errors, elapsed, outcomes = run_workers(ctx["workers"], ctx["requests"], setup, operation)
+    return summarize(latencies, errors, elapsed, status=outcomes, **extra)
+
+
+def scenario_login_storm(ctx):
+    def setup(index):
+        return {"client": Client(ctx["base_url"]), "index": index}
+
+    def operation(state, i):
+        user_index = (state["index"] * ctx["requests"] + i) % ctx["users"]
+        status, _ = state["client"].request("POST", "/login", {
+            "email": generate_data.bench_email(user_index), "password": generate_data.BENCH_PASSWORD
+        })
+        if status != 200:
+            raise RuntimeError(status)
+        return status
+    latencies, errors, elapsed, outcomes = run_workers(ctx["workers"], ctx["requests"], setup, operation)
+    return summarize(latencies, errors, elapsed, status=outcomes)
+
+
+def scenario_borrow_contention(ctx):
+    # Satu judul dengan stok separuh total permintaan: separuh berhasil (201), sisanya
+    # ditolak karena stok habis (400), keduanya dihitung sebagai operasi yang sah
+    total = ctx["workers"] * ctx["requests"]
+    copies = max(1, total // 2)
+    conn = connect()
+    cur = conn.cursor()
+    # Kategori 'Benchmark' (bukan milik generate_data): judul ini dihapus sendiri di akhir
+    cur.execute(
+        "INSERT INTO books (title, author, year, category, quantity) VALUES ('Benchmark Hot Title', 'bench', 2024, 'Benchmark', %s) RETURNING book_id",
+        (copies,)
+    )
+    book_id = cur.fetchone()[0]
+    conn.commit()
+    availability.set_quantity(book_id, copies)
+    return_at = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+
+    def setup(index):
+        return {"client": _logged_in(ctx["base_url"], index % ctx["users"])}
+
+    def operation(state, i):
+        status, _ = state["client"].request("POST", "/borrow", {"book_id": book_id, "return_at": return_at})
+        if status not in (201, 400):
+            raise RuntimeError(status)
+        return status
+
+    try:
+        latencies, errors, elapsed, outcomes = run_workers(ctx["workers"], ctx["requests"], setup, operation)
+        cur.execute("SELECT quantity, (SELECT COUNT(*) FROM borrow_logs WHERE book_id = %s) FROM books WHERE book_id = %s", (book_id, book_id))
+        quantity, logged = cur.fetchone()
+        conn.rollback()
+    finally:
+        # Hapus judul dan pinjamannya; counter pinjaman user sintetis dimuat ulang dari PG
+        cur.execute("SELECT DISTINCT user_id FROM borrow_logs WHERE book_id = %s", (book_id,))
+        user_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM borrow_logs WHERE book_id = %s", (book_id,))
+        cur.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
+        conn.commit()
+        conn.close()
+        r = db.get_redis_client()
+        r.delete(availability.cache_key(book_id), *[key for user_id in user_ids for key in user_loans.counter_keys(user_id)])
+        bump_version(CATALOG)
+    # Konsistensi: tidak boleh ada peminjaman melebihi stok
+    return summarize(latencies, errors, elapsed, status=outcomes, copies=copies, remaining=quantity, oversold=logged > copies)
+
+
+def etl_scenarios():
+    import run_etl
+    return {f"etl_{name}": func for name, (func, _) in run_etl.discover_jobs().items()}
+
+
+def run_etl_scenario(func, runs):
+    # Setiap run dipaksa rebuild penuh (full=True jika job mendukungnya, sama seperti
+    # run_etl.py --full); tanpa itu run kedua dst. hanya memproses perubahan sejak watermark
+    kwargs = {"full": True} if "full" in inspect.signature(func).parameters else {}
+    latencies, rows, errors = [], 0, 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        try:
+            stats = func(**kwargs) or {}
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+        rows += stats.get("rows") or 0
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed, rows=rows, rows_per_sec=round(rows / elapsed, 1) if elapsed else None)
+
+
+def dataset_size(cur):
+    cur.execute("SELECT (SELECT COUNT(*) FROM books), (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM borrow_logs)")
+    books, users, borrow_logs = cur.fetchone()
+    review_items = db.get_mongo_client().librarydb["review_items"].estimated_document_count()
+    return {"books": books, "users": users, "borrow_logs": borrow_logs, "reviews": review_items}
+
+
+def run(args):
+    etl = etl_scenarios()
+    available = list(API_SCENARIOS) + list(etl)
+    selected = [s.strip() for s in args.scenarios.split(",")] if args.scenarios else available
+    unknown = [s for s in selected if s not in available]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(available)})")
+
+    conn = connect()
+    cur = conn.cursor()
+    ctx = {
+        "base_url": args.base_url,
+        "workers": args.workers,
+        "requests": args.requests,
+        "pages": args.pages,
+        "seed": args.seed,
+        "users": len(_bench_users(cur)),
+        "book_ids": generate_data.bench_book_ids(cur),
+    }
+    dataset = dataset_size(cur)
+    conn.close()
+
+    results = {}
+    for name in selected:
+        print(f"Running {name}...", file=sys.stderr)
+        if name in etl:
+            results[name] = run_etl_scenario(etl[name], args.etl_runs)
+        else:
+            results[name] = globals()[f"scenario_{name}"](ctx)
+
+    return {
+        "benchmark": "suite",
+        "label": args.label,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "base_url": args.base_url, "workers": args.workers, "requests": args.requests,
+            "pages": args.pages, "etl_runs": args.etl_runs, "seed": args.seed,
+        },
+        "dataset": dataset,
+        "scenarios": results,
+    }
+
+
+def _change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(baseline, candidate, threshold, min_delta_ms):
+    # Regresi: latensi persentil naik > threshold% (dan > min_delta_ms), throughput turun
+    # > threshold%, atau error muncul/bertambah
+    scenarios, regressions = {}, []
+    for name in baseline["scenarios"]:
+        if name not in candidate["scenarios"]:
+            continue
+        before, after = baseline["scenarios"][name], candidate["scenarios"][name]
+        result = {}
+        for key in LATENCY_KEYS:
+            change = _change(before.get(key), after.get(key))
+            regressed = (change is not None and change > threshold and after[key] - before[key] > min_delta_ms)
+            result[key] = {"before": before.get(key), "after": after.get(key), "change_pct": change, "regression": regressed}
+        change = _change(before.get("throughput_ops"), after.get("throughput_ops"))
+        result["throughput_ops"] = {
+            "before": before.get("throughput_ops"), "after": after.get("throughput_ops"),
+            "change_pct": change, "regression": change is not None and change < -threshold,
+        }
+        result["errors"] = {
+            "before": before.get("errors"), "after": after.get("errors"),
+            "regression": (after.get("errors") or 0) > (before.get("errors") or 0),
+        }
+        scenarios[name] = result
+        regressions += [f"{name}.{metric}" for metric, value in result.items() if value["regression"]]
+    return {
+        "benchmark": "suite_compare",
+        "baseline": baseline.get("label"),
+        "candidate": candidate.get("label"),
+        "threshold_pct": threshold,
+        "dataset_changed": baseline.get("dataset") != candidate.get("dataset"),
+        "scenarios": scenarios,
+        "missing": [name for name in baseline["scenarios"] if name not in candidate["scenarios"]],
+        "regressions": regressions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the API and ETL jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run scenarios and print/save JSON results")
+    run_parser.add_argument("--base-url", default=BASE_URL)
+    run_parser.add_argument("--scenarios", help="comma-separated scenario names (default: all)")
+    run_parser.add_argument("--workers", type=int, default=16)
+    run_parser.add_argument("--requests", type=int, default=100, help="requests per worker")
+    run_parser.add_argument("--pages", type=int, default=5, help="pages per request in catalog_walk")
+    run_parser.add_argument("--etl-runs", type=int, default=3, help="runs per ETL job")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--label", help="label stored in the output (e.g. before/after)")
+    run_parser.add_argument("--output", help="write JSON to this file instead of stdout")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        result = compare(baseline, candidate, args.threshold, args.min_delta_ms)
+        print(json.dumps(result, indent=2))
+        if result["regressions"]:
+            print(f"Regressions: {', '.join(result['regressions'])}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    result = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
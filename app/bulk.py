@@ -0,0 +1,211 @@
+# UAS-PDT/app/bulk.py
+# Endpoint batch: POST /books/bulk (impor katalog) dan POST /borrow/batch (pinjam banyak
+# buku sekaligus).
+#
+# /books/bulk menerima JSON (array atau {"books": [...]}), NDJSON, atau CSV (header
+# title,author,year,category,quantity). NDJSON dan CSV dibaca baris demi baris dari
+# request stream. Baris yang valid dikirim dengan COPY langsung ke tabel books Citus
+# (dirutekan per shard oleh coordinator) per potongan BULK_COPY_CHUNK baris, semuanya
+# dalam satu transaksi. book_id diambil lebih dulu dari sequence books supaya bisa
+# dikembalikan dan dipakai untuk seed cache ketersediaan di Redis. Satu baris tidak
+# valid = tidak ada yang disimpan; validasi tetap berjalan sampai akhir agar semua
+# error bisa dilaporkan sekaligus.
+#
+# /borrow/batch memanggil borrow_book_atomic untuk setiap item dalam satu transaksi
+# (urut book_id agar lock baris books selalu diambil dengan urutan yang sama dan batch
+# yang bersamaan tidak deadlock). Jika ada item yang gagal, seluruh batch di-rollback.
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+BULK_MAX_ROWS = int(os.getenv('BOOKS_BULK_MAX_ROWS', '100000'))
+BULK_COPY_CHUNK = int(os.getenv('BOOKS_BULK_COPY_CHUNK', '5000'))
+BULK_MAX_ERRORS = 100 # Error per baris yang dilaporkan di respons
+BORROW_BATCH_MAX = int(os.getenv('BORROW_BATCH_MAX', '20'))
+BOOK_COLUMNS = ("title", "author", "year", "category", "quantity")
+FORMATS = {"application/json": "json", "application/x-ndjson": "ndjson", "text/csv": "csv"}
+
+
+class _InvalidRecord:
+    # Baris NDJSON yang bukan JSON valid; dilaporkan sebagai error baris tersebut
+    def __init__(self, error):
+        self.error = error
+
+
+def _iter_json(data):
+    books = data.get("books") if isinstance(data, dict) else data
+    if not isinstance(books, list):
+        raise ValueError("JSON body must be an array of books or {\"books\": [...]}")
+    return iter(books)
+
+
+def _iter_ndjson(stream):
+    for line in stream:
+        line = line.decode("utf-8").strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield _InvalidRecord(f"invalid JSON: {e}")
+
+
+def _iter_csv(stream):
+    reader = csv.reader(line.decode("utf-8") for line in stream)
+    header = next(reader, None)
+    if not header:
+        raise ValueError("CSV body is empty")
+    header = [column.strip().lstrip("\ufeff").lower() for column in header]
+    missing = [column for column in ("title", "author") if column not in header]
+    if missing:
+        raise ValueError(f"CSV header is missing columns: {', '.join(missing)}")
+    return (dict(zip(header, row)) for row in reader if row)
+
+
+def request_records(request):
+    # Iterable baris buku sesuai Content-Type; ValueError jika format tidak dikenali
+    fmt = FORMATS.get(request.mimetype)
+    if fmt is None:
+        raise ValueError(f"Unsupported Content-Type, use one of: {', '.join(FORMATS)}")
+    if fmt == "json":
+        data = request.get_json(silent=True)
+        if data is None:
+            raise ValueError("Invalid JSON body")
+        return _iter_json(data)
+    if fmt == "ndjson":
+        return _iter_ndjson(request.stream)
+    return _iter_csv(request.stream)
+
+
+def _optional_int(value, name, minimum=None, maximum=None):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    if maximum is not None and number > maximum:
+        raise ValueError(f"{name} must be at most {maximum}")
+    return number
+
+
+def parse_book(record):
+    # (title, author, year, category, quantity); ValueError jika tidak valid
+    if isinstance(record, _InvalidRecord):
+        raise ValueError(record.error)
+    if not isinstance(record, dict):
+        raise ValueError("each book must be an object")
+    title = str(record.get("title") or "").strip()
+    author = str(record.get("author") or "").strip()
+    if not title or not author:
+        raise ValueError("title and author are required")
+    if len(title) > 255 or len(author) > 255:
+        raise ValueError("title and author must be at most 255 characters")
+    category = str(record.get("category") or "").strip() or None
+    if category and len(category) > 100:
+        raise ValueError("category must be at most 100 characters")
+    year = _optional_int(record.get("year"), "year", minimum=0, maximum=9999)
+    quantity = _optional_int(record.get("quantity"), "quantity", minimum=0, maximum=2147483647)
+    return title, author, year, category, 1 if quantity is None else quantity
+
+
+def _copy_chunk(cur, rows):
+    # book_id dialokasikan dari sequence books (celah karena rollback tidak masalah)
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence('books', 'book_id')) FROM generate_series(1, %s)",
+        (len(rows),)
+    )
+    book_ids = [row[0] for row in cur.fetchall()]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for book_id, row in zip(book_ids, rows):
+        writer.writerow((book_id,) + row) # None -> field kosong = NULL di COPY CSV
+    buffer.seek(0)
+    cur.copy_expert(f"COPY books (book_id, {', '.join(BOOK_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return [(book_id, row[4]) for book_id, row in zip(book_ids, rows)]
+
+
+def copy_books(conn, records):
+    # Returns (daftar (book_id, quantity), errors). Commit/rollback diputuskan pemanggil:
+    # jika errors tidak kosong, sebagian baris mungkin sudah di-COPY dan harus di-rollback.
+    cur = conn.cursor()
+    inserted, errors, chunk = [], [], []
+    count = 0
+    for count, record in enumerate(records, start=1):
+        if count > BULK_MAX_ROWS:
+            errors.append({"row": count, "error": f"too many rows (max {BULK_MAX_ROWS})"})
+            break
+        try:
+            row = parse_book(record)
+        except ValueError as e:
+            if len(errors) < BULK_MAX_ERRORS:
+                errors.append({"row": count, "error": str(e)})
+            continue
+        if errors:
+            continue # Sudah pasti rollback; lanjutkan validasi saja
+        chunk.append(row)
+        if len(chunk) >= BULK_COPY_CHUNK:
+            inserted += _copy_chunk(cur, chunk)
+            chunk = []
+    if count == 0:
+        errors.append({"row": None, "error": "no books in request body"})
+    if chunk and not errors:
+        inserted += _copy_chunk(cur, chunk)
+    return inserted, errors
+
+
+def parse_borrow_items(data):
+    # [(book_id, return_at)] dari {"items": [{"book_id", "return_at"?}], "return_at"?}
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list) or not data["items"]:
+        raise ValueError("items must be a non-empty array")
+    if len(data["items"]) > BORROW_BATCH_MAX:
+        raise ValueError(f"At most {BORROW_BATCH_MAX} items per batch")
+    items, seen = [], set()
+    for i, item in enumerate(data["items"]):
+        if not isinstance(item, dict):
+            raise ValueError(f"items[{i}] must be an object")
+        book_id = item.get("book_id")
+        if not isinstance(book_id, int) or isinstance(book_id, bool):
+            raise ValueError(f"items[{i}].book_id must be an integer")
+        if book_id in seen:
+            raise ValueError(f"Book {book_id} appears more than once")
+        seen.add(book_id)
+        return_at_str = item.get("return_at") or data.get("return_at")
+        if not return_at_str:
+            raise ValueError(f"items[{i}] needs return_at (or a top-level return_at)")
+        try:
+            return_at = datetime.fromisoformat(return_at_str)
+        except (TypeError, ValueError):
+            raise ValueError(f"items[{i}].return_at is invalid. Use YYYY-MM-DD HH:MM:SS")
+        items.append((book_id, return_at))
+    return items
+
+
+def borrow_batch(conn, user_id, items):
+    # Returns (semua_ok, hasil per item sesuai urutan request). Tidak commit/rollback.
+    cur = conn.cursor()
+    outcomes = {}
+    for book_id, return_at in sorted(items, key=lambda item: item[0]):
+        cur.execute(
+            "SELECT status, log_id, remaining_quantity FROM borrow_book_atomic(%s, %s, %s)",
+            (book_id, user_id, return_at)
+        )
+        outcomes[book_id] = cur.fetchone()
+    all_ok = all(status == 'ok' for status, _, _ in outcomes.values())
+    results = []
+    for book_id, return_at in items:
+        status, log_id, remaining = outcomes[book_id]
+        result = {"book_id": book_id, "status": status}
+        if status == 'ok' and all_ok:
+            result.update({"log_id": log_id, "remaining_quantity": remaining, "return_at": return_at.isoformat()})
+        elif status == 'ok':
+            result["status"] = "rolled_back" # Bisa dipinjam, tetapi item lain gagal
+        results.append(result)
+    return all_ok, results
@@ -0,0 +1,318 @@
+# UAS-PDT/app/db.py
+# Lapisan koneksi bersama (pool) untuk PostgreSQL, MongoDB, dan Redis.
+# Satu pool per proses; semua endpoint dan dekorator auth memakai modul ini.
+# Query, checkout pool, dan command Redis/MongoDB diukur lewat hook di metrics.py.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions as pg_extensions
+from psycopg2 import pool as pg_pool
+from pymongo import MongoClient
+
+import metrics
+
+# Konfigurasi Database dari environment variables
+POSTGRES_HOST = os.getenv('POSTGRES_HOST')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT')
+POSTGRES_DB = os.getenv('POSTGRES_DB')
+POSTGRES_USER = os.getenv('POSTGRES_USER')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+
+MONGO_HOST = os.getenv('MONGO_HOST')
+MONGO_PORT = int(os.getenv('MONGO_PORT', '27017'))
+MONGO_USERNAME = os.getenv('MONGO_USERNAME')
+MONGO_PASSWORD = os.getenv('MONGO_PASSWORD')
+
+REDIS_HOST = os.getenv('REDIS_HOST')
+REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+
+ANALYTICS_HOST = os.getenv('ANALYTICS_HOST')
+ANALYTICS_PORT = os.getenv('ANALYTICS_PORT')
+ANALYTICS_DB = os.getenv('ANALYTICS_DB')
+ANALYTICS_USER = os.getenv('ANALYTICS_USER')
+ANALYTICS_PASSWORD = os.getenv('ANALYTICS_PASSWORD')
+
+# Hook instrumentasi MongoDB (lihat metrics.py); dipakai juga oleh client motor di async_books.py
+MONGO_LISTENERS = [metrics.MongoCommandListener(), metrics.MongoPoolListener()]
+
+# Ukuran pool dan health check (bisa diatur lewat environment variables)
+PG_POOL_MIN = int(os.getenv('PG_POOL_MIN', '1'))
+PG_POOL_MAX = int(os.getenv('PG_POOL_MAX', '10'))
+PG_POOL_TIMEOUT = float(os.getenv('PG_POOL_TIMEOUT', '5'))  # detik menunggu slot kosong
+PG_HEALTHCHECK_IDLE = float(os.getenv('PG_HEALTHCHECK_IDLE', '30'))  # cek ulang koneksi yang idle lebih lama dari ini
+
+ANALYTICS_POOL_MIN = int(os.getenv('ANALYTICS_POOL_MIN', '0'))
+ANALYTICS_POOL_MAX = int(os.getenv('ANALYTICS_POOL_MAX', '5'))
+
+MONGO_POOL_MIN = int(os.getenv('MONGO_POOL_MIN', '0'))
+MONGO_POOL_MAX = int(os.getenv('MONGO_POOL_MAX', '50'))
+MONGO_POOL_TIMEOUT_MS = int(os.getenv('MONGO_POOL_TIMEOUT_MS', '5000'))
+
+REDIS_POOL_MAX = int(os.getenv('REDIS_POOL_MAX', '50'))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', '5'))
+REDIS_HEALTHCHECK_INTERVAL = int(os.getenv('REDIS_HEALTHCHECK_INTERVAL', '30'))
+
+
+class PoolTimeout(pg_pool.PoolError):
+    pass
+
+
+class PgPool:
+    # Pool psycopg2 yang dibatasi: checkout menunggu slot kosong (bukan langsung error
+    # seperti ThreadedConnectionPool) dan koneksi idle dicek dulu sebelum dipakai.
+
+    def __init__(self, name, minconn, maxconn, timeout, healthcheck_idle, **dsn):
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        # Semua cursor dari pool diukur latensi dan jumlah barisnya (lihat metrics.py)
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, cursor_factory=metrics.InstrumentedCursor, **dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No PostgreSQL connection available after {self.timeout}s")
+        waited = time.monotonic() - start
+        metrics.record_pool_wait(self.name, waited)
+        try:
+            conn = self._healthy(self._pool.getconn())
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited > 0.001:
+                self._waits += 1
+                self._wait_seconds += waited
+        return conn
+
+    def _healthy(self, conn):
+        # Koneksi yang sudah putus atau terlalu lama idle dicek dengan SELECT 1
+        last_used = self._last_used.get(id(conn))
+        if not conn.closed and (last_used is None or time.monotonic() - last_used < self.healthcheck_idle):
+            return conn
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except psycopg2.Error:
+            self._discard(conn)
+            return self._pool.getconn()
+
+    def _discard(self, conn):
+        with self._lock:
+            self._discarded += 1
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            # Jangan kembalikan koneksi dengan transaksi yang masih terbuka
+            if conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._discard(conn)
+                    return
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._pool._pool),
+                "utilization": round(self._in_use / self.maxconn, 3),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds_total": round(self._wait_seconds, 3),
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_init_lock = threading.Lock()
+_pg_pool = None
+_analytics_pool = None
+_mongo_client = None
+_redis_pool = None
+
+
+def _get_pg_pool():
+    global _pg_pool
+    if _pg_pool is None:
+        with _init_lock:
+            if _pg_pool is None:
+                _pg_pool = PgPool(
+                    "postgres", PG_POOL_MIN, PG_POOL_MAX, PG_POOL_TIMEOUT, PG_HEALTHCHECK_IDLE,
+                    host=POSTGRES_HOST, port=POSTGRES_PORT, database=POSTGRES_DB,
+                    user=POSTGRES_USER, password=POSTGRES_PASSWORD
+                )
+    return _pg_pool
+
+
+def _get_analytics_pool():
+    global _analytics_pool
+    if _analytics_pool is None:
+        with _init_lock:
+            if _analytics_pool is None:
+                _analytics_pool = PgPool(
+                    "analytics", ANALYTICS_POOL_MIN, ANALYTICS_POOL_MAX, PG_POOL_TIMEOUT, PG_HEALTHCHECK_IDLE,
+                    host=ANALYTICS_HOST, port=ANALYTICS_PORT, database=ANALYTICS_DB,
+                    user=ANALYTICS_USER, password=ANALYTICS_PASSWORD
+                )
+    return _analytics_pool
+
+
+def _get_redis_pool():
+    global _redis_pool
+    if _redis_pool is None:
+        with _init_lock:
+            if _redis_pool is None:
+                _redis_pool = metrics.InstrumentedBlockingConnectionPool(
+                    host=REDIS_HOST, port=REDIS_PORT, decode_responses=True,
+                    max_connections=REDIS_POOL_MAX, timeout=REDIS_POOL_TIMEOUT,
+                    health_check_interval=REDIS_HEALTHCHECK_INTERVAL
+                )
+    return _redis_pool
+
+
+# Koneksi ke PostgreSQL (Library DB) - diambil dari pool, kembalikan dengan put_pg_conn()
+def get_pg_conn():
+    return _get_pg_pool().getconn()
+
+
+def put_pg_conn(conn):
+    _get_pg_pool().putconn(conn)
+
+
+@contextmanager
+def pg_conn():
+    conn = get_pg_conn()
+    try:
+        yield conn
+    finally:
+        put_pg_conn(conn)
+
+
+# Koneksi ke PostgreSQL (Analytics DB) - dipakai skrip ETL
+def get_analytics_conn():
+    return _get_analytics_pool().getconn()
+
+
+def put_analytics_conn(conn):
+    _get_analytics_pool().putconn(conn)
+
+
+@contextmanager
+def analytics_conn():
+    conn = get_analytics_conn()
+    try:
+        yield conn
+    finally:
+        put_analytics_conn(conn)
+
+
+# Koneksi ke MongoDB - satu MongoClient untuk seluruh proses (MongoClient sudah punya pool sendiri)
+def get_mongo_client():
+    global _mongo_client
+    if _mongo_client is None:
+        with _init_lock:
+            if _mongo_client is None:
+                _mongo_client = MongoClient(
+                    host=MONGO_HOST,
+                    port=MONGO_PORT,
+                    username=MONGO_USERNAME,
+                    password=MONGO_PASSWORD,
+                    minPoolSize=MONGO_POOL_MIN,
+                    maxPoolSize=MONGO_POOL_MAX,
+                    waitQueueTimeoutMS=MONGO_POOL_TIMEOUT_MS,
+                    event_listeners=MONGO_LISTENERS
+                )
+    return _mongo_client
+
+
+# Koneksi ke Redis - client ringan di atas ConnectionPool bersama (setiap command diukur)
+def get_redis_client():
+    return metrics.InstrumentedRedis(connection_pool=_get_redis_pool())
+
+
+def pool_stats():
+    stats = {}
+    stats["postgres"] = _pg_pool.stats() if _pg_pool is not None else None
+    stats["analytics"] = _analytics_pool.stats() if _analytics_pool is not None else None
+    if _redis_pool is not None:
+        # Slot kosong di BlockingConnectionPool berisi None, jadi yang terpakai = max - qsize
+        in_use = _redis_pool.max_connections - _redis_pool.pool.qsize()
+        stats["redis"] = {
+            "max": _redis_pool.max_connections,
+            "created": len(_redis_pool._connections),
+            "in_use": in_use,
+            "utilization": round(in_use / _redis_pool.max_connections, 3),
+        }
+    else:
+        stats["redis"] = None
+    stats["mongo"] = {
+        "min": MONGO_POOL_MIN,
+        "max": MONGO_POOL_MAX,
+        "connected": _mongo_client is not None,
+    }
+    return stats
+
+
+def _collect_pool_gauges():
+    # Gauge db_pool_connections untuk /metrics
+    for name, stats in pool_stats().items():
+        if stats and "in_use" in stats:
+            metrics.set_gauge("db_pool_connections", {"pool": name, "state": "in_use"}, stats["in_use"])
+            metrics.set_gauge("db_pool_connections", {"pool": name, "state": "max"}, stats["max"])
+
+
+metrics.register_collector(_collect_pool_gauges)
+
+
+def close_pools():
+    global _pg_pool, _analytics_pool, _mongo_client, _redis_pool
+    with _init_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+        if _analytics_pool is not None:
+            _analytics_pool.closeall()
+        if _mongo_client is not None:
+            _mongo_client.close()
+        if _redis_pool is not None:
+            _redis_pool.disconnect()
+        _pg_pool = _analytics_pool = _mongo_client = _redis_pool = None
@@ -0,0 +1,229 @@
+# UAS-PDT/app/etl_scripts/bulk_loader.py
+# Loader bersama untuk semua skrip ETL: memuat baris ke analytics_db secara bulk.
+# - method 'copy'  : COPY FROM STDIN ke staging table sementara, lalu satu
+#                    INSERT ... SELECT ... ON CONFLICT ke tabel tujuan
+# - method 'values': execute_values per batch (page_size baris per statement)
+#
+# Untuk full rebuild, data dibangun di shadow table lalu ditukar dengan tabel aktif
+# lewat rename (create_shadow/swap_shadow), jadi pembaca analitik (termasuk lewat
+# postgres_fdw dari library_db) tidak pernah melihat tabel kosong atau menunggu TRUNCATE.
+
+import csv
+import io
+import logging
+import os
+import re
+import time
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+LOAD_METHOD = os.getenv('ETL_LOAD_METHOD', 'copy')
+PAGE_SIZE = int(os.getenv('ETL_LOAD_PAGE_SIZE', '1000'))
+SWAP_LOCK_TIMEOUT = os.getenv('ETL_SWAP_LOCK_TIMEOUT', '2s')
+SWAP_RETRIES = int(os.getenv('ETL_SWAP_RETRIES', '5'))
+COPY_NULL = '\\N'
+
+logger = logging.getLogger("etl.bulk_loader")
+
+
+class _CsvStream(io.RawIOBase):
+    # File-like yang menghasilkan CSV dari iterable baris secara bertahap,
+    # sehingga COPY bisa streaming tanpa menampung seluruh data di memori
+    def __init__(self, rows, counter):
+        self._rows = iter(rows)
+        self._counter = counter
+        self._buffer = b''
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text)
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        for row in self._rows:
+            self._writer.writerow([COPY_NULL if value is None else value for value in row])
+            self._counter[0] += 1
+            if self._text.tell() >= 65536:
+                break
+        chunk = self._text.getvalue().encode('utf-8')
+        self._text.seek(0)
+        self._text.truncate()
+        return chunk
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b):
+            chunk = self._next_chunk()
+            if not chunk:
+                break
+            self._buffer += chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _upsert_sql(table, columns, conflict_columns, source):
+    updates = [c for c in columns if c not in conflict_columns]
+    if updates:
+        action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(', ').join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in updates
+        ))
+    else:
+        action = sql.SQL("DO NOTHING")
+    return sql.SQL("INSERT INTO {table} ({cols}) {source} ON CONFLICT ({keys}) {action}").format(
+        table=sql.Identifier(table),
+        cols=sql.SQL(', ').join(map(sql.Identifier, columns)),
+        source=source,
+        keys=sql.SQL(', ').join(map(sql.Identifier, conflict_columns)),
+        action=action,
+    )
+
+
+def _load_copy(cur, table, columns, rows, conflict_columns):
+    staging = f"{table}_staging"
+    cur.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP").format(
+        staging=sql.Identifier(staging), table=sql.Identifier(table)
+    ))
+    cur.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(staging)))
+    counter = [0]
+    copy_sql = sql.SQL("COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv, NULL {null})").format(
+        staging=sql.Identifier(staging),
+        cols=sql.SQL(', ').join(map(sql.Identifier, columns)),
+        null=sql.Literal(COPY_NULL),
+    )
+    cur.copy_expert(copy_sql.as_string(cur), io.BufferedReader(_CsvStream(rows, counter), buffer_size=65536))
+    cur.execute(_upsert_sql(table, columns, conflict_columns, sql.SQL("SELECT {cols} FROM {staging}").format(
+        cols=sql.SQL(', ').join(map(sql.Identifier, columns)),
+        staging=sql.Identifier(staging),
+    )))
+    return counter[0]
+
+
+def _load_values(cur, table, columns, rows, conflict_columns, page_size):
+    query = _upsert_sql(table, columns, conflict_columns, sql.SQL("VALUES %s")).as_string(cur)
+    loaded = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= page_size:
+            execute_values(cur, query, batch, page_size=page_size)
+            loaded += len(batch)
+            batch = []
+    if batch:
+        execute_values(cur, query, batch, page_size=page_size)
+        loaded += len(batch)
+    return loaded
+
+
+def bulk_upsert(cur, table, columns, rows, conflict_columns, method=None, page_size=None):
+    # rows boleh berupa list maupun generator; commit tetap diurus pemanggil
+    method = method or LOAD_METHOD
+    started = time.monotonic()
+    if method == 'copy':
+        loaded = _load_copy(cur, table, columns, rows, conflict_columns)
+    elif method == 'values':
+        loaded = _load_values(cur, table, columns, rows, conflict_columns, page_size or PAGE_SIZE)
+    else:
+        raise ValueError(f"Unknown ETL load method: {method}")
+    elapsed = time.monotonic() - started
+    stats = {
+        "table": table,
+        "method": method,
+        "rows": loaded,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(loaded / elapsed, 1) if elapsed > 0 else None,
+    }
+    logger.info("Loaded %s rows into %s via %s in %ss (%s rows/sec)", loaded, table, method, stats['seconds'], stats['rows_per_sec'])
+    return stats
+
+
+def create_shadow(cur, table):
+    # Shadow table kosong dengan struktur, default, dan primary key tabel aktif (dibutuhkan
+    # ON CONFLICT saat load). Index lain baru dibangun di swap_shadow setelah data dimuat:
+    # lebih cepat daripada memuat ke tabel yang sudah ber-index.
+    shadow = f"{table}_shadow"
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(shadow)))
+    cur.execute(sql.SQL("CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+        shadow=sql.Identifier(shadow), table=sql.Identifier(table)
+    ))
+    cur.execute(
+        "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+        (table,)
+    )
+    row = cur.fetchone()
+    if row:
+        cur.execute(sql.SQL("ALTER TABLE {shadow} ADD CONSTRAINT {name} " + row[0]).format(
+            shadow=sql.Identifier(shadow), name=sql.Identifier(f"{shadow}_pkey")
+        ))
+    return shadow
+
+
+def _secondary_indexes(cur, table):
+    # [(nama, 'UNIQUE '/'', definisi setelah nama tabel)] untuk index yang bukan milik constraint
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid)
+        ORDER BY c.relname
+        """,
+        (table,)
+    )
+    indexes = []
+    for name, definition in cur.fetchall():
+        # "CREATE [UNIQUE] INDEX nama ON [ONLY] schema.tabel USING ..."
+        match = re.match(r"CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (.*)$", definition)
+        if match:
+            indexes.append((name, match.group(1) or "", match.group(2)))
+    return indexes
+
+
+def _build_shadow_indexes(cur, table, shadow):
+    # Index sekunder tabel aktif dibangun ulang di shadow dengan nama sementara; definisi
+    # yang sama persis (duplikat sisa refresh lama) hanya dibangun sekali
+    renames, seen = [], set()
+    for name, unique, definition in _secondary_indexes(cur, table):
+        if (unique, definition) in seen:
+            continue
+        seen.add((unique, definition))
+        temp = f"{name[:50]}_shadow"
+        cur.execute(sql.SQL("CREATE " + unique + "INDEX {temp} ON {shadow} " + definition).format(
+            temp=sql.Identifier(temp), shadow=sql.Identifier(shadow)
+        ))
+        renames.append((temp, name))
+    return renames
+
+
+def swap_shadow(cur, table, shadow):
+    # Index sekunder dibangun di shadow sebelum lock diambil. Rename hanya butuh ACCESS
+    # EXCLUSIVE lock sesaat di akhir transaksi ETL. lock_timeout mencegah ETL mengantre
+    # lama di belakang query analitik yang sedang berjalan (dan memblokir query baru di
+    # belakangnya); jika timeout, coba lagi dari savepoint.
+    index_renames = _build_shadow_indexes(cur, table, shadow)
+    old = f"{table}_old"
+    for attempt in range(1, SWAP_RETRIES + 1):
+        cur.execute("SAVEPOINT swap_shadow")
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (SWAP_LOCK_TIMEOUT,))
+            cur.execute(sql.SQL("ALTER TABLE {table} RENAME TO {old}").format(table=sql.Identifier(table), old=sql.Identifier(old)))
+            cur.execute(sql.SQL("ALTER TABLE {shadow} RENAME TO {table}").format(shadow=sql.Identifier(shadow), table=sql.Identifier(table)))
+            cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old)))
+            # Nama index dan primary key kembali seperti yang dideklarasikan (init_analytics_db.sql,
+            # indexes.py), sehingga refresh berikutnya tidak menumpuk index baru
+            for temp, name in index_renames:
+                cur.execute(sql.SQL("ALTER INDEX {temp} RENAME TO {name}").format(temp=sql.Identifier(temp), name=sql.Identifier(name)))
+            cur.execute(sql.SQL("ALTER TABLE {table} RENAME CONSTRAINT {pkey} TO {name}").format(
+                table=sql.Identifier(table), pkey=sql.Identifier(f"{shadow}_pkey"), name=sql.Identifier(f"{table}_pkey")
+            ))
+            cur.execute("SET LOCAL lock_timeout = 0")
+            cur.execute("RELEASE SAVEPOINT swap_shadow")
+            break
+        except psycopg2.errors.LockNotAvailable:
+            cur.execute("ROLLBACK TO SAVEPOINT swap_shadow")
+            if attempt == SWAP_RETRIES:
+                raise
+            logger.warning("Swap of %s waiting for readers, retry %s/%s", table, attempt, SWAP_RETRIES)
+            time.sleep(0.5 * attempt)
@@ -1,108 +1,155 @@
 # UAS-PDT/app/etl_scripts/etl_books_summary.py
 
-import psycopg2
-from pymongo import MongoClient
+from datetime import timezone
+import argparse
+import logging
 import os
-
-# Konfigurasi Database dari environment variables
-# Koneksi ke library_db
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
-# Koneksi ke analytics_db
-ANALYTICS_HOST = os.getenv('ANALYTICS_HOST')
-ANALYTICS_PORT = os.getenv('ANALYTICS_PORT')
-ANALYTICS_DB = os.getenv('ANALYTICS_DB')
-ANALYTICS_USER = os.getenv('ANALYTICS_USER')
-ANALYTICS_PASSWORD = os.getenv('ANALYTICS_PASSWORD')
-
-# Koneksi ke MongoDB
-MONGO_HOST = os.getenv('MONGO_HOST')
-MONGO_PORT = int(os.getenv('MONGO_PORT'))
-MONGO_USERNAME = os.getenv('MONGO_USERNAME')
-MONGO_PASSWORD = os.getenv('MONGO_PASSWORD')
-
-def run_etl_books_summary():
+import sys
+
+# Modul bersama di folder app/ (mis. reviews.py) bisa di-import saat skrip dijalankan langsung
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reviews import get_reviews_collection, review_stats, books_reviewed_since
+from db import get_pg_conn, put_pg_conn, get_analytics_conn, put_analytics_conn, get_mongo_client
+from response_cache import bump_version, ANALYTICS
+from bulk_loader import bulk_upsert, create_shadow, swap_shadow
+from streaming import stream_rows, chunked
+
+logger = logging.getLogger("etl.books_summary")
+
+# Job lain yang harus selesai lebih dulu saat dijalankan lewat run_etl.py
+DEPENDS_ON = ()
+
+# Watermark incremental ETL disimpan di analytics_db (tabel etl_watermarks)
+JOB_NAME = 'books_summary'
+# Log peminjaman dengan log_id lebih kecil bisa ter-commit setelah watermark dibaca,
+# jadi borrowed_at dalam jendela ini selalu diproses ulang (aman karena COUNT dihitung ulang penuh per buku)
+WATERMARK_OVERLAP = os.getenv('ETL_WATERMARK_OVERLAP', '5 minutes')
+
+def get_watermark(cur_ana):
+    cur_ana.execute(
+        "SELECT last_log_id, last_borrowed_at, last_book_id, last_review_at FROM etl_watermarks WHERE job_name = %s",
+        (JOB_NAME,)
+    )
+    return cur_ana.fetchone()
+
+def save_watermark(cur_ana, last_log_id, last_borrowed_at, last_book_id, last_review_at):
+    cur_ana.execute(
+        """
+        INSERT INTO etl_watermarks (job_name, last_log_id, last_borrowed_at, last_book_id, last_review_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (job_name) DO UPDATE SET
+            last_log_id = EXCLUDED.last_log_id,
+            last_borrowed_at = EXCLUDED.last_borrowed_at,
+            last_book_id = EXCLUDED.last_book_id,
+            last_review_at = EXCLUDED.last_review_at,
+            updated_at = EXCLUDED.updated_at;
+        """,
+        (JOB_NAME, last_log_id, last_borrowed_at, last_book_id, last_review_at)
+    )
+
+def run_etl_books_summary(full=False):
     try:
-        # Koneksi ke Library DB
-        conn_lib = psycopg2.connect(
-            host=POSTGRES_HOST, port=POSTGRES_PORT, database=POSTGRES_DB,
-            user=POSTGRES_USER, password=POSTGRES_PASSWORD
-        )
+        # Koneksi ke Library DB dan Analytics DB diambil dari pool bersama (lihat db.py)
+        conn_lib = get_pg_conn()
         cur_lib = conn_lib.cursor()
-
-        # Koneksi ke Analytics DB
-        conn_ana = psycopg2.connect(
-            host=ANALYTICS_HOST, port=ANALYTICS_PORT, database=ANALYTICS_DB,
-            user=ANALYTICS_USER, password=ANALYTICS_PASSWORD
-        )
+        conn_ana = get_analytics_conn()
         cur_ana = conn_ana.cursor()
 
-        # Koneksi ke MongoDB
-        mongo_client = MongoClient(
-            host=MONGO_HOST, port=MONGO_PORT,
-            username=MONGO_USERNAME, password=MONGO_PASSWORD
-        )
-        reviews_collection = mongo_client.librarydb.reviews # Asumsi nama DB MongoDB 'librarydb'
-
-        print("Running ETL for books_summary...")
-
-        # 1. TRUNCATE tabel books_summary di analytics_db
-        cur_ana.execute("TRUNCATE TABLE books_summary RESTART IDENTITY;")
-
-        # 2. Extract data buku dari Library DB
-        cur_lib.execute("SELECT book_id FROM books")
-        book_ids = [row[0] for row in cur_lib.fetchall()]
-
-        books_summary_data = []
-
-        for book_id in book_ids:
-            # Hitung total review dan rata-rata rating dari MongoDB
-            mongo_doc = reviews_collection.find_one({"book_id": book_id})
-            total_review = 0
-            avg_rating = 0.0
-            if mongo_doc and 'reviews' in mongo_doc and mongo_doc['reviews']:
-                total_review = len(mongo_doc['reviews'])
-                ratings = [r['rating'] for r in mongo_doc['reviews'] if 'rating' in r]
-                if ratings:
-                    avg_rating = sum(ratings) / len(ratings)
-
-            # Hitung total peminjaman dari Library DB
-            cur_lib.execute("SELECT COUNT(*) FROM borrow_logs WHERE book_id = %s", (book_id,))
-            total_borrowed = cur_lib.fetchone()[0]
-
-            books_summary_data.append((book_id, total_review, round(avg_rating, 2), total_borrowed))
-
-        # 3. Load data ke Analytics DB
-        for book_id, total_review, avg_rating, total_borrowed in books_summary_data:
-            cur_ana.execute(
+        # Koneksi ke MongoDB (MongoClient bersama untuk seluruh proses)
+        reviews_collection = get_reviews_collection(get_mongo_client())
+
+        watermark = None if full else get_watermark(cur_ana)
+        mode = "incremental" if watermark else "full"
+        logger.info("Running ETL for books_summary (%s)...", mode)
+
+        # Batas atas watermark dibaca sebelum extract agar perubahan selama ETL ikut di run berikutnya
+        cur_lib.execute("SELECT COALESCE(MAX(log_id), 0), MAX(borrowed_at) FROM borrow_logs")
+        max_log_id, max_borrowed_at = cur_lib.fetchone()
+        cur_lib.execute("SELECT COALESCE(MAX(book_id), 0) FROM books")
+        max_book_id = cur_lib.fetchone()[0]
+
+        if watermark is None:
+            # 1. Full rebuild: hitung ulang semua buku ke shadow table (book_id dibaca lewat server-side cursor);
+            # tabel books_summary yang aktif tetap bisa dibaca sampai ditukar di akhir
+            target = create_shadow(cur_ana, 'books_summary')
+            book_ids = (row[0] for row in stream_rows(conn_lib, 'etl_books_summary_ids', "SELECT book_id FROM books ORDER BY book_id"))
+            last_review_at = None
+        else:
+            # 1. Incremental: hanya buku yang punya peminjaman/review baru atau buku baru,
+            # di-upsert langsung ke tabel aktif (hanya row lock)
+            target = 'books_summary'
+            last_log_id, last_borrowed_at, last_book_id, last_review_at = watermark
+            # UNION dua cabang yang masing-masing dilayani index-nya sendiri (borrow_logs_log_id_idx
+            # dan borrow_logs_borrowed_at_idx di indexes.py), bukan satu OR atas seluruh borrow_logs
+            cur_lib.execute(
                 """
-                INSERT INTO books_summary (book_id, total_review, avg_rating, total_borrowed)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (book_id) DO UPDATE SET
-                    total_review = EXCLUDED.total_review,
-                    avg_rating = EXCLUDED.avg_rating,
-                    total_borrowed = EXCLUDED.total_borrowed;
+                SELECT book_id FROM borrow_logs WHERE log_id > %s
+                UNION
+                SELECT book_id FROM borrow_logs WHERE borrowed_at >= %s::timestamptz - %s::interval
                 """,
-                (book_id, total_review, avg_rating, total_borrowed)
+                (last_log_id, last_borrowed_at, WATERMARK_OVERLAP)
             )
+            affected = {row[0] for row in cur_lib.fetchall()}
+            cur_lib.execute("SELECT book_id FROM books WHERE book_id > %s", (last_book_id,))
+            affected.update(row[0] for row in cur_lib.fetchall())
+            review_book_ids = books_reviewed_since(reviews_collection, last_review_at)
+            if review_book_ids:
+                # Hanya buku yang masih ada di Library DB
+                cur_lib.execute("SELECT book_id FROM books WHERE book_id = ANY(%s)", (review_book_ids,))
+                affected.update(row[0] for row in cur_lib.fetchall())
+            book_ids = sorted(affected)
+
+        review_watermark = [last_review_at]
+
+        def summary_rows():
+            # 2. Per chunk buku: satu query GROUP BY untuk total peminjaman dan satu aggregation
+            # MongoDB untuk statistik review (lihat reviews.review_stats), lalu baris langsung dialirkan ke loader
+            for chunk in chunked(book_ids):
+                stats = review_stats(reviews_collection, chunk)
+                cur_lib.execute(
+                    "SELECT book_id, COUNT(*) FROM borrow_logs WHERE book_id = ANY(%s) GROUP BY book_id",
+                    (chunk,)
+                )
+                borrow_counts = dict(cur_lib.fetchall())
+                for book_id in chunk:
+                    doc = stats.get(book_id, {})
+                    yield (book_id, doc.get("total_review", 0), doc.get("avg_rating", 0.0), borrow_counts.get(book_id, 0))
+                    reviewed_at = doc.get("last_review_at")
+                    if reviewed_at:
+                        # Tanggal dari MongoDB naive (UTC), watermark dari PG timezone-aware
+                        reviewed_at = reviewed_at.replace(tzinfo=timezone.utc) if reviewed_at.tzinfo is None else reviewed_at
+                        if review_watermark[0] is None or reviewed_at > review_watermark[0]:
+                            review_watermark[0] = reviewed_at
+
+        # 3. Load data ke Analytics DB sebagai satu bulk upsert, watermark disimpan di transaksi yang sama
+        load_stats = bulk_upsert(
+            cur_ana, target,
+            ('book_id', 'total_review', 'avg_rating', 'total_borrowed'),
+            summary_rows(), conflict_columns=('book_id',)
+        )
+        if target != 'books_summary':
+            swap_shadow(cur_ana, 'books_summary', target) # Tukar dengan rename dalam transaksi singkat di akhir
+        save_watermark(cur_ana, max_log_id, max_borrowed_at, max_book_id, review_watermark[0])
         conn_ana.commit()
-        print("ETL for books_summary completed successfully.")
+        bump_version(ANALYTICS) # Respons analitik yang di-cache menjadi basi
+        logger.info("ETL for books_summary completed successfully (%s books updated).", load_stats['rows'])
+        return load_stats
 
     except Exception as e:
-        print(f"Error during ETL for books_summary: {e}")
+        logger.error("Error during ETL for books_summary: %s", e)
         if 'conn_ana' in locals() and conn_ana:
             conn_ana.rollback()
+        raise # Biarkan runner mencatat kegagalan job ini
     finally:
         if 'conn_lib' in locals() and conn_lib:
-            conn_lib.close()
+            put_pg_conn(conn_lib)
         if 'conn_ana' in locals() and conn_ana:
-            conn_ana.close()
-        if 'mongo_client' in locals() and mongo_client:
-            mongo_client.close()
+            put_analytics_conn(conn_ana)
 
 if __name__ == '__main__':
-    run_etl_books_summary()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETL books_summary (incremental by default)")
+    parser.add_argument("--full", action="store_true", help="rebuild every book into a shadow table and swap it in")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    run_etl_books_summary(full=args.full)
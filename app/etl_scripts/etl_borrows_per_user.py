@@ -1,80 +1,71 @@
 # UAS-PDT/app/etl_scripts/etl_borrows_per_user.py
 
-import psycopg2
+import logging
 import os
+import sys
 
-# Konfigurasi Database dari environment variables
-# Koneksi ke library_db
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+# Modul bersama di folder app/ (mis. response_cache.py) bisa di-import saat skrip dijalankan langsung
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Koneksi ke analytics_db
-ANALYTICS_HOST = os.getenv('ANALYTICS_HOST')
-ANALYTICS_PORT = os.getenv('ANALYTICS_PORT')
-ANALYTICS_DB = os.getenv('ANALYTICS_DB')
-ANALYTICS_USER = os.getenv('ANALYTICS_USER')
-ANALYTICS_PASSWORD = os.getenv('ANALYTICS_PASSWORD')
+from db import get_pg_conn, put_pg_conn, get_analytics_conn, put_analytics_conn
+from response_cache import bump_version, ANALYTICS
+from user_loans import get_counters
+from bulk_loader import bulk_upsert, create_shadow, swap_shadow
+from streaming import stream_rows, chunked
+
+logger = logging.getLogger("etl.borrows_per_user")
+
+# Job lain yang harus selesai lebih dulu saat dijalankan lewat run_etl.py
+DEPENDS_ON = ()
 
 def run_etl_borrows_per_user():
     try:
-        # Koneksi ke Library DB
-        conn_lib = psycopg2.connect(
-            host=POSTGRES_HOST, port=POSTGRES_PORT, database=POSTGRES_DB,
-            user=POSTGRES_USER, password=POSTGRES_PASSWORD
-        )
-        cur_lib = conn_lib.cursor()
-
-        # Koneksi ke Analytics DB
-        conn_ana = psycopg2.connect(
-            host=ANALYTICS_HOST, port=ANALYTICS_PORT, database=ANALYTICS_DB,
-            user=ANALYTICS_USER, password=ANALYTICS_PASSWORD
-        )
+        # Koneksi ke Library DB dan Analytics DB diambil dari pool bersama (lihat db.py)
+        conn_lib = get_pg_conn()
+        conn_ana = get_analytics_conn()
         cur_ana = conn_ana.cursor()
 
-        print("Running ETL for borrows_per_user...")
+        logger.info("Running ETL for borrows_per_user...")
+
+        # 1. Bangun ulang di shadow table; tabel borrows_per_user yang aktif tetap bisa dibaca selama ETL
+        shadow = create_shadow(cur_ana, 'borrows_per_user')
 
-        # 1. TRUNCATE tabel borrows_per_user di analytics_db
-        cur_ana.execute("TRUNCATE TABLE borrows_per_user RESTART IDENTITY;")
+        # 2. Extract dan Transform: total peminjaman per user diambil dari counter live di Redis
+        # (user_loans.py, dijaga oleh /borrow dan /return) per chunk user, bukan GROUP BY atas
+        # seluruh borrow_logs; hanya user yang counter-nya belum dimuat yang dibaca dari PG
+        users = stream_rows(conn_lib, 'etl_borrows_per_user', "SELECT user_id, email FROM users ORDER BY user_id")
 
-        # 2. Extract dan Transform: Hitung total peminjaman per user
-        cur_lib.execute("""
-            SELECT
-                u.user_id,
-                u.email AS user_name, -- Atau kolom nama jika ada
-                COUNT(bl.log_id) AS total_borrows
-            FROM users u
-            JOIN borrow_logs bl ON u.user_id = bl.user_id
-            GROUP BY u.user_id, u.email;
-        """)
-        borrows_data = cur_lib.fetchall()
+        def borrows_data():
+            for chunk in chunked(users):
+                counters = get_counters([user_id for user_id, _ in chunk])
+                for user_id, email in chunk:
+                    total_borrows = counters[user_id]["total_borrows"]
+                    if total_borrows > 0: # Sama seperti JOIN sebelumnya: hanya user yang pernah meminjam
+                        yield (user_id, email, total_borrows)
 
-        # 3. Load data ke Analytics DB
-        for user_id, user_name, total_borrows in borrows_data:
-            cur_ana.execute(
-                """
-                INSERT INTO borrows_per_user (user_id, user_name, total_borrows)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    user_name = EXCLUDED.user_name,
-                    total_borrows = EXCLUDED.total_borrows;
-                """,
-                (user_id, user_name, total_borrows)
-            )
+        # 3. Load data ke Analytics DB (bulk, lihat bulk_loader.py)
+        load_stats = bulk_upsert(
+            cur_ana, shadow,
+            ('user_id', 'user_name', 'total_borrows'),
+            borrows_data(), conflict_columns=('user_id',)
+        )
+        swap_shadow(cur_ana, 'borrows_per_user', shadow) # Tukar dengan rename dalam transaksi singkat di akhir
         conn_ana.commit()
-        print("ETL for borrows_per_user completed successfully.")
+        bump_version(ANALYTICS) # Respons analitik yang di-cache menjadi basi
+        logger.info("ETL for borrows_per_user completed successfully.")
+        return load_stats
 
     except Exception as e:
-        print(f"Error during ETL for borrows_per_user: {e}")
+        logger.error("Error during ETL for borrows_per_user: %s", e)
         if 'conn_ana' in locals() and conn_ana:
             conn_ana.rollback()
+        raise # Biarkan runner mencatat kegagalan job ini
     finally:
         if 'conn_lib' in locals() and conn_lib:
-            conn_lib.close()
+            put_pg_conn(conn_lib)
         if 'conn_ana' in locals() and conn_ana:
-            conn_ana.close()
+            put_analytics_conn(conn_ana)
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
     run_etl_borrows_per_user()
\ No newline at end of file
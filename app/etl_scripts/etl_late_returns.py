@@ -1,47 +1,40 @@
 # UAS-PDT/app/etl_scripts/etl_late_returns.py
 
-import psycopg2
 from datetime import datetime
+import logging
 import os
+import sys
 
-# Konfigurasi Database dari environment variables
-# Koneksi ke library_db
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+# Modul bersama di folder app/ (mis. response_cache.py) bisa di-import saat skrip dijalankan langsung
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Koneksi ke analytics_db
-ANALYTICS_HOST = os.getenv('ANALYTICS_HOST')
-ANALYTICS_PORT = os.getenv('ANALYTICS_PORT')
-ANALYTICS_DB = os.getenv('ANALYTICS_DB')
-ANALYTICS_USER = os.getenv('ANALYTICS_USER')
-ANALYTICS_PASSWORD = os.getenv('ANALYTICS_PASSWORD')
+from db import get_pg_conn, put_pg_conn, get_analytics_conn, put_analytics_conn
+from response_cache import bump_version, ANALYTICS
+from bulk_loader import bulk_upsert, create_shadow, swap_shadow
+from streaming import stream_rows
+
+logger = logging.getLogger("etl.late_returns")
+
+# Job lain yang harus selesai lebih dulu saat dijalankan lewat run_etl.py
+DEPENDS_ON = ()
 
 def run_etl_late_returns():
     try:
-        # Koneksi ke Library DB
-        conn_lib = psycopg2.connect(
-            host=POSTGRES_HOST, port=POSTGRES_PORT, database=POSTGRES_DB,
-            user=POSTGRES_USER, password=POSTGRES_PASSWORD
-        )
-        cur_lib = conn_lib.cursor()
-
-        # Koneksi ke Analytics DB
-        conn_ana = psycopg2.connect(
-            host=ANALYTICS_HOST, port=ANALYTICS_PORT, database=ANALYTICS_DB,
-            user=ANALYTICS_USER, password=ANALYTICS_PASSWORD
-        )
+        # Koneksi ke Library DB dan Analytics DB diambil dari pool bersama (lihat db.py)
+        conn_lib = get_pg_conn()
+        conn_ana = get_analytics_conn()
         cur_ana = conn_ana.cursor()
 
-        print("Running ETL for late_returns...")
+        logger.info("Running ETL for late_returns...")
 
-        # 1. TRUNCATE tabel late_returns di analytics_db
-        cur_ana.execute("TRUNCATE TABLE late_returns RESTART IDENTITY;")
+        # 1. Bangun ulang di shadow table; tabel late_returns yang aktif tetap bisa dibaca selama ETL
+        shadow = create_shadow(cur_ana, 'late_returns')
 
         # 2. Extract dan Transform: Cari peminjaman yang terlambat
-        cur_lib.execute("""
+        # (dibaca bertahap lewat server-side cursor, diubah dan dialirkan ke loader tanpa fetchall)
+        # Dua bagian UNION ALL masing-masing dilayani partial index (lihat indexes.py):
+        # pinjaman aktif yang lewat jatuh tempo dan pinjaman yang dikembalikan terlambat
+        late_borrows = stream_rows(conn_lib, 'etl_late_returns', """
             SELECT
                 log_id,
                 book_id,
@@ -51,49 +44,54 @@ def run_etl_late_returns():
                 returned_at
             FROM borrow_logs
             WHERE returned_at IS NULL AND return_at < CURRENT_TIMESTAMP
-            OR (returned_at IS NOT NULL AND returned_at > return_at);
+            UNION ALL
+            SELECT
+                log_id,
+                book_id,
+                user_id,
+                borrowed_at,
+                return_at,
+                returned_at
+            FROM borrow_logs
+            WHERE returned_at > return_at;
         """)
-        late_borrows = cur_lib.fetchall()
 
-        late_returns_data = []
-        for log_id, book_id, user_id, borrowed_at, return_at, returned_at in late_borrows:
-            # Hitung keterlambatan hari
-            if returned_at:
-                late_days = (returned_at - return_at).days
-            else: # Belum dikembalikan dan sudah melewati batas
-                late_days = (datetime.now(return_at.tzinfo) - return_at).days # Pastikan timezone aware
+        def transform(rows):
+            for log_id, book_id, user_id, borrowed_at, return_at, returned_at in rows:
+                # Hitung keterlambatan hari
+                if returned_at:
+                    late_days = (returned_at - return_at).days
+                else: # Belum dikembalikan dan sudah melewati batas
+                    late_days = (datetime.now(return_at.tzinfo) - return_at).days # Pastikan timezone aware
+
+                if late_days > 0:
+                    yield (log_id, book_id, user_id, borrowed_at, return_at, returned_at, late_days)
 
-            if late_days > 0:
-                late_returns_data.append((log_id, book_id, user_id, borrowed_at, return_at, returned_at, late_days))
+        late_returns_data = transform(late_borrows)
 
-        # 3. Load data ke Analytics DB
-        for log_id, book_id, user_id, borrowed_at, return_at, returned_at, late_days in late_returns_data:
-            cur_ana.execute(
-                """
-                INSERT INTO late_returns (log_id, book_id, user_id, borrowed_at, return_at, returned_at, late_days)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (log_id) DO UPDATE SET
-                    book_id = EXCLUDED.book_id,
-                    user_id = EXCLUDED.user_id,
-                    borrowed_at = EXCLUDED.borrowed_at,
-                    return_at = EXCLUDED.return_at,
-                    returned_at = EXCLUDED.returned_at,
-                    late_days = EXCLUDED.late_days;
-                """,
-                (log_id, book_id, user_id, borrowed_at, return_at, returned_at, late_days)
-            )
+        # 3. Load data ke Analytics DB (bulk, lihat bulk_loader.py)
+        load_stats = bulk_upsert(
+            cur_ana, shadow,
+            ('log_id', 'book_id', 'user_id', 'borrowed_at', 'return_at', 'returned_at', 'late_days'),
+            late_returns_data, conflict_columns=('log_id',)
+        )
+        swap_shadow(cur_ana, 'late_returns', shadow) # Tukar dengan rename dalam transaksi singkat di akhir
         conn_ana.commit()
-        print("ETL for late_returns completed successfully.")
+        bump_version(ANALYTICS) # Respons analitik yang di-cache menjadi basi
+        logger.info("ETL for late_returns completed successfully.")
+        return load_stats
 
     except Exception as e:
-        print(f"Error during ETL for late_returns: {e}")
+        logger.error("Error during ETL for late_returns: %s", e)
         if 'conn_ana' in locals() and conn_ana:
             conn_ana.rollback()
+        raise # Biarkan runner mencatat kegagalan job ini
     finally:
         if 'conn_lib' in locals() and conn_lib:
-            conn_lib.close()
+            put_pg_conn(conn_lib)
         if 'conn_ana' in locals() and conn_ana:
-            conn_ana.close()
+            put_analytics_conn(conn_ana)
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
     run_etl_late_returns()
\ No newline at end of file
@@ -0,0 +1,163 @@
+# UAS-PDT/app/etl_scripts/run_etl.py
+# Runner untuk semua job ETL. Job ditemukan otomatis dari fungsi run_etl_* di file
+# etl_*.py pada folder ini; DEPENDS_ON di modul job menentukan urutan. Job yang tidak
+# saling bergantung dijalankan bersamaan di thread pool dan memakai pool koneksi
+# bersama dari db.py. Kegagalan satu job tidak menghentikan job lain (kecuali yang
+# bergantung padanya).
+#
+# Contoh:
+#   python3 etl_scripts/run_etl.py                      # semua job, paralel 3
+#   python3 etl_scripts/run_etl.py --jobs late_returns  # job tertentu saja
+#   python3 etl_scripts/run_etl.py --schedule 300       # mode scheduler, tiap 5 menit
+
+import argparse
+import glob
+import importlib
+import inspect
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+ETL_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ETL_DIR)
+sys.path.insert(0, os.path.dirname(ETL_DIR))
+
+from db import get_redis_client
+import metrics
+
+SCHEDULER_LOCK_KEY = "etl:scheduler_lock"
+
+logger = logging.getLogger("etl")
+
+
+def discover_jobs():
+    # {nama_job: (fungsi, depends_on)}; nama job = nama fungsi tanpa awalan run_etl_
+    jobs = {}
+    for path in sorted(glob.glob(os.path.join(ETL_DIR, "etl_*.py"))):
+        module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if name.startswith("run_etl_") and func.__module__ == module.__name__:
+                jobs[name[len("run_etl_"):]] = (func, tuple(getattr(module, "DEPENDS_ON", ())))
+    return jobs
+
+
+def _run_job(name, func, full):
+    started = time.monotonic()
+    kwargs = {"full": True} if full and "full" in inspect.signature(func).parameters else {}
+    try:
+        load_stats = func(**kwargs) or {}
+        status, error = "ok", None
+    except Exception as e:
+        load_stats, status, error = {}, "failed", str(e)
+        logger.exception("ETL job %s failed", name)
+    seconds = time.monotonic() - started
+    metrics.record_etl_job(name, status, seconds, load_stats.get("rows"))
+    return {
+        "job": name,
+        "status": status,
+        "error": error,
+        "seconds": round(seconds, 3),
+        "rows": load_stats.get("rows"),
+        "rows_per_sec": load_stats.get("rows_per_sec"),
+    }
+
+
+def run_jobs(jobs, parallel, full=False):
+    pending = dict(jobs)
+    done = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="etl") as executor:
+        while pending or running:
+            # Jadwalkan job yang semua dependensinya sudah selesai
+            for name in list(pending):
+                func, depends_on = pending[name]
+                missing = [d for d in depends_on if d not in jobs]
+                failed = [d for d in depends_on if d in done and done[d]["status"] != "ok"]
+                if missing or failed:
+                    reason = f"missing dependency {missing}" if missing else f"dependency failed {failed}"
+                    done[name] = {"job": name, "status": "skipped", "error": reason, "seconds": 0, "rows": None, "rows_per_sec": None}
+                    logger.warning("ETL job %s skipped: %s", name, reason)
+                    del pending[name]
+                elif all(d in done for d in depends_on):
+                    logger.info("ETL job %s started", name)
+                    running[executor.submit(_run_job, name, func, full)] = name
+                    del pending[name]
+            if not running:
+                if pending:
+                    # Sisa job saling bergantung secara melingkar
+                    for name in pending:
+                        done[name] = {"job": name, "status": "skipped", "error": "dependency cycle", "seconds": 0, "rows": None, "rows_per_sec": None}
+                    pending.clear()
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                done[running.pop(future)] = result
+                logger.info("ETL job %s %s in %.3fs (%s rows)", result["job"], result["status"], result["seconds"], result["rows"])
+    return [done[name] for name in jobs if name in done]
+
+
+def run_once(selected, parallel, full=False):
+    jobs = discover_jobs()
+    if selected:
+        unknown = [name for name in selected if name not in jobs]
+        if unknown:
+            raise SystemExit(f"Unknown ETL jobs: {', '.join(unknown)} (available: {', '.join(jobs)})")
+        jobs = {name: jobs[name] for name in jobs if name in selected}
+    started = time.monotonic()
+    results = run_jobs(jobs, parallel, full)
+    summary = {"seconds": round(time.monotonic() - started, 3), "jobs": results}
+    logger.info("ETL run finished: %s", json.dumps(summary))
+    try:
+        # Durasi job dan query ETL ikut terlihat di /metrics aplikasi (lihat metrics.py)
+        metrics.publish()
+    except Exception:
+        logger.exception("Publishing ETL metrics failed")
+    return summary
+
+
+def run_scheduler(selected, parallel, interval):
+    # Loop di dalam stack (service etl_scheduler) tanpa cron eksternal. Lock Redis
+    # mencegah dua scheduler menjalankan refresh yang sama bersamaan.
+    logger.info("ETL scheduler started, interval %ss", interval)
+    metrics.start_publisher()
+    while True:
+        started = time.monotonic()
+        try:
+            if get_redis_client().set(SCHEDULER_LOCK_KEY, os.getpid(), nx=True, ex=max(int(interval), 1)):
+                run_once(selected, parallel)
+            else:
+                logger.info("Another ETL scheduler holds the lock, skipping this interval")
+        except Exception:
+            logger.exception("ETL scheduler iteration failed")
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ETL jobs with dependency-aware parallelism")
+    parser.add_argument("--parallel", type=int, default=int(os.getenv('ETL_PARALLEL', '3')), help="max jobs running at once")
+    parser.add_argument("--jobs", help="comma-separated job names (default: all)")
+    parser.add_argument("--full", action="store_true", help="force full rebuild for jobs that support it")
+    parser.add_argument("--schedule", type=float, metavar="SECONDS", help="run forever every SECONDS")
+    parser.add_argument("--json", action="store_true", help="print the run summary as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s")
+    selected = [name.strip() for name in args.jobs.split(',')] if args.jobs else None
+
+    if args.schedule:
+        run_scheduler(selected, args.parallel, args.schedule)
+        return
+
+    summary = run_once(selected, args.parallel, args.full)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    if any(result["status"] != "ok" for result in summary["jobs"]):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+# UAS-PDT/app/etl_scripts/streaming.py
+# Helper extract untuk ETL: baca hasil query lewat named (server-side) cursor
+# sehingga memori tetap konstan berapa pun ukuran borrow_logs.
+
+import os
+from itertools import islice
+
+ITERSIZE = int(os.getenv('ETL_ITERSIZE', '2000'))
+CHUNK_SIZE = int(os.getenv('ETL_CHUNK_SIZE', '1000'))
+
+
+def stream_rows(conn, name, query, params=None, itersize=None):
+    # Baris diambil dari server per itersize baris; cursor ditutup saat generator selesai
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize or ITERSIZE
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+
+
+def chunked(iterable, size=None):
+    iterator = iter(iterable)
+    size = size or CHUNK_SIZE
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
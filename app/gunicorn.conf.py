@@ -0,0 +1,78 @@
+# UAS-PDT/app/gunicorn.conf.py
+# Konfigurasi Gunicorn untuk menjalankan app.py di produksi:
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Worker gthread: beberapa proses, masing-masing dengan beberapa thread. Setiap proses
+# punya pool koneksi sendiri (db.py, ditambah pool asyncpg di async_books.py jika
+# BOOKS_FETCH_MODE=async), jadi jumlah worker dibatasi oleh anggaran koneksi PostgreSQL
+# (PG_CONNECTION_BUDGET / koneksi per worker) selain jumlah core. Thread per worker
+# disamakan dengan PG_POOL_MAX: thread tambahan hanya akan menunggu slot pool.
+#
+# Tugas sekali jalan (index, warm-up cache) dikerjakan master sebelum fork, lalu pool
+# master ditutup; setiap worker membuka pool-nya sendiri setelah fork.
+
+import logging
+import multiprocessing
+import os
+
+CPU_COUNT = multiprocessing.cpu_count()
+PG_POOL_MAX = int(os.getenv('PG_POOL_MAX', '10'))
+PG_CONNECTION_BUDGET = int(os.getenv('PG_CONNECTION_BUDGET', '80')) # Total koneksi library_db untuk semua worker
+# Pool asyncpg jalur async /books (default sama dengan async_books.ASYNC_PG_POOL_MAX)
+ASYNC_PG_POOL_MAX = int(os.getenv('BOOKS_ASYNC_PG_POOL_MAX', '0')) or PG_POOL_MAX
+PG_CONNECTIONS_PER_WORKER = PG_POOL_MAX + (ASYNC_PG_POOL_MAX if os.getenv('BOOKS_FETCH_MODE', 'sync') == 'async' else 0)
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_WORKERS', '0')) or max(1, min(2 * CPU_COUNT + 1, PG_CONNECTION_BUDGET // PG_CONNECTIONS_PER_WORKER))
+threads = int(os.getenv('WEB_THREADS', '0')) or PG_POOL_MAX
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+# Daur ulang worker secara berkala (dengan jitter agar tidak bersamaan)
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # Logger aplikasi (mis. slow_query dari metrics.py) ikut ke stderr seperti log Gunicorn
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(name)s %(message)s")
+    import db
+    import availability
+    import indexes
+
+    try:
+        indexes.ensure_indexes()
+        availability.warm_up()
+    except Exception as e:
+        # Worker tetap dijalankan; /health/ready melaporkan cache yang belum warm
+        server.log.error(f"Startup tasks failed: {e}")
+    finally:
+        db.close_pools() # Koneksi master tidak boleh diwariskan ke worker
+
+
+def post_fork(server, worker):
+    import db
+    import metrics
+    db.close_pools()
+    metrics.reset() # Query startup milik master tidak ikut terhitung di worker
+
+
+def post_worker_init(worker):
+    import db
+    import availability
+    import metrics
+
+    try:
+        # Buka pool milik worker ini sebelum menerima request pertama
+        with db.pg_conn():
+            pass
+        db.get_redis_client().ping()
+        db.get_mongo_client().admin.command('ping')
+    except Exception as e:
+        worker.log.error(f"Connection pool warm-up failed: {e}")
+    # Lock Redis di reconciler memastikan hanya satu worker yang benar-benar berjalan
+    availability.start_reconciler()
+    metrics.start_publisher() # Snapshot metrics worker ini ke Redis untuk /metrics
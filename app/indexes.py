@@ -0,0 +1,261 @@
+# UAS-PDT/app/indexes.py
+# Deklarasi index sekunder untuk PostgreSQL (library_db, analytics_db) dan MongoDB,
+# dibuat saat startup secara idempoten, plus pemeriksaan regresi berbasis EXPLAIN.
+#
+# - ensure_indexes(): CREATE INDEX CONCURRENTLY untuk setiap index PG yang belum punya
+#   padanan dengan definisi sama (tanpa mengunci tulis di tabel yang sudah besar; index
+#   INVALID sisa build yang gagal dibuat ulang) dan create_index untuk MongoDB. Advisory
+#   lock mencegah beberapa proses app membangun index yang sama bersamaan.
+# - check_plans(): EXPLAIN setiap query panas dengan enable_seqscan=off; jika planner
+#   tetap memilih Seq Scan (atau COLLSCAN di MongoDB), berarti tidak ada index yang bisa
+#   dipakai dan pemeriksaan gagal.
+#
+# Jalankan manual di dalam kontainer flask_app:
+#   python3 indexes.py            # buat index yang belum ada
+#   python3 indexes.py --check    # exit 1 jika ada query panas yang jatuh ke sequential scan
+
+import argparse
+import json
+import re
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+
+from db import pg_conn, analytics_conn, get_mongo_client
+import analytics
+import reviews
+
+ADVISORY_LOCK_KEY = 'ensure_indexes'
+
+# {target: [(nama_index, tabel, definisi setelah nama tabel)]}
+# Lookup borrow_logs berdasarkan book_id sudah dilayani primary key (book_id, log_id).
+PG_INDEXES = {
+    "library": [
+        # Pinjaman yang masih aktif (partial): ETL late_returns dan jatuh tempo
+        ("borrow_logs_open_loans_idx", "borrow_logs", "(return_at) WHERE returned_at IS NULL"),
+        # Pinjaman yang dikembalikan terlambat (partial): bagian kedua ETL late_returns
+        ("borrow_logs_returned_late_idx", "borrow_logs", "(returned_at) WHERE returned_at > return_at"),
+        # Covering index per user: COUNT per user (index-only scan) dan riwayat pinjaman terbaru
+        ("borrow_logs_user_borrowed_at_idx", "borrow_logs", "(user_id, borrowed_at DESC) INCLUDE (log_id, book_id, return_at, returned_at)"),
+        # Pinjaman aktif per user (partial)
+        ("borrow_logs_user_open_loans_idx", "borrow_logs", "(user_id) WHERE returned_at IS NULL"),
+        # ETL books_summary incremental: log baru sejak watermark dan jendela overlap
+        # borrowed_at (index-only scan), juga MAX(log_id)/MAX(borrowed_at) untuk watermark
+        ("borrow_logs_log_id_idx", "borrow_logs", "(log_id) INCLUDE (book_id)"),
+        ("borrow_logs_borrowed_at_idx", "borrow_logs", "(borrowed_at) INCLUDE (book_id)"),
+    ],
+    "analytics": [
+        # Urutan + keyset pagination endpoint /analytics/* (ikut tersalin ke shadow table ETL)
+        ("late_returns_late_days_log_id_idx", "late_returns", "(late_days DESC, log_id DESC)"),
+        ("late_returns_user_id_idx", "late_returns", "(user_id)"),
+        ("late_returns_book_id_idx", "late_returns", "(book_id)"),
+        ("borrows_per_user_total_borrows_user_id_idx", "borrows_per_user", "(total_borrows DESC, user_id DESC)"),
+    ],
+}
+PG_TARGETS = {"library": pg_conn, "analytics": analytics_conn}
+
+# {collection: [(keys, opsi create_index)]}
+MONGO_INDEXES = {
+    # Satu dokumen per review, jadi book_id tidak unik; lookup per buku memakai prefix
+    # book_id dari index gabungan (urut terbaru), ETL incremental memakai timestamp
+    reviews.REVIEW_ITEMS_COLLECTION: [
+        ([("book_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {"name": "book_id_timestamp"}),
+        ([("timestamp", ASCENDING)], {"name": "timestamp"}),
+    ],
+}
+
+# Query panas yang harus memakai index: (nama, target, sql, params)
+_late_page = analytics.build_query(analytics.REPORTS["late_returns"], {}, [1, 1], 100)
+_late_by_user = analytics.build_query(analytics.REPORTS["late_returns"], {"user_id": 1}, None, 100)
+_per_user_page = analytics.build_query(analytics.REPORTS["borrows_per_user"], {}, [1, 1], 100)
+PG_HOT_QUERIES = [
+    ("login", "library", "SELECT user_id, password, role FROM users WHERE email = %s", ("admin@kampus.com",)),
+    ("books_page", "library", "SELECT book_id, title, author, year, category, quantity FROM books WHERE book_id > %s ORDER BY book_id LIMIT %s", (0, 51)),
+    ("return_lookup", "library", "SELECT user_id, book_id, return_at, returned_at FROM borrow_logs WHERE book_id = %s AND log_id = %s", (1, 1)),
+    ("borrows_per_book", "library", "SELECT COUNT(*) FROM borrow_logs WHERE book_id = %s", (1,)),
+    ("borrows_per_user", "library", "SELECT COUNT(*) FROM borrow_logs WHERE user_id = %s", (1,)),
+    ("open_loans_per_user", "library", "SELECT COUNT(*) FROM borrow_logs WHERE user_id = %s AND returned_at IS NULL", (1,)),
+    ("overdue_open_loans", "library", "SELECT log_id FROM borrow_logs WHERE returned_at IS NULL AND return_at < CURRENT_TIMESTAMP", ()),
+    ("returned_late", "library", "SELECT log_id FROM borrow_logs WHERE returned_at > return_at", ()),
+    ("books_summary_affected", "library",
+     "SELECT book_id FROM borrow_logs WHERE log_id > %s UNION SELECT book_id FROM borrow_logs WHERE borrowed_at >= %s::timestamptz - %s::interval",
+     (0, datetime(2000, 1, 1), '5 minutes')),
+    ("late_returns_page", "analytics", _late_page[0], _late_page[1]),
+    ("late_returns_by_user", "analytics", _late_by_user[0], _late_by_user[1]),
+    ("borrows_per_user_page", "analytics", _per_user_page[0], _per_user_page[1]),
+]
+
+# (nama, collection, filter, sort)
+MONGO_HOT_QUERIES = [
+    ("reviews_by_book", reviews.REVIEW_ITEMS_COLLECTION, {"book_id": 1}, [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ("reviews_since", reviews.REVIEW_ITEMS_COLLECTION, {"timestamp": {"$gt": datetime(2000, 1, 1)}}, None),
+]
+
+
+def _strip_index_name(indexdef):
+    # "CREATE [UNIQUE] INDEX nama ON [ONLY] schema.tabel USING ..." -> ('UNIQUE '/'', 'USING ...')
+    match = re.match(r"CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (.*)$", indexdef)
+    return (match.group(1) or "", match.group(2)) if match else None
+
+
+def _canonical_definition(cur, table, definition):
+    # Definisi deklarasi dalam bentuk pg_get_indexdef, didapat dengan membangun index yang
+    # sama pada temp table kosong berstruktur sama, sehingga bisa dibandingkan dengan index
+    # yang sudah ada apa pun namanya
+    probe = f"_index_probe_{table}"
+    cur.execute(f"DROP TABLE IF EXISTS pg_temp.{probe}")
+    cur.execute(f"CREATE TEMP TABLE {probe} (LIKE {table})")
+    try:
+        cur.execute(f"CREATE INDEX {probe}_idx ON pg_temp.{probe} {definition}")
+        cur.execute("SELECT pg_get_indexdef(%s::regclass)", (f"pg_temp.{probe}_idx",))
+        return _strip_index_name(cur.fetchone()[0])
+    finally:
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{probe}")
+
+
+def _table_indexes(cur, table):
+    # {nama: (definisi tanpa nama, indisvalid)} untuk index tabel yang bukan milik constraint
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisvalid
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = i.indexrelid)
+        ORDER BY c.relname
+        """,
+        (table,)
+    )
+    return {name: (_strip_index_name(indexdef), valid) for name, indexdef, valid in cur.fetchall()}
+
+
+def ensure_pg_indexes(target):
+    # Index dianggap ada jika tabelnya punya index dengan definisi yang sama (bukan sekadar
+    # nama yang sama). Index setara dengan nama lain diganti namanya ke nama deklarasi,
+    # salinan setara lainnya (dan yang INVALID) di-drop, dan index dengan nama deklarasi
+    # tetapi definisi lama dibangun ulang.
+    results = []
+    with PG_TARGETS[target]() as conn:
+        # CREATE INDEX CONCURRENTLY tidak boleh berada di dalam transaksi
+        conn.autocommit = True
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (ADVISORY_LOCK_KEY,))
+            try:
+                for name, table, definition in PG_INDEXES[target]:
+                    canonical = _canonical_definition(cur, table, definition)
+                    existing = _table_indexes(cur, table)
+                    equivalent = [other for other, (other_def, _) in existing.items() if other_def == canonical]
+                    valid = [other for other in equivalent if existing[other][1]]
+                    keep = name if name in valid else (valid[0] if valid else None)
+
+                    for other in equivalent:
+                        if other != keep:
+                            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {other}")
+                            if other != name:
+                                results.append({"target": target, "index": other, "status": "dropped duplicate"})
+                    if name in existing and name not in equivalent:
+                        # Definisi deklarasi berubah sejak index ini dibuat
+                        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+                    if keep == name:
+                        status = "exists"
+                    elif keep:
+                        cur.execute(f"ALTER INDEX {keep} RENAME TO {name}")
+                        status = "renamed"
+                    else:
+                        cur.execute(f"CREATE INDEX CONCURRENTLY {name} ON {table} {definition}")
+                        status = "rebuilt" if name in existing else "created"
+                    results.append({"target": target, "index": name, "status": status})
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (ADVISORY_LOCK_KEY,))
+        finally:
+            conn.autocommit = False
+    return results
+
+
+def ensure_mongo_indexes():
+    # create_index sudah idempoten (no-op jika index dengan spesifikasi sama sudah ada)
+    db = get_mongo_client().librarydb
+    results = []
+    for collection, specs in MONGO_INDEXES.items():
+        for keys, options in specs:
+            db[collection].create_index(keys, **options)
+            results.append({"target": "mongo", "index": f"{collection}.{options['name']}", "status": "ensured"})
+    return results
+
+
+def ensure_indexes():
+    results = []
+    for target in PG_INDEXES:
+        results.extend(ensure_pg_indexes(target))
+    results.extend(ensure_mongo_indexes())
+    for result in results:
+        if result["status"] != "exists" and result["target"] != "mongo":
+            print(f"Index {result['index']} ({result['target']}) {result['status']}")
+    return results
+
+
+def _seq_scans(plan_lines):
+    return [m.group(1) for line in plan_lines for m in [re.search(r"Seq Scan on (\S+)", line)] if m]
+
+
+def _explain_pg(conn, target, query, params):
+    cur = conn.cursor()
+    try:
+        if target == "library":
+            # SET LOCAL ikut dikirim ke shard Citus
+            cur.execute("SET LOCAL citus.propagate_set_commands TO 'local'")
+        cur.execute("SET LOCAL enable_seqscan = off")
+        cur.execute("EXPLAIN " + query, params)
+        return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.rollback()
+
+
+def _collscans(plan):
+    if isinstance(plan, dict):
+        found = ["COLLSCAN"] if plan.get("stage") == "COLLSCAN" else []
+        for value in plan.values():
+            found += _collscans(value)
+        return found
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in _collscans(item)]
+    return []
+
+
+def check_plans():
+    results = []
+    for target in PG_TARGETS:
+        with PG_TARGETS[target]() as conn:
+            for name, query_target, query, params in PG_HOT_QUERIES:
+                if query_target != target:
+                    continue
+                scans = _seq_scans(_explain_pg(conn, target, query, params))
+                results.append({"query": name, "target": target, "ok": not scans, "seq_scans": scans})
+
+    db = get_mongo_client().librarydb
+    for name, collection, query, sort in MONGO_HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        scans = _collscans(cursor.limit(100).explain().get("queryPlanner", {}).get("winningPlan", {}))
+        results.append({"query": name, "target": "mongo", "ok": not scans, "seq_scans": scans})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create declared indexes and check hot query plans")
+    parser.add_argument("--check", action="store_true", help="fail if a hot query plans a sequential scan")
+    args = parser.parse_args()
+
+    if not args.check:
+        print(json.dumps(ensure_indexes(), indent=2))
+        sys.exit(0)
+
+    results = check_plans()
+    print(json.dumps(results, indent=2))
+    failed = [r["query"] for r in results if not r["ok"]]
+    if failed:
+        print(f"Sequential scan in hot queries: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,536 @@
+# UAS-PDT/app/metrics.py
+# Instrumentasi: histogram latensi per route dan per query backend (PostgreSQL, MongoDB,
+# Redis), jumlah baris, waktu tunggu slot pool, dan hit/miss cache; ditampilkan dalam
+# format teks Prometheus di GET /metrics.
+#
+# - db.py memasang hook di lapisan koneksi: cursor psycopg2 (InstrumentedCursor),
+#   listener command/pool pymongo, dan client/pool Redis (InstrumentedRedis)
+# - app.py mengukur setiap request (label route = pola URL, bukan path asli, agar
+#   jumlah seri tetap kecil)
+# - Query yang lebih lambat dari SLOW_QUERY_MS dicatat ke logger "slow_query" beserta
+#   bentuk SQL-nya (literal diganti ?)
+#
+# Setiap proses (worker Gunicorn, scheduler ETL) mencatat di memorinya sendiri lalu
+# menerbitkan snapshot ke Redis (hash metrics:snapshots) secara berkala; /metrics
+# menjumlahkan snapshot semua proses yang masih hidup, jadi hasil scrape tidak
+# bergantung pada worker mana yang melayaninya. Counter dan histogram dari snapshot
+# proses yang sudah mati (worker didaur ulang) dipindahkan ke hash metrics:retired
+# sebelum snapshot-nya dihapus, sehingga total tidak pernah turun; gauge-nya dibuang.
+
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from functools import lru_cache
+
+from psycopg2 import extensions as pg_extensions
+from pymongo import monitoring
+import redis
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_INTERVAL', '5')) # detik
+STALE_AFTER = float(os.getenv('METRICS_STALE_AFTER', '30')) # snapshot proses yang lebih tua dari ini diabaikan
+SNAPSHOTS_KEY = "metrics:snapshots"
+RETIRED_KEY = "metrics:retired"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger("slow_query")
+
+# {nama: {"type", "help", "labels", "buckets"}}
+_DEFINITIONS = {
+    "http_request_duration_seconds": {
+        "type": "histogram", "help": "HTTP request latency by route",
+        "labels": ("route", "method", "status"), "buckets": LATENCY_BUCKETS,
+    },
+    "db_query_duration_seconds": {
+        "type": "histogram", "help": "Backend query latency by store, operation and table/collection",
+        "labels": ("store", "operation", "target"), "buckets": LATENCY_BUCKETS,
+    },
+    "db_query_rows_total": {
+        "type": "counter", "help": "Rows returned or affected by backend queries",
+        "labels": ("store", "operation", "target"),
+    },
+    "db_query_errors_total": {
+        "type": "counter", "help": "Backend queries that raised an error",
+        "labels": ("store", "operation", "target"),
+    },
+    "db_slow_queries_total": {
+        "type": "counter", "help": f"Backend queries slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)",
+        "labels": ("store", "operation", "target"),
+    },
+    "db_pool_acquire_seconds": {
+        "type": "histogram", "help": "Time spent waiting for a pooled connection",
+        "labels": ("pool",), "buckets": (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+    },
+    "db_pool_connections": {
+        "type": "gauge", "help": "Pooled connections by state (summed over processes)",
+        "labels": ("pool", "state"),
+    },
+    "cache_lookups_total": {
+        "type": "counter", "help": "Cache lookups by result",
+        "labels": ("cache", "result"),
+    },
+    "etl_job_duration_seconds": {
+        "type": "histogram", "help": "ETL job duration",
+        "labels": ("job", "status"), "buckets": (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+    },
+    "etl_rows_total": {
+        "type": "counter", "help": "Rows loaded by ETL jobs",
+        "labels": ("job",),
+    },
+}
+
+_lock = threading.Lock()
+_values = {name: {} for name in _DEFINITIONS}
+_collectors = []
+_publisher_pid = None
+# Waktu mulai ikut di id agar proses baru dengan pid yang sama (kontainer di-restart) tidak
+# menimpa snapshot proses lama sebelum nilainya dipindahkan ke metrics:retired
+_process_id = f"{socket.gethostname()}:{os.getpid()}:{time.time():.0f}"
+
+
+def observe(name, labels, value):
+    # Histogram: per label disimpan [hitungan per bucket..., +Inf, sum]
+    buckets = _DEFINITIONS[name]["buckets"]
+    key = tuple(str(labels[label]) for label in _DEFINITIONS[name]["labels"])
+    with _lock:
+        series = _values[name].get(key)
+        if series is None:
+            series = _values[name][key] = [0] * (len(buckets) + 1) + [0.0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(buckets)] += 1
+        series[-1] += value
+
+
+def inc(name, labels, value=1):
+    key = tuple(str(labels[label]) for label in _DEFINITIONS[name]["labels"])
+    with _lock:
+        _values[name][key] = _values[name].get(key, 0) + value
+
+
+def set_gauge(name, labels, value):
+    key = tuple(str(labels[label]) for label in _DEFINITIONS[name]["labels"])
+    with _lock:
+        _values[name][key] = value
+
+
+def register_collector(func):
+    # Dipanggil setiap kali snapshot dibuat, untuk mengisi gauge (mis. statistik pool)
+    _collectors.append(func)
+
+
+def reset():
+    # Setelah fork: nilai milik master tidak boleh ikut terhitung di worker
+    global _process_id, _publisher_pid
+    with _lock:
+        for series in _values.values():
+            series.clear()
+    _process_id = f"{socket.gethostname()}:{os.getpid()}:{time.time():.0f}"
+    _publisher_pid = None
+
+
+# --- Bentuk SQL dan label query ---
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+_SQL_TARGET = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN|TABLE)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+_SQL_OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE", "COPY", "CREATE", "DROP", "ALTER", "EXPLAIN", "SET", "DECLARE", "ANALYZE")
+
+
+def sql_shape(query):
+    # (operasi, tabel pertama, bentuk SQL tanpa literal/parameter dan spasi berlebih).
+    # Query panjang (mis. execute_values dengan ribuan baris) cukup dilihat awalnya dan
+    # tidak disimpan di cache.
+    if len(query) > 2000:
+        return _sql_shape(query[:2000])
+    return _cached_sql_shape(query)
+
+
+@lru_cache(maxsize=1024)
+def _cached_sql_shape(query):
+    return _sql_shape(query)
+
+
+def _sql_shape(query):
+    shape = " ".join(_SQL_LITERALS.sub("?", query).split())
+    words = shape.upper().split(None, 1)
+    operation = words[0] if words else "UNKNOWN"
+    if operation == "WITH":
+        # CTE: operasi utama adalah kata kunci pertama setelah definisi CTE
+        found = [op for op in _SQL_OPERATIONS if re.search(rf"\)\s*{op}\b", shape, re.IGNORECASE)]
+        operation = found[0] if found else "SELECT"
+    elif operation not in _SQL_OPERATIONS:
+        operation = "OTHER"
+    target = _SQL_TARGET.search(shape)
+    return operation, target.group(1).lower() if target else "-", shape[:500]
+
+
+def record_query(store, operation, target, seconds, rows=None, shape=None, error=False):
+    labels = {"store": store, "operation": operation, "target": target}
+    observe("db_query_duration_seconds", labels, seconds)
+    if rows is not None and rows >= 0:
+        inc("db_query_rows_total", labels, rows)
+    if error:
+        inc("db_query_errors_total", labels)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        inc("db_slow_queries_total", labels)
+        slow_query_log.warning(
+            "Slow %s query %.1f ms (rows=%s): %s", store, seconds * 1000,
+            rows if rows is not None and rows >= 0 else "?", shape or f"{operation} {target}"
+        )
+
+
+def record_pool_wait(pool, seconds):
+    observe("db_pool_acquire_seconds", {"pool": pool}, seconds)
+
+
+def record_request(route, method, status, seconds):
+    observe("http_request_duration_seconds", {"route": route, "method": method, "status": status}, seconds)
+
+
+def record_cache(cache, hits, misses):
+    if hits:
+        inc("cache_lookups_total", {"cache": cache, "result": "hit"}, hits)
+    if misses:
+        inc("cache_lookups_total", {"cache": cache, "result": "miss"}, misses)
+
+
+def record_etl_job(job, status, seconds, rows):
+    observe("etl_job_duration_seconds", {"job": job, "status": status}, seconds)
+    if rows:
+        inc("etl_rows_total", {"job": job}, rows)
+
+
+# --- Hook di lapisan koneksi (dipasang oleh db.py) ---
+
+class InstrumentedCursor(pg_extensions.cursor):
+    # cursor_factory untuk koneksi pool: setiap execute/copy diukur
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        error = False
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._record(query, time.perf_counter() - started, error)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        error = False
+        try:
+            return super().copy_expert(sql, file, size)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._record(sql, time.perf_counter() - started, error)
+
+    def _record(self, query, seconds, error):
+        try:
+            if not isinstance(query, str):
+                query = query.as_string(self) if hasattr(query, "as_string") else query.decode()
+            operation, target, shape = sql_shape(query)
+            record_query("postgres", operation, target, seconds, self.rowcount, shape, error)
+        except Exception:
+            pass # Instrumentasi tidak boleh menggagalkan query
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        command = event.command
+        target = command.get(event.command_name)
+        target = target if isinstance(target, str) else "-"
+        # Bentuk filter: hanya nama field, tanpa nilai
+        query = command.get("filter") or command.get("q") or {}
+        shape = f"{event.command_name} {target} {sorted(query)}" if isinstance(query, dict) else f"{event.command_name} {target}"
+        self._pending[(event.request_id, event.connection_id)] = (target, shape)
+
+    def _finish(self, event, rows, error):
+        target, shape = self._pending.pop((event.request_id, event.connection_id), ("-", event.command_name))
+        record_query("mongo", event.command_name, target, event.duration_micros / 1e6, rows, shape, error)
+
+    def succeeded(self, event):
+        reply = event.reply or {}
+        rows = reply.get("n")
+        if "cursor" in reply:
+            cursor = reply["cursor"]
+            rows = len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+        self._finish(event, rows, False)
+
+    def failed(self, event):
+        self._finish(event, None, True)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    # Waktu tunggu checkout: check-out started dan checked out terjadi di thread yang sama
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            record_pool_wait("mongo", time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class InstrumentedBlockingConnectionPool(redis.BlockingConnectionPool):
+    def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        connection = super().get_connection(command_name, *keys, **options)
+        record_pool_wait("redis", time.perf_counter() - started)
+        return connection
+
+
+def _redis_rows(result):
+    if isinstance(result, (list, tuple, dict, set)):
+        return len(result)
+    return None
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        commands = len(self.command_stack)
+        started = time.perf_counter()
+        error = False
+        try:
+            return super().execute(raise_on_error)
+        except Exception:
+            error = True
+            raise
+        finally:
+            if commands:
+                record_query("redis", "PIPELINE", "-", time.perf_counter() - started, commands, f"PIPELINE ({commands} commands)", error)
+
+
+class InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        result, error = None, False
+        try:
+            result = super().execute_command(*args, **options)
+            return result
+        except Exception:
+            error = True
+            raise
+        finally:
+            command = str(args[0]).upper() if args else "UNKNOWN"
+            # Segmen pertama key (sebelum ':' pertama) sebagai target, mis. book_available_count,
+            # response, review_page: bagian variabel (id, versi, hash) tidak boleh jadi label
+            # karena jumlah seri akan tumbuh tanpa batas
+            key = args[1] if len(args) > 1 and command not in ("EVAL", "EVALSHA") else (args[3] if len(args) > 3 else None)
+            target = str(key).split(":", 1)[0] if key is not None and ":" in str(key) else "-"
+            record_query("redis", command, target, time.perf_counter() - started, _redis_rows(result), f"{command} {target}", error)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# --- Snapshot, agregasi antar proses, dan format Prometheus ---
+
+def snapshot():
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception:
+            pass
+    with _lock:
+        return {name: [[list(key), value if not isinstance(value, list) else list(value)] for key, value in series.items()]
+                for name, series in _values.items()}
+
+
+def publish(r=None):
+    if r is None:
+        from db import get_redis_client # Hindari import melingkar (db.py meng-import modul ini)
+        r = get_redis_client()
+    r.hset(SNAPSHOTS_KEY, _process_id, json.dumps({"ts": time.time(), "metrics": snapshot()}))
+
+
+def _publish_loop():
+    while True:
+        time.sleep(PUBLISH_INTERVAL)
+        try:
+            publish()
+        except Exception as e:
+            print(f"Error publishing metrics snapshot: {e}")
+
+
+def start_publisher():
+    # Satu thread per proses; aman dipanggil berulang
+    global _publisher_pid
+    with _lock:
+        if _publisher_pid == os.getpid():
+            return
+        _publisher_pid = os.getpid()
+    threading.Thread(target=_publish_loop, name="metrics-publisher", daemon=True).start()
+
+
+# Pindahkan snapshot basi ke metrics:retired, hanya jika isinya masih sama dengan yang
+# dibaca: scrape lain yang bersamaan tidak ikut memindahkannya dua kali, dan snapshot yang
+# baru diterbitkan ulang tidak terhapus.
+_RETIRE_LUA = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+for i = 3, #ARGV, 2 do
+    redis.call('HINCRBYFLOAT', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+def _retired_fields(metrics_snapshot):
+    # [field, nilai, ...] untuk HINCRBYFLOAT: satu field per seri counter dan per elemen
+    # histogram (bucket..., sum); gauge tidak disimpan
+    fields = []
+    for name, series in metrics_snapshot.items():
+        definition = _DEFINITIONS.get(name)
+        if definition is None or definition["type"] == "gauge":
+            continue
+        for key, value in series:
+            values = value if isinstance(value, list) else [value]
+            for i, item in enumerate(values):
+                if item:
+                    field = [name, key, i] if isinstance(value, list) else [name, key]
+                    fields += [json.dumps(field), repr(float(item))]
+    return fields
+
+
+def _retired(r):
+    # Nilai metrics:retired dalam bentuk yang sama dengan snapshot: {nama: {key: nilai}}
+    retired = {}
+    for field, raw in r.hgetall(RETIRED_KEY).items():
+        field, value = json.loads(field), float(raw)
+        name, key = field[0], tuple(field[1])
+        definition = _DEFINITIONS.get(name)
+        if definition is None:
+            continue
+        value = int(value) if value.is_integer() else value
+        if len(field) == 2:
+            retired.setdefault(name, {})[key] = value
+            continue
+        size = len(definition.get("buckets", ())) + 2 # bucket..., +Inf, sum
+        if field[2] < size:
+            retired.setdefault(name, {}).setdefault(key, [0] * size)[field[2]] = value
+    return retired
+
+
+def _merge(merged, name, key, value):
+    current = merged[name].get(key)
+    if current is None:
+        merged[name][key] = value
+    elif isinstance(value, list):
+        merged[name][key] = [a + b for a, b in zip(current, value)]
+    else:
+        merged[name][key] = current + value
+
+
+def collect():
+    # Gabungan snapshot semua proses yang masih hidup (proses ini selalu ikut, terbaru)
+    # ditambah nilai proses yang sudah mati di metrics:retired
+    from db import get_redis_client
+    r = get_redis_client()
+    publish(r)
+    merged = {name: {} for name in _DEFINITIONS}
+    now = time.time()
+    for process_id, raw in r.hgetall(SNAPSHOTS_KEY).items():
+        data = json.loads(raw)
+        if now - data["ts"] > STALE_AFTER:
+            r.eval(_RETIRE_LUA, 2, SNAPSHOTS_KEY, RETIRED_KEY, process_id, raw, *_retired_fields(data["metrics"]))
+            continue
+        for name, series in data["metrics"].items():
+            if name in merged:
+                for key, value in series:
+                    _merge(merged, name, tuple(key), value)
+    for name, series in _retired(r).items():
+        for key, value in series.items():
+            _merge(merged, name, key, value)
+    return merged
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(merged):
+    lines = []
+    for name, definition in _DEFINITIONS.items():
+        series = merged.get(name, {})
+        lines.append(f"# HELP {name} {definition['help']}")
+        lines.append(f"# TYPE {name} {definition['type']}")
+        for key in sorted(series):
+            value = series[key]
+            if definition["type"] != "histogram":
+                lines.append(f"{name}{_labels(definition['labels'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(definition["buckets"]) + ["+Inf"], value[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{name}_bucket{_labels(definition['labels'], key, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(definition['labels'], key)} {value[-1]:.6f}")
+            lines.append(f"{name}_count{_labels(definition['labels'], key)} {cumulative}")
+
+    # Rasio hit cache diturunkan dari cache_lookups_total
+    lines.append("# HELP cache_hit_ratio Cache hits / lookups")
+    lines.append("# TYPE cache_hit_ratio gauge")
+    lookups = {}
+    for (cache, result), value in merged.get("cache_lookups_total", {}).items():
+        lookups.setdefault(cache, {"hit": 0, "miss": 0})[result] = value
+    for cache, counts in sorted(lookups.items()):
+        total = counts["hit"] + counts["miss"]
+        if total:
+            lines.append(f'cache_hit_ratio{{cache="{_escape(cache)}"}} {counts["hit"] / total:.4f}')
+    return "\n".join(lines) + "\n"
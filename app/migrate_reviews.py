@@ -0,0 +1,60 @@
+# UAS-PDT/app/migrate_reviews.py
+# Migrasi review dari layout lama (librarydb.reviews: satu dokumen per buku dengan
+# array 'reviews') ke layout baru (librarydb.review_items: satu dokumen per review).
+#
+# Aman dijalankan berulang: setiap review lama diberi legacy_id "<_id dokumen>:<index>"
+# dan ditulis dengan upsert, jadi review yang sudah dimigrasi tidak terduplikasi.
+#
+# Jalankan di dalam kontainer flask_app:
+#   python3 migrate_reviews.py [--batch 1000] [--drop-legacy]
+
+import argparse
+
+from pymongo import UpdateOne, ASCENDING
+
+from db import get_mongo_client
+import reviews
+from indexes import ensure_mongo_indexes
+
+
+def migrate(batch_size, drop_legacy=False):
+    db = get_mongo_client().librarydb
+    legacy = db[reviews.LEGACY_COLLECTION]
+    target = reviews.get_reviews_collection(get_mongo_client())
+    ensure_mongo_indexes()
+    target.create_index([("legacy_id", ASCENDING)], name="legacy_id", unique=True, sparse=True)
+
+    migrated_docs = migrated_reviews = 0
+    operations = []
+    for doc in legacy.find({}, {"book_id": 1, "reviews": 1}, batch_size=100):
+        for index, review in enumerate(doc.get("reviews") or []):
+            legacy_id = f"{doc['_id']}:{index}"
+            item = {
+                "book_id": doc["book_id"],
+                "user_id": review.get("user_id"),
+                "rating": review.get("rating"),
+                "comment": review.get("comment"),
+                "timestamp": review.get("timestamp"),
+                "legacy_id": legacy_id,
+            }
+            operations.append(UpdateOne({"legacy_id": legacy_id}, {"$setOnInsert": item}, upsert=True))
+            migrated_reviews += 1
+            if len(operations) >= batch_size:
+                target.bulk_write(operations, ordered=False)
+                operations = []
+        migrated_docs += 1
+    if operations:
+        target.bulk_write(operations, ordered=False)
+
+    print(f"Migrated {migrated_reviews} reviews from {migrated_docs} book documents into {reviews.REVIEW_ITEMS_COLLECTION}.")
+    if drop_legacy:
+        legacy.drop()
+        print(f"Dropped legacy collection {reviews.LEGACY_COLLECTION}.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert per-book review arrays into one document per review")
+    parser.add_argument("--batch", type=int, default=1000, help="upserts per bulk_write")
+    parser.add_argument("--drop-legacy", action="store_true", help="drop librarydb.reviews after migrating")
+    args = parser.parse_args()
+    migrate(args.batch, args.drop_legacy)
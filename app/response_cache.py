@@ -0,0 +1,92 @@
+# UAS-PDT/app/response_cache.py
+# Cache respons JSON di Redis untuk endpoint yang sering di-poll (katalog dan analitik),
+# dengan dukungan ETag / 304 Not Modified.
+#
+# Setiap cache punya "scope" dengan counter versi di Redis (response_version:{scope}).
+# Operasi yang mengubah data memanggil bump_version(scope): /borrow, /return, /review
+# untuk 'catalog', dan skrip ETL untuk 'analytics'. Key cache dan ETag mengandung versi,
+# jadi entri lama otomatis tidak terpakai lagi setelah versi naik.
+
+import hashlib
+import os
+from functools import wraps
+
+from flask import request, make_response
+import redis
+
+from db import get_redis_client
+
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '300')) # detik
+CATALOG = "catalog"
+ANALYTICS = "analytics"
+
+
+def version_key(scope):
+    return f"response_version:{scope}"
+
+
+def bump_version(scope):
+    # Dipanggil setelah data berhasil di-commit; kegagalan Redis tidak boleh membatalkan
+    # operasinya (entri lama tetap kedaluwarsa lewat TTL)
+    try:
+        return get_redis_client().incr(version_key(scope))
+    except Exception as e:
+        print(f"Error bumping response cache version for {scope}: {e}")
+        return None
+
+
+def _cache_identity():
+    # Path + query string yang sudah diurutkan, supaya ?a=1&b=2 dan ?b=2&a=1 berbagi cache
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    return hashlib.sha1(f"{request.path}?{params}".encode()).hexdigest()[:20]
+
+
+def cached_response(scope, ttl=None):
+    ttl = ttl or RESPONSE_CACHE_TTL
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            r = get_redis_client()
+            try:
+                version = r.get(version_key(scope)) or "0"
+            except redis.RedisError as e:
+                # Redis tidak tersedia: layani tanpa cache (dan tanpa ETag) daripada gagal 500
+                print(f"Response cache unavailable for {scope}: {e}")
+                return f(*args, **kwargs)
+            identity = _cache_identity()
+            etag = f'"{scope}-{version}-{identity}"'
+
+            # Klien sudah punya versi terbaru: cukup satu GET Redis untuk versi
+            if etag in request.headers.get('If-None-Match', ''):
+                response = make_response('', 304)
+                response.headers['ETag'] = etag
+                return response
+
+            cache_key = f"response:{scope}:{version}:{identity}"
+            try:
+                body = r.get(cache_key)
+            except redis.RedisError as e:
+                print(f"Response cache unavailable for {scope}: {e}")
+                return f(*args, **kwargs)
+            if body is not None:
+                response = make_response(body, 200)
+                response.mimetype = 'application/json'
+                response.headers['X-Cache'] = 'HIT'
+            else:
+                response = make_response(f(*args, **kwargs))
+                # Respons terdegradasi (store lain timeout) tidak di-cache agar tidak bertahan sampai TTL
+                if (response.status_code != 200 or response.mimetype != 'application/json'
+                        or response.is_streamed or 'X-Degraded' in response.headers):
+                    return response
+                try:
+                    r.set(cache_key, response.get_data(as_text=True), ex=ttl)
+                except redis.RedisError as e:
+                    # Respons tetap dikirim, hanya tidak tersimpan di cache
+                    print(f"Error storing cached response for {scope}: {e}")
+                response.headers['X-Cache'] = 'MISS'
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
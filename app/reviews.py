@@ -0,0 +1,198 @@
+# UAS-PDT/app/reviews.py
+# Akses review buku di MongoDB yang dipakai bersama oleh endpoint Flask dan skrip ETL.
+#
+# Layout penyimpanan: satu dokumen per review di librarydb.review_items
+#   {book_id, user_id, rating, comment, timestamp}
+# dengan index gabungan (book_id, timestamp, _id), dideklarasikan di indexes.py.
+# Layout lama (satu dokumen per buku dengan array 'reviews' di librarydb.reviews) tumbuh
+# tanpa batas menuju limit 16 MB; konversi data lama lewat migrate_reviews.py.
+
+import base64
+import json
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DESCENDING
+
+REVIEW_ITEMS_COLLECTION = "review_items"
+LEGACY_COLLECTION = "reviews"
+RATING_BUCKETS = ("1", "2", "3", "4", "5")
+REVIEW_PAGE_DEFAULT = int(os.getenv('REVIEW_PAGE_DEFAULT', '20'))
+REVIEW_PAGE_MAX = int(os.getenv('REVIEW_PAGE_MAX', '100'))
+REVIEW_PAGE_CACHE_TTL = int(os.getenv('REVIEW_PAGE_CACHE_TTL', '300')) # detik
+
+
+def get_reviews_collection(mongo_client):
+    return mongo_client.librarydb[REVIEW_ITEMS_COLLECTION] # Asumsi DB bernama 'librarydb'
+
+
+def add_review(reviews_collection, book_id, user_id, rating, comment):
+    # Satu operasi tulis per review, tanpa find_one terlebih dahulu
+    review = {
+        "book_id": book_id,
+        "user_id": user_id,
+        "rating": rating,
+        "comment": comment,
+        "timestamp": datetime.now()
+    }
+    reviews_collection.insert_one(review)
+    review.pop("_id", None)
+    return review
+
+
+def _serialize(doc):
+    return {
+        "user_id": doc.get("user_id"),
+        "rating": doc.get("rating"),
+        "comment": doc.get("comment"),
+        "timestamp": doc["timestamp"].isoformat() if doc.get("timestamp") else None,
+    }
+
+
+def encode_cursor(doc):
+    raw = json.dumps({"ts": doc["timestamp"].isoformat(), "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    # ValueError jika cursor tidak valid
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(data["ts"]), ObjectId(data["id"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def review_page(reviews_collection, book_id, limit, cursor=None):
+    # Satu halaman review terbaru lebih dulu, keyset pada (timestamp, _id) sesuai index
+    # book_id_timestamp, jadi biaya baca sebanding dengan ukuran halaman
+    query = {"book_id": book_id}
+    if cursor:
+        ts, oid = decode_cursor(cursor)
+        query["$or"] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": oid}}]
+    docs = list(
+        reviews_collection.find(query, {"_id": 1, "user_id": 1, "rating": 1, "comment": 1, "timestamp": 1})
+        .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1])
+    return {"book_id": book_id, "reviews": [_serialize(doc) for doc in docs], "next_cursor": next_cursor}
+
+
+def page_version_key(book_id):
+    return f"review_page_version:{book_id}"
+
+
+def page_cache_key(book_id, version):
+    return f"review_page:{book_id}:{version}"
+
+
+def cached_first_page(r, reviews_collection, book_id):
+    # Halaman pertama (ukuran default) per buku di-cache di Redis sebagai JSON. Versi per
+    # buku ada di key (pola yang sama dengan response_cache.py) dan dibaca sebelum query
+    # MongoDB: halaman yang dihitung sebelum add_review menaikkan versi tersimpan di key
+    # versi lama yang tidak dibaca lagi, bukan menimpa cache yang baru.
+    version = r.get(page_version_key(book_id)) or "0"
+    key = page_cache_key(book_id, version)
+    cached = r.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    page = review_page(reviews_collection, book_id, REVIEW_PAGE_DEFAULT)
+    r.set(key, json.dumps(page), ex=REVIEW_PAGE_CACHE_TTL)
+    return page
+
+
+def invalidate_page_cache(r, book_id):
+    r.incr(page_version_key(book_id))
+
+
+def latest_reviews_pipeline(book_ids, per_book):
+    # N review terbaru untuk beberapa buku sekaligus dalam satu aggregation
+    # (dipakai juga oleh jalur async di async_books.py)
+    return [
+        {"$match": {"book_id": {"$in": list(book_ids)}}},
+        {"$group": {
+            "_id": "$book_id",
+            "reviews": {"$topN": {
+                "n": per_book,
+                "sortBy": {"timestamp": -1, "_id": -1},
+                "output": {"user_id": "$user_id", "rating": "$rating", "comment": "$comment", "timestamp": "$timestamp"},
+            }},
+        }},
+    ]
+
+
+def latest_reviews(reviews_collection, book_ids, per_book):
+    pipeline = latest_reviews_pipeline(book_ids, per_book)
+    return {doc["_id"]: doc["reviews"] for doc in reviews_collection.aggregate(pipeline)}
+
+
+def review_stats(reviews_collection, book_ids=None):
+    # Statistik review dihitung di dalam MongoDB ($group), jadi review tidak pernah
+    # dikirim ke aplikasi. Hasil: {book_id: {total_review, avg_rating, histogram,
+    # last_review_at}}; buku tanpa review tidak muncul di hasil.
+    # Bucket histogram = rating dibulatkan ke bawah lalu dibatasi ke 1..5 (RATING_BUCKETS):
+    # 4.5 -> "4", 3.5 -> "3", 0.5 -> "1"; rating non-numerik tidak masuk histogram.
+    pipeline = []
+    if book_ids is not None:
+        pipeline.append({"$match": {"book_id": {"$in": list(book_ids)}}})
+    pipeline += [
+        {"$group": {
+            "_id": {"book_id": "$book_id", "rating": {"$cond": [
+                {"$isNumber": "$rating"},
+                {"$min": [len(RATING_BUCKETS), {"$max": [1, {"$floor": "$rating"}]}]},
+                None,
+            ]}},
+            "count": {"$sum": 1},
+            "rated": {"$sum": {"$cond": [{"$isNumber": "$rating"}, 1, 0]}},
+            "rating_sum": {"$sum": "$rating"},
+            "last_review_at": {"$max": "$timestamp"},
+        }},
+        {"$group": {
+            "_id": "$_id.book_id",
+            "total_review": {"$sum": "$count"},
+            "rated": {"$sum": "$rated"},
+            "rating_sum": {"$sum": "$rating_sum"},
+            "histogram": {"$push": {"rating": "$_id.rating", "count": "$count"}},
+            "last_review_at": {"$max": "$last_review_at"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "book_id": "$_id",
+            "total_review": 1,
+            "avg_rating": {"$cond": [{"$gt": ["$rated", 0]}, {"$divide": ["$rating_sum", "$rated"]}, 0]},
+            "histogram": 1,
+            "last_review_at": 1,
+        }},
+    ]
+
+    stats = {}
+    for doc in reviews_collection.aggregate(pipeline):
+        histogram = {bucket: 0 for bucket in RATING_BUCKETS}
+        for entry in doc["histogram"]:
+            if entry["rating"] is not None:
+                histogram[str(int(entry["rating"]))] += entry["count"]
+        doc["histogram"] = histogram
+        doc["avg_rating"] = round(doc["avg_rating"], 2)
+        stats[doc["book_id"]] = doc
+    return stats
+
+
+def books_reviewed_since(reviews_collection, since):
+    # book_id yang punya review baru sejak watermark ETL (memakai index timestamp)
+    query = {"timestamp": {"$gt": since}} if since else {}
+    return reviews_collection.distinct("book_id", query)
+
+
+def empty_stats(book_id):
+    return {
+        "book_id": book_id,
+        "total_review": 0,
+        "avg_rating": 0.0,
+        "histogram": {bucket: 0 for bucket in RATING_BUCKETS},
+        "last_review_at": None,
+    }
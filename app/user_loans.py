@@ -0,0 +1,207 @@
+# UAS-PDT/app/user_loans.py
+# Pinjaman per user: counter live di Redis dan riwayat pinjaman untuk GET /me/loans.
+#
+# Counter dibentuk dari dua set log_id per user, sehingga setiap event idempoten:
+#   user_loans:{user_id}:all       semua pinjaman      -> total_borrows = SCARD
+#   user_loans:{user_id}:returned  yang sudah kembali  -> active_loans = SCARD(all) - SCARD(returned)
+#   user_loans:{user_id}           penanda bahwa set sudah dimuat dari PG
+# - apply_event()/apply_events(): dipanggil borrow/return setelah commit PG; SADD log_id (Lua), selalu,
+#   juga sebelum set dimuat
+# - get_counters(): baca O(1) untuk banyak user sekaligus; user yang belum dimuat dibaca
+#   sekali dari borrow_logs (index covering per user, lihat indexes.py) lalu digabung
+#   (SADD) ke set yang sama
+# Event yang juga terlihat oleh pemuatan dari PG hanya masuk sekali (anggota set yang
+# sama), dan event yang tiba sebelum atau sesudah pemuatan tetap terhitung, jadi counter
+# tepat tanpa WATCH. Memori sebanding dengan jumlah pinjaman user (intset di Redis).
+# Semua key punya TTL yang diperpanjang setiap event, sehingga selisih akibat kegagalan
+# Redis setelah commit pulih sendiri. Jika Redis tidak tersedia, counter dihitung dari PG.
+
+import base64
+import json
+import os
+from datetime import datetime
+
+import redis
+
+from db import pg_conn, get_redis_client
+
+KEY_PREFIX = "user_loans:"
+COUNTER_TTL = int(os.getenv('USER_LOANS_COUNTER_TTL', '86400')) # detik
+LOAD_BATCH = 1000 # log_id per SADD saat memuat dari PG
+LOANS_PAGE_DEFAULT = int(os.getenv('LOANS_PAGE_DEFAULT', '20'))
+LOANS_PAGE_MAX = int(os.getenv('LOANS_PAGE_MAX', '100'))
+LOAN_STATUSES = ("all", "active", "history")
+
+# KEYS: all, returned, penanda; ARGV: log_id, 1 jika return, TTL
+_APPLY_EVENT_LUA = """
+redis.call('SADD', KEYS[1], ARGV[1])
+if ARGV[2] == '1' then
+    redis.call('SADD', KEYS[2], ARGV[1])
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return 1
+"""
+
+
+def counter_key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def counter_keys(user_id):
+    # Semua key milik satu user (penanda, all, returned); dipakai juga untuk menghapusnya
+    key = counter_key(user_id)
+    return [key, f"{key}:all", f"{key}:returned"]
+
+
+def apply_event(user_id, log_id, returned):
+    # returned=False untuk borrow, True untuk return log_id tersebut
+    apply_events(user_id, [log_id], returned)
+
+
+def apply_events(user_id, log_ids, returned):
+    # Beberapa event sekaligus (POST /borrow/batch) dalam satu pipeline
+    marker, all_key, returned_key = counter_keys(user_id)
+    pipe = get_redis_client().pipeline(transaction=False)
+    for log_id in log_ids:
+        pipe.eval(_APPLY_EVENT_LUA, 3, all_key, returned_key, marker, log_id, 1 if returned else 0, COUNTER_TTL)
+    pipe.execute()
+
+
+def _logs_from_pg(user_ids):
+    # {user_id: [(log_id, sudah_kembali)]} untuk user yang punya pinjaman
+    logs = {}
+    with pg_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT user_id, log_id, returned_at IS NOT NULL FROM borrow_logs WHERE user_id = ANY(%s)",
+            (list(user_ids),)
+        )
+        for user_id, log_id, returned in cur.fetchall():
+            logs.setdefault(user_id, []).append((log_id, returned))
+    return logs
+
+
+def _count_from_pg(user_ids):
+    # {user_id: {active_loans, total_borrows}} langsung dari PG (saat Redis tidak tersedia)
+    counters = {user_id: {"active_loans": 0, "total_borrows": 0} for user_id in user_ids}
+    for user_id, logs in _logs_from_pg(user_ids).items():
+        counters[user_id] = {"active_loans": sum(1 for _, returned in logs if not returned), "total_borrows": len(logs)}
+    return counters
+
+
+def _load(r, user_ids):
+    # Log dari PG digabung ke set (SADD idempoten, event bersamaan tidak tertimpa); penanda
+    # dipasang dalam MULTI yang sama
+    logs = _logs_from_pg(user_ids)
+    with r.pipeline() as pipe:
+        for user_id in user_ids:
+            marker, all_key, returned_key = counter_keys(user_id)
+            user_logs = logs.get(user_id, [])
+            for i in range(0, len(user_logs), LOAD_BATCH):
+                batch = user_logs[i:i + LOAD_BATCH]
+                pipe.sadd(all_key, *[log_id for log_id, _ in batch])
+                returned_ids = [log_id for log_id, returned in batch if returned]
+                if returned_ids:
+                    pipe.sadd(returned_key, *returned_ids)
+            pipe.set(marker, 1)
+            for key in (marker, all_key, returned_key):
+                pipe.expire(key, COUNTER_TTL)
+        pipe.execute()
+
+
+def _read(r, user_ids):
+    # {user_id: (sudah_dimuat, total, returned)} dalam satu pipeline
+    pipe = r.pipeline(transaction=False)
+    for user_id in user_ids:
+        marker, all_key, returned_key = counter_keys(user_id)
+        pipe.exists(marker)
+        pipe.scard(all_key)
+        pipe.scard(returned_key)
+    values = pipe.execute()
+    return {user_id: tuple(values[i * 3:i * 3 + 3]) for i, user_id in enumerate(user_ids)}
+
+
+def get_counters(user_ids):
+    # {user_id: {active_loans, total_borrows}}
+    if not user_ids:
+        return {}
+    try:
+        r = get_redis_client()
+        state = _read(r, user_ids)
+        missing = [user_id for user_id, (loaded, _, _) in state.items() if not loaded]
+        if missing:
+            _load(r, missing)
+            state.update(_read(r, missing))
+    except redis.RedisError as e:
+        print(f"Error reading loan counters, counting from PostgreSQL: {e}")
+        return _count_from_pg(user_ids)
+    return {
+        user_id: {"active_loans": total - returned, "total_borrows": total}
+        for user_id, (_, total, returned) in state.items()
+    }
+
+
+def encode_cursor(borrowed_at, log_id):
+    raw = json.dumps({"ts": borrowed_at.isoformat(), "id": log_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    # ValueError jika cursor tidak valid
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(data["ts"]), int(data["id"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def loan_page(conn, user_id, status, limit, cursor=None):
+    # Pinjaman terbaru lebih dulu, keyset pada (borrowed_at, log_id) sesuai index
+    # borrow_logs_user_borrowed_at_idx. Join ke books co-located (book_id), jadi judul
+    # ikut diambil di shard yang sama.
+    conditions, params = ["bl.user_id = %s"], [user_id]
+    if status == "active":
+        conditions.append("bl.returned_at IS NULL")
+    elif status == "history":
+        conditions.append("bl.returned_at IS NOT NULL")
+    if cursor:
+        ts, log_id = decode_cursor(cursor)
+        conditions.append("(bl.borrowed_at < %s OR (bl.borrowed_at = %s AND bl.log_id < %s))")
+        params += [ts, ts, log_id]
+    params.append(limit + 1)
+
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT bl.log_id, bl.book_id, b.title, bl.borrowed_at, bl.return_at, bl.returned_at,
+               bl.returned_at IS NULL AND bl.return_at < CURRENT_TIMESTAMP AS overdue
+        FROM borrow_logs bl
+        JOIN books b ON b.book_id = bl.book_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bl.borrowed_at DESC, bl.log_id DESC
+        LIMIT %s
+        """,
+        params
+    )
+    rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+    loans = [
+        {
+            "log_id": log_id,
+            "book_id": book_id,
+            "title": title,
+            "borrowed_at": borrowed_at.isoformat() if borrowed_at else None,
+            "return_at": return_at.isoformat() if return_at else None,
+            "returned_at": returned_at.isoformat() if returned_at else None,
+            "status": "active" if returned_at is None else "returned",
+            "overdue": overdue,
+        }
+        for log_id, book_id, title, borrowed_at, return_at, returned_at, overdue in rows
+    ]
+    return loans, next_cursor
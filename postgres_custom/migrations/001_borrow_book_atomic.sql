@@ -0,0 +1,37 @@
+-- UAS-PDT/postgres_custom/migrations/001_borrow_book_atomic.sql
+-- Migrasi untuk library_db yang sudah berjalan (init.sql hanya dieksekusi pada volume baru).
+-- Jalankan: docker compose exec -T library_db psql -U admin -d librarydb < postgres_custom/migrations/001_borrow_book_atomic.sql
+
+ALTER TABLE books ADD COLUMN IF NOT EXISTS quantity INT NOT NULL DEFAULT 1 CHECK (quantity >= 0);
+
+-- Fungsi peminjaman atomik: kurangi quantity hanya jika masih tersedia lalu catat
+-- borrow_logs, semuanya dalam satu panggilan dari aplikasi.
+-- status: 'ok' | 'out_of_stock' | 'not_found'
+CREATE OR REPLACE FUNCTION borrow_book_atomic(p_book_id INT, p_user_id INT, p_return_at TIMESTAMP WITH TIME ZONE)
+RETURNS TABLE (status TEXT, log_id INT, remaining_quantity INT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+    v_quantity INT;
+    v_log_id INT;
+BEGIN
+    UPDATE books SET quantity = books.quantity - 1
+    WHERE books.book_id = p_book_id AND books.quantity > 0
+    RETURNING books.quantity INTO v_quantity;
+
+    IF NOT FOUND THEN
+        IF EXISTS (SELECT 1 FROM books WHERE books.book_id = p_book_id) THEN
+            RETURN QUERY SELECT 'out_of_stock'::TEXT, NULL::INT, 0;
+        ELSE
+            RETURN QUERY SELECT 'not_found'::TEXT, NULL::INT, NULL::INT;
+        END IF;
+        RETURN;
+    END IF;
+
+    INSERT INTO borrow_logs (book_id, user_id, borrowed_at, return_at)
+    VALUES (p_book_id, p_user_id, CURRENT_TIMESTAMP, p_return_at)
+    RETURNING borrow_logs.log_id INTO v_log_id;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_log_id, v_quantity;
+END;
+$$;
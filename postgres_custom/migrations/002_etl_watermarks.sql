@@ -0,0 +1,13 @@
+-- UAS-PDT/postgres_custom/migrations/002_etl_watermarks.sql
+-- Migrasi untuk analytics_db yang sudah berjalan.
+-- Jalankan: docker compose exec -T analytics_db psql -U admin -d analyticsdb < postgres_custom/migrations/002_etl_watermarks.sql
+
+-- Watermark untuk ETL incremental (posisi terakhir yang sudah diproses per job)
+CREATE TABLE IF NOT EXISTS etl_watermarks (
+    job_name VARCHAR(100) PRIMARY KEY,
+    last_log_id BIGINT DEFAULT 0,
+    last_borrowed_at TIMESTAMP WITH TIME ZONE,
+    last_book_id BIGINT DEFAULT 0,
+    last_review_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,9 @@
+-- UAS-PDT/postgres_custom/migrations/003_analytics_report_indexes.sql
+-- Migrasi untuk analytics_db yang sudah berjalan.
+-- Jalankan: docker compose exec -T analytics_db psql -U admin -d analyticsdb < postgres_custom/migrations/003_analytics_report_indexes.sql
+
+-- Index untuk urutan + keyset pagination endpoint /analytics/* (ikut tersalin ke shadow table ETL)
+CREATE INDEX IF NOT EXISTS late_returns_late_days_log_id_idx ON late_returns (late_days DESC, log_id DESC);
+CREATE INDEX IF NOT EXISTS late_returns_user_id_idx ON late_returns (user_id);
+CREATE INDEX IF NOT EXISTS late_returns_book_id_idx ON late_returns (book_id);
+CREATE INDEX IF NOT EXISTS borrows_per_user_total_borrows_user_id_idx ON borrows_per_user (total_borrows DESC, user_id DESC);
@@ -0,0 +1,25 @@
+-- UAS-PDT/postgres_custom/migrations/004_fdw_tuning.sql
+-- Migrasi untuk library_db yang sudah berjalan: tuning postgres_fdw ke analytics_db.
+-- Jalankan: docker compose exec -T library_db psql -U admin -d librarydb < postgres_custom/migrations/004_fdw_tuning.sql
+
+-- fetch_size: baris per FETCH dari server remote (default postgres_fdw hanya 100)
+-- use_remote_estimate: planner meminta estimasi biaya ke analytics_db, sehingga
+-- WHERE/ORDER BY/LIMIT dieksekusi di sana memakai index-nya
+DO $$
+DECLARE
+    opt TEXT[];
+BEGIN
+    FOREACH opt SLICE 1 IN ARRAY ARRAY[['fetch_size', '1000'], ['use_remote_estimate', 'true']] LOOP
+        BEGIN
+            EXECUTE format('ALTER SERVER analytics_server OPTIONS (ADD %I %L)', opt[1], opt[2]);
+        EXCEPTION WHEN duplicate_object THEN
+            EXECUTE format('ALTER SERVER analytics_server OPTIONS (SET %I %L)', opt[1], opt[2]);
+        END;
+    END LOOP;
+END
+$$;
+
+-- Statistik lokal foreign table, dipakai planner bila use_remote_estimate dimatikan
+ANALYZE books_summary;
+ANALYZE borrows_per_user;
+ANALYZE late_returns;
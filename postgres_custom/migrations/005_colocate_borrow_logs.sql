@@ -0,0 +1,33 @@
+-- UAS-PDT/postgres_custom/migrations/005_colocate_borrow_logs.sql
+-- Migrasi untuk library_db yang sudah berjalan: users menjadi reference table dan
+-- borrow_logs didistribusikan ulang berdasarkan book_id, co-located dengan books.
+-- alter_distributed_table menyalin seluruh borrow_logs ke shard baru dan mengunci tabel
+-- selama proses; jalankan saat trafik rendah. Aman dijalankan ulang.
+-- Jalankan: docker compose exec -T library_db psql -U admin -d librarydb -v ON_ERROR_STOP=1 < postgres_custom/migrations/005_colocate_borrow_logs.sql
+--
+-- Ukur sebelum dan sesudah migrasi:
+--   python3 benchmarks/bench_shard_routing.py --label before > before.json
+--   python3 benchmarks/bench_shard_routing.py --label after > after.json
+
+-- 1. users -> reference table (data lokal di coordinator disalin ke semua node)
+SELECT NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid = 'users'::regclass) AS users_is_local \gset
+\if :users_is_local
+SELECT create_reference_table('users');
+\endif
+
+-- 2. borrow_logs: distribusi log_id -> book_id. Primary key harus memuat kolom distribusi
+-- lama maupun baru, jadi diganti dulu menjadi (book_id, log_id)
+SELECT column_to_column_name(logicalrelid, partkey) = 'log_id' AS borrow_logs_by_log_id
+FROM pg_dist_partition WHERE logicalrelid = 'borrow_logs'::regclass \gset
+\if :borrow_logs_by_log_id
+BEGIN;
+ALTER TABLE borrow_logs DROP CONSTRAINT borrow_logs_pkey;
+ALTER TABLE borrow_logs ADD PRIMARY KEY (book_id, log_id);
+COMMIT;
+SELECT alter_distributed_table('borrow_logs', distribution_column := 'book_id', colocate_with := 'books');
+\endif
+
+-- 3. Verifikasi: books dan borrow_logs harus punya colocation_id yang sama
+SELECT table_name, distribution_column, colocation_id, citus_table_type
+FROM citus_tables
+WHERE table_name IN ('books'::regclass, 'borrow_logs'::regclass, 'users'::regclass);
@@ -9,9 +9,13 @@ CREATE EXTENSION postgres_fdw;
 -- Buat SERVER untuk koneksi ke analytics_db
 -- HOST adalah nama service di docker-compose.yml
 -- PORT adalah port PostgreSQL di kontainer analytics_db
+-- fetch_size: baris per FETCH dari server remote (default postgres_fdw hanya 100)
+-- use_remote_estimate: planner meminta estimasi biaya ke analytics_db, sehingga
+-- WHERE/ORDER BY/LIMIT dieksekusi di sana memakai index-nya
 CREATE SERVER analytics_server
     FOREIGN DATA WRAPPER postgres_fdw
-    OPTIONS (host 'analytics_db', port '5432', dbname 'analyticsdb');
+    OPTIONS (host 'analytics_db', port '5432', dbname 'analyticsdb',
+             fetch_size '1000', use_remote_estimate 'true');
 
 -- Buat USER MAPPING untuk server analytics_server
 -- Sesuaikan user dan password dengan yang ada di docker-compose.yml untuk analytics_db
@@ -19,7 +23,8 @@ CREATE USER MAPPING FOR admin
     SERVER analytics_server
     OPTIONS (user 'admin', password 'password');
 
--- Tabel users (distribusi tidak diperlukan, ini adalah lookup table)
+-- Tabel users (lookup table kecil, direplikasi ke semua node sebagai reference table
+-- sehingga join dengan borrow_logs/books tetap dieksekusi lokal di setiap shard)
 CREATE TABLE users (
     user_id SERIAL PRIMARY KEY,
     email VARCHAR(255) UNIQUE NOT NULL,
@@ -27,30 +32,70 @@ CREATE TABLE users (
     role VARCHAR(50) NOT NULL DEFAULT 'mahasiswa' -- 'admin' atau 'mahasiswa'
 );
 
+SELECT create_reference_table('users');
+
 -- Tabel books (akan di-shard)
 CREATE TABLE books (
     book_id SERIAL PRIMARY KEY,
     title VARCHAR(255) NOT NULL,
     author VARCHAR(255) NOT NULL,
     year INT,
-    category VARCHAR(100)
+    category VARCHAR(100),
+    quantity INT NOT NULL DEFAULT 1 CHECK (quantity >= 0) -- Jumlah eksemplar yang tersedia (sumber warm-up cache Redis)
 );
 
 -- Shard tabel books berdasarkan book_id
 SELECT create_distributed_table('books', 'book_id');
 
 -- Tabel borrow_logs (akan di-shard)
+-- Primary key harus memuat kolom distribusi (book_id)
 CREATE TABLE borrow_logs (
-    log_id SERIAL PRIMARY KEY,
+    log_id SERIAL,
     book_id INT NOT NULL,
     user_id INT NOT NULL,
     borrowed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     return_at TIMESTAMP WITH TIME ZONE NOT NULL,
-    returned_at TIMESTAMP WITH TIME ZONE
+    returned_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (book_id, log_id)
 );
 
--- Shard tabel borrow_logs berdasarkan log_id
-SELECT create_distributed_table('borrow_logs', 'log_id');
+-- Shard tabel borrow_logs berdasarkan book_id, co-located dengan books: log peminjaman
+-- satu buku berada di shard yang sama dengan barisnya di books, sehingga /borrow,
+-- /return, dan query per buku hanya menyentuh satu shard
+SELECT create_distributed_table('borrow_logs', 'book_id', colocate_with => 'books');
+
+-- Fungsi peminjaman atomik: kurangi quantity hanya jika masih tersedia lalu catat
+-- borrow_logs, semuanya dalam satu panggilan dari aplikasi. Kedua statement memfilter
+-- book_id yang sama pada tabel yang co-located, jadi Citus merutekannya ke satu shard.
+-- status: 'ok' | 'out_of_stock' | 'not_found'
+CREATE OR REPLACE FUNCTION borrow_book_atomic(p_book_id INT, p_user_id INT, p_return_at TIMESTAMP WITH TIME ZONE)
+RETURNS TABLE (status TEXT, log_id INT, remaining_quantity INT)
+LANGUAGE plpgsql AS $$
+#variable_conflict use_column
+DECLARE
+    v_quantity INT;
+    v_log_id INT;
+BEGIN
+    UPDATE books SET quantity = books.quantity - 1
+    WHERE books.book_id = p_book_id AND books.quantity > 0
+    RETURNING books.quantity INTO v_quantity;
+
+    IF NOT FOUND THEN
+        IF EXISTS (SELECT 1 FROM books WHERE books.book_id = p_book_id) THEN
+            RETURN QUERY SELECT 'out_of_stock'::TEXT, NULL::INT, 0;
+        ELSE
+            RETURN QUERY SELECT 'not_found'::TEXT, NULL::INT, NULL::INT;
+        END IF;
+        RETURN;
+    END IF;
+
+    INSERT INTO borrow_logs (book_id, user_id, borrowed_at, return_at)
+    VALUES (p_book_id, p_user_id, CURRENT_TIMESTAMP, p_return_at)
+    RETURNING borrow_logs.log_id INTO v_log_id;
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_log_id, v_quantity;
+END;
+$$;
 
 -- Buat FOREIGN TABLES untuk mengakses tabel analitik dari analytics_db
 -- Ini memungkinkan library_db melihat data dari analytics_db seolah-olah lokal
@@ -84,8 +129,8 @@ INSERT INTO users (email, password, role) VALUES
 ('Siti@kampus.com', 'siti_pass', 'mahasiswa'),
 ('Jany@kampus.com', 'jany_pass', 'mahasiswa');
 
-INSERT INTO books (title, author, year, category) VALUES
-('The Lord of the Rings', 'J.R.R. Tolkien', 1994, 'Fantasy'),
-('The Hitchhiker''s Guide to the Galaxy', 'T. Egerton', 2002, 'Science Fiction'),
-('Pride and Prejudice', 'Jane Austen', 1983, 'Romance'),
-('Al Quran sebagai Cahaya Ilmu', 'Ust. Basmalah', 2024, 'Spiritual');
\ No newline at end of file
+INSERT INTO books (title, author, year, category, quantity) VALUES
+('The Lord of the Rings', 'J.R.R. Tolkien', 1994, 'Fantasy', 3),
+('The Hitchhiker''s Guide to the Galaxy', 'T. Egerton', 2002, 'Science Fiction', 2),
+('Pride and Prejudice', 'Jane Austen', 1983, 'Romance', 2),
+('Al Quran sebagai Cahaya Ilmu', 'Ust. Basmalah', 2024, 'Spiritual', 5);
\ No newline at end of file
@@ -22,4 +22,20 @@ CREATE TABLE late_returns (
     return_at TIMESTAMP WITH TIME ZONE,
     returned_at TIMESTAMP WITH TIME ZONE,
     late_days INT
-);
\ No newline at end of file
+);
+
+-- Watermark untuk ETL incremental (posisi terakhir yang sudah diproses per job)
+CREATE TABLE IF NOT EXISTS etl_watermarks (
+    job_name VARCHAR(100) PRIMARY KEY,
+    last_log_id BIGINT DEFAULT 0,
+    last_borrowed_at TIMESTAMP WITH TIME ZONE,
+    last_book_id BIGINT DEFAULT 0,
+    last_review_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Index untuk urutan + keyset pagination endpoint /analytics/* (ikut tersalin ke shadow table ETL)
+CREATE INDEX IF NOT EXISTS late_returns_late_days_log_id_idx ON late_returns (late_days DESC, log_id DESC);
+CREATE INDEX IF NOT EXISTS late_returns_user_id_idx ON late_returns (user_id);
+CREATE INDEX IF NOT EXISTS late_returns_book_id_idx ON late_returns (book_id);
+CREATE INDEX IF NOT EXISTS borrows_per_user_total_borrows_user_id_idx ON borrows_per_user (total_borrows DESC, user_id DESC);